@@ -1,21 +1,30 @@
 import datetime
+import time
 import traceback
+from collections import OrderedDict, defaultdict
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
-from django.contrib.auth.models import User
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template import loader
 from django.utils.timezone import now
 
-from cl.alerts.models import FREQUENCY, RealTimeQueue, ITEM_TYPES
-from cl.lib import search_utils
+from cl.alerts.models import Alert, FREQUENCY, RealTimeQueue, ITEM_TYPES
+from cl.alerts.utils import add_cut_off_date, compile_alert_query, \
+    get_alert_query_key, percolate
 from cl.lib.command_utils import VerboseCommand, logger
 from cl.lib.scorched_utils import ExtraSolrInterface
 from cl.lib.search_utils import regroup_snippets
-from cl.search.forms import SearchForm
 from cl.stats.utils import tally_stat
 
 
+# How many distinct alert queries to run at once.
+ALERT_QUERY_WORKERS = 8
+
+# How many emails to send over each SMTP connection.
+EMAIL_BATCH_SIZE = 100
+
+
 class InvalidDateError(Exception):
     pass
 
@@ -46,7 +55,13 @@ def get_cut_off_date(rate, d=datetime.date.today()):
     return cut_off_date
 
 
-def send_alert(user_profile, hits, simulate):
+def make_alert_message(user_profile, hits):
+    """Render the email for a user's hits.
+
+    :param user_profile: The UserProfile of the user to send the email to.
+    :param hits: A list of [alert, alert_type, results] lists.
+    :return: An EmailMultiAlternatives object, ready to send.
+    """
     email_subject = 'New hits for your CourtListener alerts'
     email_sender = 'CourtListener Alerts <alerts@courtlistener.com>'
 
@@ -58,8 +73,19 @@ def send_alert(user_profile, hits, simulate):
     msg = EmailMultiAlternatives(email_subject, txt, email_sender,
                                  [user_profile.user.email])
     msg.attach_alternative(html, "text/html")
-    if not simulate:
-        msg.send(fail_silently=False)
+    return msg
+
+
+def send_alert_messages(messages, batch_size=EMAIL_BATCH_SIZE):
+    """Send alert emails in batches, each over a single connection.
+
+    :param messages: An iterable of email messages.
+    :param batch_size: How many messages to send per connection.
+    """
+    messages = list(messages)
+    for i in range(0, len(messages), batch_size):
+        connection = get_connection(fail_silently=False)
+        connection.send_messages(messages[i:i + batch_size])
 
 
 class Command(VerboseCommand):
@@ -74,6 +100,8 @@ class Command(VerboseCommand):
         }
         self.options = {}
         self.valid_ids = {}
+        self.compiled_queries = {}
+        self.matches = {}
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -94,46 +122,31 @@ class Command(VerboseCommand):
     def run_query(self, alert, rate):
         results = []
         error = False
-        cd = {}
+        alert_type = None
         try:
             logger.info("Now running the query: %s\n" % alert.query)
-
-            # Set up the data
-            data = search_utils.get_string_to_dict(alert.query)
-            try:
-                del data['filed_before']
-            except KeyError:
-                pass
-            data['order_by'] = 'score desc'
-            logger.info("  Data sent to SearchForm is: %s\n" % data)
-            search_form = SearchForm(data)
-            if search_form.is_valid():
-                cd = search_form.cleaned_data
-
-                if rate == 'rt' and len(self.valid_ids[cd['type']]) == 0:
-                    # Bail out. No results will be found if no valid_ids.
-                    return error, cd['type'], results
-
-                cut_off_date = get_cut_off_date(rate)
-                if cd['type'] == 'o':
-                    cd['filed_after'] = cut_off_date
-                elif cd['type'] == 'oa':
-                    cd['argued_after'] = cut_off_date
-                main_params = search_utils.build_main_query(cd, facet=False)
-                main_params.update({
-                    'rows': '20',
-                    'start': '0',
-                    'hl.tag.pre': '<em><strong>',
-                    'hl.tag.post': '</strong></em>',
-                    'caller': 'cl_send_alerts',
-                })
-
+            key = get_alert_query_key(alert.query)
+            compiled = self.compiled_queries.get(key)
+            if compiled is None:
+                compiled = compile_alert_query(alert.query)
+                self.compiled_queries[key] = compiled
+            alert_type = compiled['type']
+            if alert_type is not None:
+                if rate == 'rt':
+                    matched_ids = self.matches.get(key)
+                    if not matched_ids:
+                        # Bail out. The percolator found no new items that
+                        # match, so there's no need to ask Solr.
+                        return error, alert_type, results
+
+                main_params = add_cut_off_date(compiled['params'], alert_type,
+                                               get_cut_off_date(rate))
                 if rate == 'rt':
                     main_params['fq'].append('id:(%s)' % ' OR '.join(
-                        [str(i) for i in self.valid_ids[cd['type']]]
+                        [str(i) for i in sorted(matched_ids)]
                     ))
                 results = self.connections[
-                    cd['type']
+                    alert_type
                 ].query().add_extra(
                     **main_params
                 ).execute()
@@ -142,7 +155,7 @@ class Command(VerboseCommand):
             else:
                 logger.info("  Query for alert %s was invalid\n"
                             "  Errors from the SearchForm: %s\n" %
-                            (alert.query, search_form.errors))
+                            (alert.query, compiled['errors']))
                 error = True
         except:
             traceback.print_exc()
@@ -152,58 +165,128 @@ class Command(VerboseCommand):
 
         logger.info("  There were %s results\n" % len(results))
 
-        return error, cd.get('type'), results
+        return error, alert_type, results
+
+    def percolate_new_items(self):
+        """Check every real time alert against the new items at once, and
+        remember which alerts matched which items.
+
+        Alerts are compiled once per distinct query, and then checked in
+        batches, so only the alerts that matched something need to be run
+        individually.
+        """
+        queries_by_type = defaultdict(dict)
+        cut_off_date = get_cut_off_date('rt')
+        queries = Alert.objects.filter(rate='rt').values_list(
+            'query', flat=True).distinct()
+        for query in queries:
+            key = get_alert_query_key(query)
+            compiled = compile_alert_query(query)
+            self.compiled_queries[key] = compiled
+            alert_type = compiled['type']
+            if self.valid_ids.get(alert_type):
+                queries_by_type[alert_type][key] = add_cut_off_date(
+                    compiled['params'], alert_type, cut_off_date)
+
+        for alert_type, compiled_queries in queries_by_type.items():
+            matches = percolate(self.connections[alert_type], compiled_queries,
+                                self.valid_ids[alert_type])
+            logger.info("Percolated %s distinct '%s' alerts against %s new "
+                        "items. %s matched." %
+                        (len(compiled_queries), alert_type,
+                         len(self.valid_ids[alert_type]), len(matches)))
+            self.matches.update(matches)
 
     def send_emails(self, rate):
         """Send out an email to every user whose alert has a new hit for a
         rate.
-        """
-        users = User.objects.filter(
-            alerts__rate=rate,
-        ).distinct()
-
-        alerts_sent_count = 0
-        for user in users:
-            alerts = user.alerts.filter(rate=rate)
-            logger.info("\n\nAlerts for user '%s': %s\n"
-                        "%s\n" % (user, alerts, '*' * 40))
 
-            not_donated_enough = user.profile.total_donated_last_year < \
-                settings.MIN_DONATION['rt_alerts']
-            if not_donated_enough and rate == 'rt':
-                logger.info('\n\nUser: %s has not donated enough for their %s '
-                            'RT alerts to be sent.\n' % (user, len(alerts)))
+        Alerts are grouped by their normalized query, each distinct query is
+        run once on a pool of workers, and the results are shared by every
+        alert that has that query. Emails are then rendered and sent in
+        batches.
+        """
+        timings = OrderedDict()
+        t = time.time()
+        alerts = Alert.objects.filter(rate=rate).select_related(
+            'user__profile').order_by('user_id', 'query')
+        alerts_by_user = OrderedDict()
+        alerts_by_key = OrderedDict()
+        for alert in alerts:
+            user = alert.user
+            if rate == 'rt' and user.profile.total_donated_last_year < \
+                    settings.MIN_DONATION['rt_alerts']:
+                logger.info('\n\nUser: %s has not donated enough for their '
+                            'RT alert to be sent: %s\n' % (user, alert))
                 continue
-
+            alerts_by_user.setdefault(user, []).append(alert)
+            key = get_alert_query_key(alert.query)
+            alerts_by_key.setdefault(key, alert)
+            if key not in self.compiled_queries:
+                # Compile here, so the workers don't need the database.
+                self.compiled_queries[key] = compile_alert_query(alert.query)
+        alert_count = sum(len(a) for a in alerts_by_user.values())
+        timings['load'] = time.time() - t
+
+        # Run each distinct query once.
+        t = time.time()
+        pool = ThreadPool(ALERT_QUERY_WORKERS)
+        try:
+            query_results = dict(zip(alerts_by_key.keys(), pool.map(
+                lambda alert: self.run_query(alert, rate),
+                alerts_by_key.values(),
+            )))
+        finally:
+            pool.close()
+            pool.join()
+        timings['query'] = time.time() - t
+
+        # Fan the results out to the users that have each query.
+        t = time.time()
+        messages = []
+        hit_alert_pks = []
+        for user, user_alerts in alerts_by_user.items():
+            logger.info("\n\nAlerts for user '%s': %s\n"
+                        "%s\n" % (user, user_alerts, '*' * 40))
             hits = []
-            for alert in alerts:
-                error, alert_type, results = self.run_query(alert, rate)
+            for alert in user_alerts:
+                error, alert_type, results = query_results[
+                    get_alert_query_key(alert.query)]
                 if error:
                     continue
 
                 # hits is a multi-dimensional array. It consists of alerts,
                 # paired with a list of document dicts, of the form:
                 # [[alert1, [{hit1}, {hit2}, {hit3}]], [alert2, ...]]
-                try:
-                    if len(results) > 0:
-                        hits.append([alert, alert_type, results])
-                        alert.date_last_hit = now()
-                        alert.save()
-                except Exception as e:
-                    traceback.print_exc()
-                    logger.info("  Search failed on this alert: %s\n%s\n" %
-                                (alert.query, e))
+                if len(results) > 0:
+                    hits.append([alert, alert_type, results])
+                    hit_alert_pks.append(alert.pk)
 
             if len(hits) > 0:
-                alerts_sent_count += 1
-                send_alert(user.profile, hits, self.options['simulate'])
+                messages.append(make_alert_message(user.profile, hits))
             elif self.options['verbosity'] >= 1:
                 logger.info("  No hits. Not sending mail for this cl.\n")
+        Alert.objects.filter(pk__in=hit_alert_pks).update(date_last_hit=now())
+        timings['render'] = time.time() - t
 
+        t = time.time()
+        if not self.options['simulate']:
+            send_alert_messages(messages)
+        timings['send'] = time.time() - t
+
+        logger.info(
+            "Ran %s distinct queries for %s %s alerts (%.0f%% of alerts "
+            "shared another alert's results). Timings: %s." % (
+                len(alerts_by_key), alert_count, rate,
+                100.0 * (alert_count - len(alerts_by_key)) /
+                max(alert_count, 1),
+                ', '.join(['%s %.1fs' % (stage, seconds) for stage, seconds
+                           in timings.items()]),
+            ))
         if not self.options['simulate']:
-            tally_stat('alerts.sent.%s' % rate, inc=alerts_sent_count)
+            tally_stat('alerts.sent.%s' % rate, inc=len(messages))
             logger.info("Sent %s %s email alerts." %
-                        (alerts_sent_count, rate))
+                        (len(messages), rate))
 
     def clean_rt_queue(self):
         """Clean out any items in the RealTime queue once they've been run or
@@ -263,6 +346,7 @@ class Command(VerboseCommand):
         if options['rate'] == 'rt':
             self.remove_stale_rt_items()
             self.valid_ids = self.get_new_ids()
+            self.percolate_new_items()
 
         if options['simulate']:
             logger.info("******************************************\n"
@@ -1,9 +1,13 @@
+import datetime
+
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
-from django.test import Client, TestCase
+from django.test import Client, SimpleTestCase, TestCase
 from timeout_decorator import timeout_decorator
 
 from cl.alerts.models import Alert
+from cl.alerts.utils import add_cut_off_date, compile_alert_query, \
+    get_alert_query_key, make_percolator_field
 from cl.tests.base import BaseSeleniumTest, SELENIUM_TIMEOUT
 
 
@@ -40,6 +44,57 @@ class AlertTest(TestCase):
         self.client.logout()
 
 
+class AlertCompilerTest(TestCase):
+    fixtures = ['test_court.json']
+
+    def test_compiling_an_alert(self):
+        """Are an alert's own dates replaced by the cut off date?"""
+        compiled = compile_alert_query(
+            'q=foo&type=o&filed_before=2000-01-01&court=test')
+        self.assertEqual(compiled['type'], 'o')
+        params = add_cut_off_date(compiled['params'], 'o',
+                                  datetime.date(2017, 1, 1))
+        self.assertIn('dateFiled:[2017-01-01T00:00:00Z TO *]', params['fq'])
+        self.assertNotIn('2000-01-01', ' '.join(params['fq']))
+        # The compiled params weren't changed.
+        self.assertNotIn('dateFiled:[2017-01-01T00:00:00Z TO *]',
+                         compiled['params']['fq'])
+
+
+class AlertQueryKeyTest(SimpleTestCase):
+
+    def test_equivalent_queries_share_a_key(self):
+        """Do queries that run the same search get the same key?"""
+        self.assertEqual(
+            get_alert_query_key('q=foo&type=o&order_by=dateFiled+desc'),
+            get_alert_query_key('type=o&q=foo+&court=&page=2'),
+        )
+        self.assertNotEqual(get_alert_query_key('q=foo&type=o'),
+                            get_alert_query_key('q=foo&type=oa'))
+
+
+class PercolatorFieldTest(SimpleTestCase):
+
+    def test_making_a_percolator_field(self):
+        """Do the query and filters of an alert become one function?"""
+        fl, extra = make_percolator_field('a1', {
+            'q': 'foo',
+            'qf': 'text',
+            'fq': ['court_exact:(test)',
+                   "{!collapse field=cluster_id sort='type asc'}"],
+        })
+        self.assertEqual(
+            fl,
+            'a1:and(exists(query({!edismax qf=$a1_qf v=$a1_q})),'
+            'exists(query({!query v=$a1_fq0})))'
+        )
+        self.assertEqual(extra, {
+            'a1_q': 'foo',
+            'a1_qf': 'text',
+            'a1_fq0': 'court_exact:(test)',
+        })
+
+
 class AlertSeleniumTest(BaseSeleniumTest):
     fixtures = ['test_court.json', 'authtest_data.json']
 
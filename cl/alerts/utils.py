@@ -0,0 +1,191 @@
+import hashlib
+import logging
+
+from django.core.cache import cache
+
+from cl.lib import search_utils
+from cl.lib.search_utils import make_date_query
+from cl.search.forms import SearchForm
+
+logger = logging.getLogger(__name__)
+
+# Bump this when build_main_query changes so that stale compiled queries are
+# ignored.
+ALERT_QUERY_CACHE_VERSION = 1
+ALERT_QUERY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Params that are replaced when an alert is run. The dates are replaced by
+# the cut off date.
+IGNORED_ALERT_PARAMS = ('order_by', 'page', 'filed_before', 'filed_after',
+                        'argued_after')
+
+# How many alerts to check against the new documents per Solr request.
+PERCOLATOR_BATCH_SIZE = 50
+
+
+def normalize_alert_query(query):
+    """Put an alert's query string in a canonical form, so that alerts that
+    would run the same search compare equal.
+
+    Params are sorted, blank ones are dropped, and the ones that are replaced
+    when an alert is run (its ordering, page and dates) are removed.
+
+    :param query: The query string of an Alert, like 'q=foo&type=o'.
+    :return: The normalized query string.
+    """
+    data = search_utils.get_string_to_dict(query)
+    return u'&'.join([u'%s=%s' % (k, v.strip()) for k, v in
+                      sorted(data.items()) if
+                      k not in IGNORED_ALERT_PARAMS and v.strip()])
+
+
+def get_alert_query_key(query):
+    """Get the key that identifies an alert query, no matter who saved it."""
+    return hashlib.md5(
+        normalize_alert_query(query).encode('utf-8')).hexdigest()
+
+
+def compile_alert_query(query):
+    """Validate an alert's query and turn it into Solr params.
+
+    This is the slow part of running an alert, so the result is cached by the
+    hash of the query and shared by everybody that has the same alert.
+
+    :param query: The query string of an Alert, like 'q=foo&type=o'.
+    :return: A dict with the search type ('o' or 'oa') and the Solr params.
+    The params don't include the alert's cut off date; add it with
+    add_cut_off_date. If the query is invalid, the dict has the errors
+    instead.
+    """
+    cache_key = 'alert-query:%s:%s' % (ALERT_QUERY_CACHE_VERSION,
+                                       get_alert_query_key(query))
+    compiled = cache.get(cache_key)
+    if compiled is not None:
+        return compiled
+
+    data = search_utils.get_string_to_dict(query)
+    for param in IGNORED_ALERT_PARAMS:
+        data.pop(param, None)
+    data['order_by'] = 'score desc'
+    search_form = SearchForm(data)
+    if search_form.is_valid():
+        cd = search_form.cleaned_data
+        main_params = search_utils.build_main_query(cd, facet=False)
+        main_params['fq'] = [fq for fq in main_params.get('fq', []) if fq]
+        main_params.update({
+            'rows': '20',
+            'start': '0',
+            'hl.tag.pre': '<em><strong>',
+            'hl.tag.post': '</strong></em>',
+            'caller': 'cl_send_alerts',
+        })
+        compiled = {'type': cd['type'], 'params': main_params}
+    else:
+        compiled = {'type': None, 'errors': dict(search_form.errors)}
+    cache.set(cache_key, compiled, ALERT_QUERY_CACHE_TIMEOUT)
+    return compiled
+
+
+def add_cut_off_date(params, search_type, cut_off_date):
+    """Copy compiled Solr params, limiting them to items after a date.
+
+    :param params: Solr params from compile_alert_query.
+    :param search_type: The type of the search ('o' or 'oa').
+    :param cut_off_date: The date after which items are new.
+    :return: A new dict of Solr params.
+    """
+    params = params.copy()
+    date_field = 'dateArgued' if search_type == 'oa' else 'dateFiled'
+    params['fq'] = params['fq'] + [make_date_query(date_field, None,
+                                                   cut_off_date)]
+    return params
+
+
+def make_percolator_field(alias, params):
+    """Make a pseudo-field that says whether a document matches an alert.
+
+    The alert's main query and each of its filters become a query() function,
+    and the field is true when all of them match. Because functions are only
+    evaluated for the documents that are returned, checking an alert this way
+    costs about the same no matter how big the index is.
+
+    :param alias: The name of the field in the results, and the prefix of
+    the params it needs. Must be a valid param name.
+    :param params: Solr params from compile_alert_query.
+    :return: A tuple of the fl entry and a dict of the params it refers to.
+    """
+    extra = {}
+    local_params = []
+    for name in ['qf', 'pf', 'ps']:
+        if name in params:
+            extra['%s_%s' % (alias, name)] = params[name]
+            local_params.append('%s=$%s_%s' % (name, alias, name))
+    extra['%s_q' % alias] = params['q']
+    clauses = ['exists(query({!edismax %s v=$%s_q}))' % (
+        ' '.join(local_params), alias)]
+    for i, fq in enumerate(params['fq']):
+        if fq.startswith('{!collapse'):
+            # A post filter, not a query. It only groups results.
+            continue
+        extra['%s_fq%s' % (alias, i)] = fq
+        clauses.append('exists(query({!query v=$%s_fq%s}))' % (alias, i))
+    if len(clauses) == 1:
+        fl = '%s:%s' % (alias, clauses[0])
+    else:
+        fl = '%s:and(%s)' % (alias, ','.join(clauses))
+    return fl, extra
+
+
+def percolate(conn, compiled_queries, ids, batch_size=PERCOLATOR_BATCH_SIZE):
+    """Find which of many alert queries match some new documents.
+
+    Instead of running every alert against the index, the new documents are
+    fetched once per batch of alerts with a pseudo-field for each alert that
+    says whether the document matches it. The number of requests depends on
+    the number of distinct alerts divided by the batch size, and the work
+    Solr does per request depends on the number of new documents.
+
+    :param conn: An ExtraSolrInterface for the core the documents are in.
+    :param compiled_queries: A dict mapping query keys to Solr params from
+    compile_alert_query.
+    :param ids: The IDs of the new documents.
+    :param batch_size: How many alerts to check per request.
+    :return: A dict mapping the query keys that matched to the sets of
+    document IDs that they matched.
+    """
+    matches = {}
+    if not ids:
+        return matches
+    keys = sorted(compiled_queries.keys())
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        aliases = {}
+        fls = ['id']
+        params = {}
+        for i, key in enumerate(batch):
+            alias = 'a%s' % i
+            aliases[alias] = key
+            fl, extra = make_percolator_field(alias, compiled_queries[key])
+            fls.append(fl)
+            params.update(extra)
+        params.update({
+            'q': '*',
+            'fq': ['id:(%s)' % ' OR '.join([str(pk) for pk in ids])],
+            'fl': ','.join(fls),
+            'rows': len(ids),
+            'caller': 'cl_send_alerts',
+        })
+        try:
+            results = conn.query().add_extra(**params).execute()
+        except Exception:
+            # Don't lose every alert in the batch to one bad query. Assume
+            # they all match, so they're run the usual way.
+            logger.warning("Unable to percolate alerts: %s" % batch)
+            for key in batch:
+                matches[key] = set(ids)
+            continue
+        for doc in results.result.docs:
+            for alias, key in aliases.items():
+                if doc.get(alias):
+                    matches.setdefault(key, set()).add(int(doc['id']))
+    return matches
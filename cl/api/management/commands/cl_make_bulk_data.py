@@ -3,8 +3,10 @@ import shutil
 from os.path import join
 
 from django.conf import settings
+from django.core.management import CommandError
 
-from cl.api.tasks import make_bulk_data_and_swap_it_in
+from cl.api.tasks import make_bulk_data_and_swap_it_in, \
+    make_streamed_bulk_data_and_swap_it_in
 from cl.audio.api_serializers import AudioSerializer
 from cl.audio.models import Audio
 from cl.lib.command_utils import VerboseCommand, logger
@@ -22,8 +24,43 @@ from cl.search.models import Court, Docket, OpinionCluster, Opinion
 class Command(VerboseCommand):
     help = 'Create the bulk files for all jurisdictions and for "all".'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            default=False,
+            help="Serialize everything straight into the compressed archives "
+                 "instead of writing a JSON file per item and tarring them "
+                 "up afterwards. Courts are exported in parallel. This always "
+                 "does a full export.",
+        )
+        parser.add_argument(
+            '--jsonl',
+            action='store_true',
+            default=False,
+            help="With --stream, write gzipped JSON-lines files (one item "
+                 "per line) instead of tar.gz archives.",
+        )
+        parser.add_argument(
+            '--deltas',
+            action='store_true',
+            default=False,
+            help="Once full archives exist, publish only the items changed "
+                 "since the last run, as a delta archive listed in each "
+                 "type's manifest.json, instead of rebuilding the full "
+                 "archives. Not compatible with --stream.",
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            help="With --stream, the number of courts to export at once. "
+                 "Defaults to the number of CPUs.",
+        )
+
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
+        if options['stream'] and options['deltas']:
+            raise CommandError("--stream and --deltas can't be used together.")
         courts = Court.objects.all()
 
         kwargs_list = [
@@ -98,7 +135,14 @@ class Command(VerboseCommand):
         logger.info('Starting bulk file creation with %s celery tasks...' %
                     len(kwargs_list))
         for kwargs in kwargs_list:
-            make_bulk_data_and_swap_it_in(courts, kwargs)
+            if options['stream']:
+                make_streamed_bulk_data_and_swap_it_in(
+                    courts, kwargs, jsonl=options['jsonl'],
+                    processes=options['processes'],
+                )
+            else:
+                make_bulk_data_and_swap_it_in(courts, kwargs,
+                                              deltas=options['deltas'])
 
         # Make the citation bulk data
         obj_type_str = 'citations'
@@ -1,37 +1,117 @@
 import glob
+import gzip
 import os
 import shutil
 import tarfile
+import time
+from StringIO import StringIO
+from multiprocessing import Pool
 from os.path import join
 
 from django.conf import settings
+from django.db import connections
 from django.test import RequestFactory
+from django.utils.timezone import now
 from rest_framework.renderers import JSONRenderer
 from rest_framework.versioning import URLPathVersioning
 
-from cl.api.utils import BulkJsonHistory
+from cl.api.utils import BulkJsonHistory, BulkDeltaManifest
 from cl.celery import app
-from cl.lib.db_tools import queryset_generator
+from cl.lib.db_tools import queryset_generator, stream_queryset
 from cl.lib.timer import print_timing
 from cl.lib.utils import deepgetattr, mkdir_p
 
 
 @app.task
 @print_timing
-def make_bulk_data_and_swap_it_in(courts, kwargs):
-    """We can't wrap the handle() function, but we can wrap this one."""
+def make_bulk_data_and_swap_it_in(courts, kwargs, deltas=False):
+    """We can't wrap the handle() function, but we can wrap this one.
 
-    print(' - Creating bulk %s files...' % kwargs['obj_type_str'])
+    If deltas is True and full archives have already been published, only
+    the items changed since the last run are written, into a delta archive
+    that's added to the manifest, instead of rebuilding the full archives.
+    """
+    obj_type_str = kwargs['obj_type_str']
+    if deltas:
+        since = BulkJsonHistory(obj_type_str).get_last_good_date()
+        manifest = BulkDeltaManifest(obj_type_str)
+        if since is not None and manifest.json.get('full') is not None:
+            print(' - Creating bulk %s delta...' % obj_type_str)
+            make_bulk_delta(courts, kwargs, manifest, since)
+            return
+
+    print(' - Creating bulk %s files...' % obj_type_str)
     num_written = write_json_to_disk(courts, **kwargs)
 
     if num_written > 0:
-        print('   - Tarring and compressing all %s files...' %
-              kwargs['obj_type_str'])
-        targz_json_files(courts, kwargs['obj_type_str'], kwargs['court_attr'])
+        print('   - Tarring and compressing all %s files...' % obj_type_str)
+        targz_json_files(courts, obj_type_str, kwargs['court_attr'])
+
+        print('   - Swapping in the new %s archives...' % obj_type_str)
+        swap_archives(obj_type_str)
+        mark_full_build(obj_type_str, create=deltas)
+
+
+def make_bulk_delta(courts, kwargs, manifest, since):
+    """Write the items changed since the last run into a delta archive and
+    publish it in the manifest.
+
+    The per-item files are still updated, so the next full build is correct,
+    but nothing else is re-tarred, so this costs time in proportion to the
+    number of changes.
+    """
+    obj_type_str = kwargs['obj_type_str']
+    until = now()
+    file_name = 'deltas/%s.tar.gz' % until.strftime('%Y-%m-%dT%H%M%S')
+    tmp_path = join(settings.BULK_DATA_DIR, 'tmp', obj_type_str, file_name)
+    mkdir_p(os.path.dirname(tmp_path))
+    tar = tarfile.open(tmp_path, 'w:gz', compresslevel=3)
+    try:
+        num_written = write_json_to_disk(courts, delta_tar=tar, **kwargs)
+    finally:
+        tar.close()
+
+    if num_written == 0:
+        os.remove(tmp_path)
+        return
+    print('   - Publishing the %s delta...' % obj_type_str)
+    final_path = join(settings.BULK_DATA_DIR, obj_type_str, file_name)
+    mkdir_p(os.path.dirname(final_path))
+    shutil.move(tmp_path, final_path)
+    manifest.add_delta_and_save(file_name, since, until, num_written)
+
 
+@print_timing
+def make_streamed_bulk_data_and_swap_it_in(courts, kwargs, jsonl=False,
+                                           processes=None):
+    """Like make_bulk_data_and_swap_it_in, but stream the serialized items
+    straight into the archives instead of writing a file per item first.
+
+    This always exports everything, with one worker process per court at a
+    time.
+    """
+    print(' - Streaming bulk %s archives...' % kwargs['obj_type_str'])
+    num_written = stream_json_to_archives(courts, jsonl=jsonl,
+                                          processes=processes, **kwargs)
+    if num_written > 0:
         print('   - Swapping in the new %s archives...' %
               kwargs['obj_type_str'])
         swap_archives(kwargs['obj_type_str'])
+        mark_full_build(kwargs['obj_type_str'])
+
+
+def mark_full_build(obj_type_str, create=False):
+    """Note in the delta manifest that new full archives were swapped in.
+
+    This must follow every full build, or mirrors would apply the deltas made
+    before it over the newer archives.
+
+    :param obj_type_str: The type of the archives, like 'opinions'.
+    :param create: Whether to make the manifest if there isn't one yet.
+    """
+    manifest = BulkDeltaManifest(obj_type_str)
+    if create or os.path.isfile(manifest.path):
+        manifest.mark_full_and_save(now())
 
 
 def swap_archives(obj_type_str):
@@ -39,7 +119,9 @@ def swap_archives(obj_type_str):
     mkdir_p(join(settings.BULK_DATA_DIR, obj_type_str))
     path_to_gz_files = join(settings.BULK_DATA_DIR, 'tmp', obj_type_str,
                             '*.tar*')
-    for f in glob.glob(path_to_gz_files):
+    path_to_jsonl_files = join(settings.BULK_DATA_DIR, 'tmp', obj_type_str,
+                               '*.jsonl.gz')
+    for f in glob.glob(path_to_gz_files) + glob.glob(path_to_jsonl_files):
         shutil.move(
             f,
             join(settings.BULK_DATA_DIR, obj_type_str, os.path.basename(f))
@@ -103,14 +185,28 @@ def targz_json_files(courts, obj_type_str, court_attr):
         tar.close()
 
 
+def make_serializer_context():
+    """Make the context the API serializers need to render URLs the way they
+    would in the API.
+    """
+    r = RequestFactory().request()
+    r.META['SERVER_NAME'] = 'www.courtlistener.com'  # Else, it's testserver
+    r.version = 'v3'
+    r.versioning_scheme = URLPathVersioning()
+    return dict(request=r)
+
+
 def write_json_to_disk(courts, obj_type_str, obj_type, court_attr,
-                       serializer):
+                       serializer, delta_tar=None):
     """Write all items to disk as json files inside directories named by
     jurisdiction.
 
     The main trick is that we identify if we are creating a bulk archive
     from scratch. If so, we iterate over everything. If not, we only
     iterate over items that have been modified since the last good date.
+
+    If delta_tar is an open tarfile, every item written is added to it as
+    well, at the same path it has relative to the type's directory.
     """
     # Are there already bulk files?
     history = BulkJsonHistory(obj_type_str)
@@ -149,11 +245,7 @@ def write_json_to_disk(courts, obj_type_str, obj_type, court_attr,
 
         i = 0
         renderer = JSONRenderer()
-        r = RequestFactory().request()
-        r.META['SERVER_NAME'] = 'www.courtlistener.com'  # Else, it's testserver
-        r.version = 'v3'
-        r.versioning_scheme = URLPathVersioning()
-        context = dict(request=r)
+        context = make_serializer_context()
         for item in item_list:
             json_str = renderer.render(
                 serializer(item, context=context).data,
@@ -170,9 +262,113 @@ def write_json_to_disk(courts, obj_type_str, obj_type, court_attr,
 
             with open(loc, 'wb') as f:
                 f.write(json_str)
+            if delta_tar is not None:
+                info = tarfile.TarInfo(os.path.relpath(loc, join(
+                    settings.BULK_DATA_DIR, 'tmp', obj_type_str)))
+                info.size = len(json_str)
+                info.mtime = time.time()
+                delta_tar.addfile(info, StringIO(json_str))
             i += 1
 
         print ('   - %s %s json files created.' % (i, obj_type_str))
 
         history.mark_success_and_save()
         return i
+
+
+def stream_archive(path, qs, serializer, jsonl=False):
+    """Serialize every item in a queryset straight into a compressed archive.
+
+    :param path: Where to write the archive, without its extension.
+    :param qs: The items to serialize.
+    :param serializer: The API serializer class for the items.
+    :param jsonl: If True, write a gzipped JSON-lines file, with one item per
+    line. Otherwise, write a tar.gz with one JSON file per item, like the
+    archives made by targz_json_files.
+    :return: The number of items written.
+    """
+    renderer = JSONRenderer()
+    context = make_serializer_context()
+    item_list = stream_queryset(qs, report_every=None)
+
+    i = 0
+    if jsonl:
+        with gzip.open('%s.jsonl.gz' % path, 'wb', compresslevel=3) as f:
+            for item in item_list:
+                data = serializer(item, context=context).data
+                f.write(renderer.render(data) + '\n')
+                i += 1
+        return i
+
+    tar = tarfile.open('%s.tar.gz' % path, 'w:gz', compresslevel=3)
+    mtime = time.time()
+    for item in item_list:
+        json_str = renderer.render(
+            serializer(item, context=context).data,
+            accepted_media_type='application/json; indent=2',
+        )
+        info = tarfile.TarInfo('%s.json' % item.pk)
+        info.size = len(json_str)
+        info.mtime = mtime
+        tar.addfile(info, StringIO(json_str))
+        i += 1
+    tar.close()
+    return i
+
+
+def _stream_court_archive(args):
+    """Pool worker: write the archive for a single court."""
+    court_id, obj_type_str, obj_type, court_attr, serializer, jsonl = args
+    qs = obj_type.objects.filter(**{court_attr.replace('.', '__'): court_id})
+    path = join(settings.BULK_DATA_DIR, 'tmp', obj_type_str, court_id)
+    return stream_archive(path, qs, serializer, jsonl=jsonl)
+
+
+def stream_json_to_archives(courts, obj_type_str, obj_type, court_attr,
+                            serializer, jsonl=False, processes=None):
+    """Write all items of a type into per-court compressed archives, without
+    writing a file per item along the way.
+
+    Court-centric types are exported with a pool of processes, one court per
+    process at a time. The per-court archives are then combined into all.tar
+    (or all.jsonl.gz), as targz_json_files does.
+
+    :return: The number of items written.
+    """
+    base = join(settings.BULK_DATA_DIR, 'tmp', obj_type_str)
+    mkdir_p(base)
+    if court_attr is None:
+        # A non-jurisdiction-centric object.
+        return stream_archive(join(base, 'all'), obj_type.objects.all(),
+                              serializer, jsonl=jsonl)
+
+    court_ids = [court.pk for court in courts]
+    # Don't share DB connections with the child processes.
+    for conn in connections.all():
+        conn.close()
+    pool = Pool(processes=processes)
+    try:
+        counts = pool.map(_stream_court_archive, [
+            (court_id, obj_type_str, obj_type, court_attr, serializer, jsonl)
+            for court_id in court_ids
+        ])
+    finally:
+        pool.close()
+        pool.join()
+
+    if jsonl:
+        # A series of gzip members is itself a valid gzip file.
+        with open(join(base, 'all.jsonl.gz'), 'wb') as out:
+            for court_id in court_ids:
+                with open(join(base, '%s.jsonl.gz' % court_id), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+    else:
+        tar = tarfile.open(join(base, 'all.tar'), 'w')
+        for court_id in court_ids:
+            targz = join(base, '%s.tar.gz' % court_id)
+            tar.add(targz, arcname=os.path.basename(targz))
+        tar.close()
+
+    total = sum(counts)
+    print('   - %s %s items streamed into archives.' % (total, obj_type_str))
+    return total
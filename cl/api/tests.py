@@ -1,8 +1,12 @@
 # coding=utf-8
 from __future__ import print_function
+import gzip
 import json
+import os
 import shutil
+import tarfile
 from datetime import timedelta, date
+from os.path import join
 
 from django.contrib.auth.models import User, Permission
 from django.core.urlresolvers import reverse
@@ -12,13 +16,16 @@ from django.utils.timezone import now
 from rest_framework.status import HTTP_200_OK, HTTP_403_FORBIDDEN
 
 from cl.api.management.commands.cl_make_bulk_data import Command
-from cl.api.utils import BulkJsonHistory
+from cl.api.tasks import stream_archive
+from cl.api.utils import BulkJsonHistory, BulkDeltaManifest
 from cl.api.views import coverage_data
 from cl.audio.models import Audio
 from cl.lib.test_helpers import IndexedSolrTestCase
+from cl.lib.utils import mkdir_p
 from cl.scrapers.management.commands.cl_scrape_oral_arguments import \
     Command as OralArgumentCommand
 from cl.scrapers.test_assets import test_oral_arg_scraper
+from cl.search.api_serializers import OpinionSerializer
 from cl.search.models import Docket, Court, Opinion, OpinionCluster, \
     OpinionsCited
 
@@ -779,6 +786,34 @@ class BulkJsonHistoryTest(TestCase):
         )
 
 
+class BulkDeltaManifestTest(TestCase):
+
+    def setUp(self):
+        self.manifest = BulkDeltaManifest('test')
+
+    def tearDown(self):
+        shutil.rmtree(self.manifest.dir, ignore_errors=True)
+
+    def test_adding_deltas_then_a_full_build(self):
+        self.assertEqual(self.manifest.deltas, [])
+        mkdir_p(join(self.manifest.dir, 'deltas'))
+        delta_path = join(self.manifest.dir, 'deltas', 'a.tar.gz')
+        open(delta_path, 'w').close()
+
+        since = now() - timedelta(days=1)
+        self.manifest.add_delta_and_save('deltas/a.tar.gz', since, now(), 3)
+        reloaded = BulkDeltaManifest('test')
+        self.assertEqual(len(reloaded.deltas), 1)
+        self.assertEqual(reloaded.deltas[0]['count'], 3)
+
+        # A full build makes the existing deltas redundant.
+        reloaded.mark_full_and_save(now())
+        reloaded = BulkDeltaManifest('test')
+        self.assertEqual(reloaded.deltas, [])
+        self.assertIn('date', reloaded.json['full'])
+        self.assertFalse(os.path.exists(delta_path))
+
+
 class BulkDataTest(TestCase):
     tmp_data_dir = '/tmp/bulk-dir/'
 
@@ -826,6 +861,42 @@ class BulkDataTest(TestCase):
         """Can we successfully generate all bulk files?"""
         Command().execute()
 
+    @override_settings(BULK_DATA_DIR=tmp_data_dir)
+    def test_full_build_after_a_delta_run(self):
+        """Does a full build without --deltas drop the deltas that came
+        before it from the manifest?"""
+        Command().execute(deltas=True)
+        first_full = BulkDeltaManifest('dockets').json['full']['date']
+        Docket.objects.all()[0].save()
+        Command().execute(deltas=True)
+        self.assertEqual(len(BulkDeltaManifest('dockets').deltas), 1)
+
+        Command().execute()
+        manifest = BulkDeltaManifest('dockets')
+        self.assertEqual(manifest.deltas, [])
+        self.assertGreater(manifest.json['full']['date'], first_full)
+
+    def test_streaming_items_into_archives(self):
+        """Can we serialize items straight into tar.gz and JSON-lines
+        archives?"""
+        mkdir_p(self.tmp_data_dir)
+        path = join(self.tmp_data_dir, 'test')
+        expected = sorted('%s.json' % pk for pk in
+                          Opinion.objects.values_list('pk', flat=True))
+
+        count = stream_archive(path, Opinion.objects.all(), OpinionSerializer)
+        self.assertEqual(count, len(expected))
+        tar = tarfile.open('%s.tar.gz' % path)
+        self.assertEqual(sorted(tar.getnames()), expected)
+        tar.close()
+
+        count = stream_archive(path, Opinion.objects.all(), OpinionSerializer,
+                               jsonl=True)
+        self.assertEqual(count, len(expected))
+        with gzip.open('%s.jsonl.gz' % path) as f:
+            items = [json.loads(line) for line in f]
+        self.assertEqual(len(items), len(expected))
+
     def test_database_has_objects_for_bulk_export(self):
         self.assertTrue(Opinion.objects.count() > 0, 'Opinions exist')
         self.assertTrue(Audio.objects.count() > 0, 'Audio exist')
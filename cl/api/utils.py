@@ -339,6 +339,74 @@ class BulkJsonHistory(object):
         self.save_to_disk()
 
 
+class BulkDeltaManifest(object):
+    """Keep track of the delta archives published for a bulk data type, so
+    mirrors can fetch only what changed since they last synced.
+
+    The manifest lives next to the public archives, as manifest.json:
+
+    {
+      "full": {"date": ISO-Date},
+      "deltas": [
+        {"file": "deltas/<date>.tar.gz", "since": ISO-Date,
+         "until": ISO-Date, "count": int},
+        ...
+      ]
+    }
+
+    To sync, a mirror applies the full archives, then every delta whose
+    "until" is after the date of the full archives, in order.
+    """
+
+    def __init__(self, obj_type_str):
+        self.obj_type_str = obj_type_str
+        self.dir = os.path.join(settings.BULK_DATA_DIR, obj_type_str)
+        self.path = os.path.join(self.dir, 'manifest.json')
+        self.json = self.load_json_file()
+
+    def load_json_file(self):
+        try:
+            with open(self.path, 'r') as f:
+                try:
+                    return json.load(f)
+                except ValueError:
+                    return {}
+        except IOError:
+            return {}
+
+    def save_to_disk(self):
+        mkdir_p(self.dir)
+        with open(self.path, 'w') as f:
+            json.dump(self.json, f, indent=2)
+
+    @property
+    def deltas(self):
+        return self.json.setdefault('deltas', [])
+
+    def mark_full_and_save(self, d):
+        """Note that full archives were published as of d, which makes the
+        older deltas redundant, so delete them.
+        """
+        for delta in self.deltas:
+            try:
+                os.remove(os.path.join(self.dir, delta['file']))
+            except OSError as e:
+                if e.errno != 2:
+                    raise
+        self.json['full'] = {'date': d.isoformat()}
+        self.json['deltas'] = []
+        self.save_to_disk()
+
+    def add_delta_and_save(self, file_name, since, until, count):
+        self.deltas.append({
+            'file': file_name,
+            'since': since.isoformat(),
+            'until': until.isoformat(),
+            'count': count,
+        })
+        self.save_to_disk()
+
+
 def invert_user_logs(start, end):
     """Invert the user logs for a period of time
 
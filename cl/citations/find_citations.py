@@ -475,7 +475,7 @@ def get_citations(text, html=True, do_post_citation=True, do_defendant=True):
     # citations must have a volume before and a page after the reporter.
     for i in xrange(1, len(words) - 1):
         # Find reporter
-        if words[i] in (EDITIONS.keys() + VARIATIONS_ONLY.keys()):
+        if words[i] in reporter_tokenizer.REPORTER_STRINGS:
             citation = extract_base_citation(words, i)
             if citation is None:
                 # Not a valid citation; continue looking
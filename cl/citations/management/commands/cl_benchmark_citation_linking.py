@@ -0,0 +1,116 @@
+# coding=utf-8
+import os
+import time
+
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.functions import Coalesce, Length
+
+from cl.citations.find_citations import get_citations
+from cl.citations.tasks import link_citations, link_citations_one_at_a_time
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.search.models import Opinion
+
+PLAIN_TEXT_WRAPPER = u'</pre>%s<pre class="inline">'
+
+
+def get_fixture_texts(multiplier):
+    """Get the texts of the test opinions, made long by repeating them.
+
+    :param multiplier: How many times to repeat each text.
+    :return: A list of (name, text, is_html) tuples.
+    """
+    texts = []
+    for name, is_html in [('opinion_text.txt', False),
+                          ('opinion_html.html', True)]:
+        path = os.path.join(settings.MEDIA_ROOT, 'test', 'search', name)
+        with open(path) as f:
+            text = f.read().decode('utf-8')
+        texts.append((name, text * multiplier, is_html))
+    return texts
+
+
+def get_opinion_texts(count):
+    """Get the texts of the longest opinions in the database, choosing the
+    same field of each that create_cited_html would.
+
+    :param count: How many opinions to get.
+    :return: A list of (name, text, is_html) tuples.
+    """
+    # The HTML fields are nullable, and a null length would null the sum.
+    lengths = [Coalesce(Length(field), Value(0)) for field in
+               ['html_columbia', 'html_lawbox', 'html', 'plain_text']]
+    opinions = Opinion.objects.annotate(
+        length=sum(lengths[1:], lengths[0]),
+    ).order_by('-length')[:count]
+    texts = []
+    for opinion in opinions:
+        html = opinion.html_columbia or opinion.html_lawbox or opinion.html
+        if html:
+            texts.append(('opinion %s' % opinion.pk, html, True))
+        elif opinion.plain_text:
+            texts.append(('opinion %s' % opinion.pk, opinion.plain_text,
+                          False))
+    return texts
+
+
+def time_it(f, repeat):
+    """Return the best time, in seconds, of calling f repeat times."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+class Command(VerboseCommand):
+    help = ('Time linking citations with one re.sub per citation against '
+            'doing it in a single pass, on the longest opinions we have.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--opinions',
+            type=int,
+            help=('Time the longest this many opinions in the database, '
+                  'instead of the test opinions.'),
+        )
+        parser.add_argument(
+            '--multiplier',
+            type=int,
+            default=20,
+            help=('How many times to repeat the test opinions, to make them '
+                  'as long as the big appellate opinions.'),
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='How many times to time each opinion, keeping the best.',
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        if options['opinions']:
+            texts = get_opinion_texts(options['opinions'])
+        else:
+            texts = get_fixture_texts(options['multiplier'])
+
+        for name, text, is_html in texts:
+            citations = get_citations(text, html=is_html)
+            wrapper = u'%s' if is_html else PLAIN_TEXT_WRAPPER
+            old = time_it(
+                lambda: link_citations_one_at_a_time(text, citations,
+                                                     wrapper),
+                options['repeat'],
+            )
+            new = time_it(
+                lambda: link_citations(text, citations, wrapper),
+                options['repeat'],
+            )
+            logger.info("%s: %s characters, %s citations. One re.sub per "
+                        "citation: %.3fs. Single pass: %.3fs (%.1fx)." %
+                        (name, len(text), len(citations), old, new,
+                         old / new if new else float('inf')))
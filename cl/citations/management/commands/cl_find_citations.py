@@ -2,12 +2,12 @@
 import time
 import sys
 
-from cl.citations.tasks import update_document
+from cl.citations.tasks import update_documents
 from cl.lib import sunburnt
 from cl.lib.argparse_types import valid_date_time
 from cl.lib.celery_utils import CeleryThrottle
 from cl.lib.command_utils import VerboseCommand, logger
-from cl.lib.db_tools import queryset_generator
+from cl.lib.db_tools import stream_queryset
 from cl.search.models import Opinion
 from django.conf import settings
 from django.core.management import call_command
@@ -73,6 +73,15 @@ class Command(VerboseCommand):
                   "the opinions, it is thus generally wise to use "
                   "'concurrently'."),
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help="The number of opinions to process in each task. Changes to "
+                 "citation counts are added up across a batch and saved with "
+                 "one query, and with --index concurrently, each cited "
+                 "cluster is reindexed once per batch.",
+        )
 
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
@@ -91,6 +100,7 @@ class Command(VerboseCommand):
                                'everything.')
 
         self.index = options['index']
+        self.batch_size = options['batch_size']
         self.si = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='rw')
 
         # Use query chaining to build the query
@@ -109,8 +119,9 @@ class Command(VerboseCommand):
         self.count = query.count()
         self.average_per_s = 0
         self.timings = []
-        docs = queryset_generator(query, chunksize=10000)
-        self.update_documents(docs)
+        pks = stream_queryset(query.values_list('pk', flat=True),
+                              chunksize=10000)
+        self.update_documents(pks)
 
     def log_progress(self, processed_count, last_pk):
         if processed_count % 1000 == 1:
@@ -130,7 +141,7 @@ class Command(VerboseCommand):
         ))
         sys.stdout.flush()
 
-    def update_documents(self, documents):
+    def update_documents(self, pks):
         sys.stdout.write('Graph size is {0:d} nodes.\n'.format(self.count))
         sys.stdout.flush()
         processed_count = 0
@@ -138,12 +149,18 @@ class Command(VerboseCommand):
             index_during_subtask = True
         else:
             index_during_subtask = False
-        throttle = CeleryThrottle(min_items=500)
-        for doc in documents:
-            throttle.maybe_wait()
-            update_document.delay(doc, index_during_subtask)
+        throttle = CeleryThrottle(min_items=max(500 // self.batch_size, 5))
+        batch = []
+        for pk in pks:
+            batch.append(pk)
             processed_count += 1
-            self.log_progress(processed_count, doc.pk)
+            if len(batch) == self.batch_size or processed_count == self.count:
+                throttle.maybe_wait()
+                update_documents.delay(batch, index_during_subtask)
+                batch = []
+            self.log_progress(processed_count, pk)
+        if batch:
+            update_documents.delay(batch, index_during_subtask)
 
         if self.index == 'all_at_end':
             call_command(
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 # encoding utf-8
-
+import re
 from datetime import date, datetime
 
 from django.conf import settings
@@ -8,11 +8,32 @@ from reporters_db import REPORTERS
 
 from cl.citations.find_citations import strip_punct
 from cl.lib import sunburnt
+from cl.lib.utils import LRUCache, chunks
 
 DEBUG = True
 
 QUERY_LENGTH = 10
 
+# The number of citations to look up in a single OR'd Solr query.
+BATCH_SIZE = 50
+
+# Candidate opinions for each normalized citation string. Popular citations
+# like 410 U.S. 113 come up constantly, so keep them around instead of asking
+# Solr again. The TTL lets newly indexed opinions get picked up eventually.
+candidate_cache = LRUCache(maxsize=50000, ttl=60 * 60)
+
+_solr_connections = {}
+
+
+def get_solr_connection():
+    """Get a Solr connection for citation matching that is shared by
+    everything in this process, so it only has to be set up once.
+    """
+    url = settings.SOLR_OPINION_URL
+    if url not in _solr_connections:
+        _solr_connections[url] = sunburnt.SolrInterface(url, mode='r')
+    return _solr_connections[url]
+
 
 def build_date_range(start_year, end_year):
     """Build a date range to be handed off to a solr query."""
@@ -99,8 +120,7 @@ def match_citation(citation, citing_doc=None):
     Returns:
       - a Solr Result object with the results, or an empty list if no hits
     """
-    # TODO: Create shared solr connection for all queries
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+    conn = get_solr_connection()
     main_params = {
         'q': '*',
         'fq': [
@@ -140,3 +160,121 @@ def match_citation(citation, citing_doc=None):
 
     # Give up.
     return []
+
+
+def normalize_citation(s):
+    """Reduce a citation to its lowercase word tokens, roughly the way Solr
+    tokenizes the citation field, so they can be compared.
+    """
+    return tuple(re.findall(r'\w+', s.lower()))
+
+
+def _contains_phrase(tokens, phrase):
+    n = len(phrase)
+    return any(tokens[i:i + n] == phrase
+               for i in range(len(tokens) - n + 1))
+
+
+def get_candidates(citations):
+    """Get the opinions in Solr that have the citations, using a few OR'd
+    queries instead of one query per citation.
+
+    Results are cached by normalized citation, so a citation that has been
+    looked up recently doesn't hit Solr.
+
+    :param citations: A list of Citation objects.
+    :return: A dict mapping each normalized base citation to a list of the
+    precedential Solr docs that have it, or to None if there were too many of
+    them to get in a batch.
+    """
+    candidates = {}
+    to_query = []
+    for citation in citations:
+        key = normalize_citation(citation.base_citation())
+        if key in candidates:
+            continue
+        cached = candidate_cache.get((settings.SOLR_OPINION_URL, key))
+        if cached is not None:
+            candidates[key] = cached
+        else:
+            candidates[key] = []
+            to_query.append((key, citation.base_citation()))
+
+    conn = get_solr_connection()
+    for chunk in chunks(to_query, BATCH_SIZE):
+        rows = len(chunk) * 20
+        results = conn.raw_query(**{
+            'q': '*',
+            'fq': [
+                'status:Precedential',
+                'citation:(%s)' % ' OR '.join('"%s"' % base_citation
+                                              for _, base_citation in chunk),
+            ],
+            'fl': 'id,citation,dateFiled,court_exact',
+            'rows': rows,
+            'caller': 'citation.match_citations.get_candidates',
+        }).execute()
+        if results.result.numFound > rows:
+            # Too many to sort out here. Mark them so that they're matched one
+            # at a time.
+            for key, _ in chunk:
+                candidates[key] = None
+            continue
+        for doc in results:
+            doc_cites = [normalize_citation(c) for c in doc.get('citation', [])]
+            for key, _ in chunk:
+                if any(_contains_phrase(c, key) for c in doc_cites):
+                    candidates[key].append(doc)
+        for key, _ in chunk:
+            candidate_cache.set((settings.SOLR_OPINION_URL, key),
+                                candidates[key])
+    return candidates
+
+
+def match_citations(citations, citing_doc=None):
+    """Match a list of citations to items in the database, sharing Solr queries
+    between them.
+
+    This gives the same answers as calling match_citation on each citation,
+    but the citation field is searched for all of the citations at once and
+    the date, court and self-citation filters are applied to the results
+    here. Only citations that match more than one item and have a defendant
+    to narrow them down with need queries of their own.
+
+    :param citations: A list of Citation objects.
+    :param citing_doc: The opinion the citations are from, if any.
+    :return: A list with the matches for each citation, in the same order as
+    the citations. Each item is a list of Solr docs, as from match_citation.
+    """
+    candidates = get_candidates(citations)
+    matches = []
+    for citation in citations:
+        docs = candidates[normalize_citation(citation.base_citation())]
+        if docs is None:
+            matches.append(match_citation(citation, citing_doc=citing_doc))
+            continue
+
+        if citation.year:
+            start_year = end_year = citation.year
+        else:
+            start_year, end_year = get_years_from_reporter(citation)
+            if citing_doc is not None and citing_doc.cluster.date_filed:
+                end_year = min(end_year, citing_doc.cluster.date_filed.year)
+        results = []
+        for doc in docs:
+            if citing_doc is not None and doc['id'] == citing_doc.pk:
+                continue
+            date_filed = doc.get('dateFiled')
+            if date_filed is None or not \
+                    start_year <= date_filed.year <= end_year:
+                continue
+            if citation.court and doc.get('court_exact') != citation.court:
+                continue
+            results.append(doc)
+
+        if len(results) > 1 and citing_doc is not None and \
+                citation.defendant:
+            # Refine using the defendant, the same way match_citation does.
+            results = match_citation(citation, citing_doc=citing_doc)
+        matches.append(results)
+    return matches
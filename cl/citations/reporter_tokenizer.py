@@ -8,10 +8,13 @@ import re
 
 from reporters_db import EDITIONS, VARIATIONS_ONLY
 
+# Every reporter string and variation, built once so that checking whether a
+# token is a reporter is a hash lookup instead of a scan of a fresh list.
+REPORTER_STRINGS = frozenset(EDITIONS.keys() + VARIATIONS_ONLY.keys())
+
 # We need to build a REGEX that has all the variations and the reporters in
 # order from longest to shortest.
-REGEX_LIST = EDITIONS.keys() + VARIATIONS_ONLY.keys()
-REGEX_LIST.sort(key=len, reverse=True)
+REGEX_LIST = sorted(REPORTER_STRINGS, key=len, reverse=True)
 REGEX_STR = '|'.join(map(re.escape, REGEX_LIST))
 REPORTER_RE = re.compile("\s(%s)\s" % REGEX_STR)
 
@@ -24,7 +27,7 @@ def normalize_variation(string):
     which is best. Usually, this can be accomplished using the year of the
     item.
     """
-    if string in VARIATIONS_ONLY.keys():
+    if string in VARIATIONS_ONLY:
         if len(VARIATIONS_ONLY[string]) == 1:
             # Simple case
             return VARIATIONS_ONLY[string][0]
@@ -59,7 +62,7 @@ def tokenize(text):
     strings = REPORTER_RE.split(text)
     words = []
     for string in strings:
-        if string in EDITIONS.keys() + VARIATIONS_ONLY.keys():
+        if string in REPORTER_STRINGS:
             words.append(string)
         else:
             # Normalize spaces
@@ -1,9 +1,15 @@
 import re
+from collections import Counter
 from httplib import ResponseNotReady
 
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils.timezone import now
+
 from cl.celery import app
 from cl.citations import find_citations, match_citations
-from cl.search.models import Opinion, OpinionsCited
+from cl.search.models import Opinion, OpinionCluster, OpinionsCited
+from cl.search.tasks import add_or_update_opinions
 
 # This is the distance two reporter abbreviations can be from each other if they
 # are considered parallel reporters. For example, "22 U.S. 44, 46 (13 Atl. 33)"
@@ -66,71 +72,140 @@ def get_document_citations(opinion):
     return citations
 
 
+def link_citations(text, citations, wrapper=u'%s'):
+    """Replace every occurrence of the citations in text with their HTML, in
+    a single pass over the text.
+
+    Doing a re.sub per citation rescans and copies the whole text once per
+    citation, which is quadratic for long opinions with many citations.
+    Instead, the regexes of all the citations are combined into one, and each
+    match is mapped back to its citation by its volume, reporter and page.
+    The output is the same as link_citations_one_at_a_time's, except where
+    two citations overlap in the text, as 1 F. 9 does with 1 F. 99, or with
+    11 F. 9. There, the re.sub per citation links whichever citation comes
+    first in the list, and can cut the other in half, leaving 1 F. 99 linked
+    as 1 F. 9 followed by a bare 9. Here, the match that starts first wins,
+    and the longest regexes go first so that, at the same start, the longer
+    citation wins. This is intended: each citation is linked whole, no
+    matter what order the citations were found in.
+
+    :param text: The text to link up.
+    :param citations: A list of Citation objects found in the text. If more
+    than one has the same regex, the first one wins.
+    :param wrapper: A format string to wrap each citation's HTML in.
+    :return: The text with the citations replaced by their HTML.
+    """
+    replacements = {}
+    patterns = []
+    for citation in citations:
+        key = u'%d %s %s' % (citation.volume, citation.reporter_found,
+                             citation.page)
+        if key in replacements:
+            continue
+        replacements[key] = wrapper % citation.as_html()
+        # Citation regexes capture the whitespace around the reporter, but
+        # Python 2 caps a regex at 100 groups, so don't capture here.
+        patterns.append(citation.as_regex().replace('(\\s+)', '\\s+'))
+    if not patterns:
+        return text
+    # The alternation takes the first pattern that matches, not the longest.
+    patterns.sort(key=len, reverse=True)
+
+    def replace(match):
+        found = match.group(0)
+        html = replacements.get(u' '.join(found.split()))
+        if html is None:
+            return found
+        ws_before_reporter = re.match(r'\d+(\s+)', found).group(1)
+        ws_before_page = re.search(r'(\s+)\S+$', found).group(1)
+        return html.replace(u'\\1', ws_before_reporter).replace(
+            u'\\2', ws_before_page)
+
+    return re.sub(u'|'.join(patterns), replace, text)
+
+
+def link_citations_one_at_a_time(text, citations, wrapper=u'%s'):
+    """Replace the citations in text with their HTML, one re.sub per citation.
+
+    This is how citations used to be linked. It's kept as a reference for the
+    tests and the cl_benchmark_citation_linking command, but is quadratic for
+    long opinions, so use link_citations instead.
+
+    :param text: The text to link up.
+    :param citations: A list of Citation objects found in the text.
+    :param wrapper: A format string to wrap each citation's HTML in.
+    :return: The text with the citations replaced by their HTML.
+    """
+    for citation in citations:
+        text = re.sub(citation.as_regex(), wrapper % citation.as_html(), text)
+    return text
+
+
 def create_cited_html(opinion, citations):
     if any([opinion.html_columbia, opinion.html_lawbox, opinion.html]):
         new_html = opinion.html_columbia or opinion.html_lawbox or opinion.html
-        for citation in citations:
-            new_html = re.sub(citation.as_regex(), citation.as_html(),
-                              new_html)
+        new_html = link_citations(new_html, citations)
     elif opinion.plain_text:
-        inner_html = opinion.plain_text
-        for citation in citations:
-            repl = u'</pre>%s<pre class="inline">' % citation.as_html()
-            inner_html = re.sub(citation.as_regex(), repl, inner_html)
+        inner_html = link_citations(opinion.plain_text, citations,
+                                    u'</pre>%s<pre class="inline">')
         new_html = u'<pre class="inline">%s</pre>' % inner_html
     return new_html.encode('utf-8')
 
 
-@app.task(bind=True, max_retries=5, ignore_result=True)
-def update_document(self, opinion, index=True):
-    """Get the citations for an item and save it and add it to the index if
-    requested."""
+def link_document_citations(opinion, citation_counts):
+    """Find and match the citations in an opinion, link them up in its
+    html_with_citations, and replace its OpinionsCited rows.
+
+    This doesn't touch the clusters of the opinions that are cited. Instead,
+    the number of new citations to each one is added to citation_counts, so
+    that they can be applied in bulk, and each cluster reindexed once, by
+    apply_citation_counts. The opinion itself is not saved.
+
+    :param opinion: The citing opinion.
+    :param citation_counts: A Counter mapping cluster IDs to the number of new
+    citations to them.
+    """
     citations = get_document_citations(opinion)
+    all_matches = match_citations.match_citations(citations,
+                                                  citing_doc=opinion)
+
+    # TODO: Figure out what to do if there's more than one
+    match_ids = set(matches[0]['id'] for matches in all_matches
+                    if len(matches) == 1)
+    matched_opinions = Opinion.objects.filter(
+        pk__in=match_ids
+    ).select_related('cluster').in_bulk(match_ids)
 
     # List used so we can do one simple update to the citing opinion.
     opinions_cited = set()
-    for citation in citations:
-        try:
-            matches = match_citations.match_citation(
-                citation,
-                citing_doc=opinion
-            )
-        except ResponseNotReady as e:
-            # Threading problem in httplib, which is used in the Solr query.
-            raise self.retry(exc=e, countdown=2)
-
-        # TODO: Figure out what to do if there's more than one
-        if len(matches) == 1:
-            match_id = matches[0]['id']
-            try:
-                matched_opinion = Opinion.objects.get(pk=match_id)
-
-                # Increase citation count for matched cluster if it hasn't
-                # already been cited by this opinion.
-                if matched_opinion not in opinion.opinions_cited.all():
-                    matched_opinion.cluster.citation_count += 1
-                    matched_opinion.cluster.save(index=index)
-
-                # Add citation match to the citing opinion's list of cases it
-                # cites. opinions_cited is a set so duplicates aren't an issue
-                opinions_cited.add(matched_opinion.pk)
-
-                # URL field will be used for generating inline citation html
-                citation.match_url = matched_opinion.cluster.get_absolute_url()
-                citation.match_id = matched_opinion.pk
-            except Opinion.DoesNotExist:
-                # No Opinions returned. Press on.
-                continue
-            except Opinion.MultipleObjectsReturned:
-                # Multiple Opinions returned. Press on.
-                continue
-        else:
+    for citation, matches in zip(citations, all_matches):
+        if len(matches) != 1:
             # No match found for citation
             #create_stub([citation])
-            pass
+            continue
+        matched_opinion = matched_opinions.get(matches[0]['id'])
+        if matched_opinion is None:
+            # No Opinions returned. Press on.
+            continue
+
+        # Add citation match to the citing opinion's list of cases it
+        # cites. opinions_cited is a set so duplicates aren't an issue
+        opinions_cited.add(matched_opinion.pk)
+
+        # URL field will be used for generating inline citation html
+        citation.match_url = matched_opinion.cluster.get_absolute_url()
+        citation.match_id = matched_opinion.pk
 
     # Only update things if we found citations
     if citations:
+        # Increase citation count for matched clusters if they haven't
+        # already been cited by this opinion.
+        already_cited = set(OpinionsCited.objects.filter(
+            citing_opinion_id=opinion.pk,
+        ).values_list('cited_opinion_id', flat=True))
+        for pk in opinions_cited - already_cited:
+            citation_counts[matched_opinions[pk].cluster_id] += 1
+
         opinion.html_with_citations = create_cited_html(opinion, citations)
 
         # Nuke existing citations
@@ -143,11 +218,88 @@ def update_document(self, opinion, index=True):
             pk in opinions_cited
         ])
 
+
+def apply_citation_counts(citation_counts):
+    """Add the accumulated citation counts to their clusters with a single
+    UPDATE.
+
+    :param citation_counts: A Counter mapping cluster IDs to the number of new
+    citations to them.
+    """
+    deltas = dict((pk, n) for pk, n in citation_counts.items() if n)
+    if not deltas:
+        return
+    OpinionCluster.objects.filter(pk__in=deltas.keys()).update(
+        citation_count=F('citation_count') + Case(
+            *[When(pk=pk, then=Value(n)) for pk, n in deltas.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        ),
+        date_modified=now(),
+    )
+
+
+def index_citation_changes(cluster_pks, opinion_pks=()):
+    """Reindex the opinions in the clusters whose counts changed, along with
+    any other opinions given, in one task.
+    """
+    opinion_pks = set(opinion_pks)
+    if cluster_pks:
+        opinion_pks.update(Opinion.objects.filter(
+            cluster_id__in=cluster_pks,
+        ).values_list('pk', flat=True))
+    if opinion_pks:
+        add_or_update_opinions.delay(list(opinion_pks))
+
+
+@app.task(bind=True, max_retries=5, ignore_result=True)
+def update_document(self, opinion, index=True):
+    """Get the citations for an item and save it and add it to the index if
+    requested."""
+    citation_counts = Counter()
+    try:
+        link_document_citations(opinion, citation_counts)
+    except ResponseNotReady as e:
+        # Threading problem in httplib, which is used in the Solr query.
+        raise self.retry(exc=e, countdown=2)
+    apply_citation_counts(citation_counts)
+    if index:
+        index_citation_changes(citation_counts.keys())
+
     # Update Solr if requested. In some cases we do it at the end for
     # performance reasons.
     opinion.save(index=index)
 
 
+@app.task(bind=True, max_retries=5, ignore_result=True)
+def update_documents(self, opinion_pks, index=True):
+    """Get the citations for a batch of opinions and save them.
+
+    Changes to the citation counts of the cited clusters are added up across
+    the whole batch and applied at the end with one query, so a popular
+    cluster cited by many opinions in the batch is only updated, and
+    reindexed, once.
+
+    :param opinion_pks: The PKs of the citing opinions.
+    :param index: Whether to reindex the citing opinions and the clusters
+    they cite once the batch is done.
+    """
+    citation_counts = Counter()
+    opinions = Opinion.objects.filter(pk__in=opinion_pks).select_related(
+        'cluster')
+    try:
+        with transaction.atomic():
+            for opinion in opinions:
+                link_document_citations(opinion, citation_counts)
+                opinion.save(index=False)
+            apply_citation_counts(citation_counts)
+    except ResponseNotReady as e:
+        # Threading problem in httplib, which is used in the Solr query.
+        raise self.retry(exc=e, countdown=2)
+    if index:
+        index_citation_changes(citation_counts.keys(), opinion_pks)
+
+
 @app.task(ignore_result=True)
 def update_document_by_id(opinion_id, index=True):
     op = Opinion.objects.get(pk=opinion_id)
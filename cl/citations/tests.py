@@ -1,6 +1,9 @@
 # coding=utf-8
+import os
+from collections import Counter
 from datetime import date
 
+from django.conf import settings
 from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.test import TestCase, SimpleTestCase
@@ -11,9 +14,10 @@ from cl.citations.find_citations import get_citations, is_date_in_reporter, \
     Citation
 from cl.citations.management.commands.cl_add_parallel_citations import \
     identify_parallel_citations, make_edge_list
-from cl.citations.match_citations import match_citation
+from cl.citations.match_citations import match_citation, match_citations
 from cl.citations.reporter_tokenizer import tokenize
-from cl.citations.tasks import update_document, create_cited_html
+from cl.citations.tasks import update_document, create_cited_html, \
+    link_citations, link_citations_one_at_a_time, apply_citation_counts
 from cl.lib.test_helpers import IndexedSolrTestCase
 from cl.search.models import Opinion, OpinionsCited, OpinionCluster
 
@@ -278,6 +282,48 @@ class CiteTest(TestCase):
             new_html,
         )
 
+    def test_single_pass_linking_matches_per_citation_subs(self):
+        """Does the single pass linker make the same HTML as doing one re.sub
+        per citation on a long opinion?
+        """
+        path = os.path.join(settings.MEDIA_ROOT, 'test', 'search',
+                            'opinion_text.txt')
+        with open(path) as f:
+            # Make it long, like the big appellate opinions.
+            text = f.read().decode('utf-8') * 20
+        citations = get_citations(text, html=False)
+        self.assertTrue(len(citations) > 0)
+        for i, citation in enumerate(citations[::2]):
+            citation.match_url = u'/opinion/%s/foo/' % i
+            citation.match_id = i
+
+        for wrapper in [u'%s', u'</pre>%s<pre class="inline">']:
+            expected = link_citations_one_at_a_time(text, citations, wrapper)
+            actual = link_citations(text, citations, wrapper)
+            self.assertEqual(expected, actual)
+
+    def test_longer_citations_win_over_their_prefixes(self):
+        """Is 1 F. 99 linked whole, even when 1 F. 9 is also cited?"""
+        text = u'See 1 F. 9 and 1 F. 99.'
+        citations = get_citations(text, html=False)
+        self.assertEqual(len(citations), 2)
+        linked = link_citations(text, citations)
+        self.assertIn(u'<span class="page">99</span>', linked)
+        self.assertNotIn(u'</span>9', linked)
+
+
+class CitationCountTest(TestCase):
+    fixtures = ['test_court.json', 'judge_judy.json',
+                'test_objects_search.json']
+
+    def test_applying_citation_counts_in_bulk(self):
+        """Are accumulated citation counts added to the right clusters?"""
+        with self.assertNumQueries(1):
+            apply_citation_counts(Counter({1: 2, 3: 1, 2: 0}))
+        counts = dict(OpinionCluster.objects.values_list('pk',
+                                                         'citation_count'))
+        self.assertEqual(counts, {1: 6, 2: 6, 3: 9})
+
 
 class MatchingTest(IndexedSolrTestCase):
     def test_citation_matching(self):
@@ -309,6 +355,19 @@ class MatchingTest(IndexedSolrTestCase):
         results = match_citation(citation)
         self.assertEqual([], results)
 
+    def test_batch_matching_agrees_with_single_matching(self):
+        """Do batched lookups give the same matches as one-at-a-time ones?"""
+        citing = Opinion.objects.get(pk=3)
+        citations = get_citations(citing.plain_text or citing.html, html=False)
+        citations.extend(get_citations('1 F. 9 (1795)'))
+        expected = [[r['id'] for r in match_citation(c, citing_doc=citing)]
+                    for c in citations]
+        for _ in range(2):
+            # The second time around, the lookups come from the cache.
+            actual = [[r['id'] for r in matches] for matches in
+                      match_citations(citations, citing_doc=citing)]
+            self.assertEqual(expected, actual)
+
 
 class CitationFeedTest(IndexedSolrTestCase):
 
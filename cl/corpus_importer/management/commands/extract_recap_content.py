@@ -27,10 +27,17 @@ class Command(VerboseCommand):
             default='celery',
             help="Which queue should the items be sent to? (default: 'celery')",
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help="How many items should each task extract when skipping OCR? "
+                 "(default: 100)",
+        )
 
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
         docs = RECAPDocument.objects.all().order_by()
         extract_recap_documents(docs, options['skip_ocr'], options.get('order'),
-                                options['queue'])
+                                options['queue'], options['batch_size'])
 
@@ -1,9 +1,163 @@
+import logging
+import time
+import uuid
 from datetime import timedelta
 
+from django.db import connections, transaction
+from django.db.models import Case, Model, Q, Value, When
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_key_value(row, key, pk_name):
+    """Get the value of a key field from a row of a queryset.
+
+    Rows can be model instances, dicts from values() queries, or scalars from
+    flat values_list() queries.
+    """
+    if isinstance(row, Model):
+        return getattr(row, key)
+    if isinstance(row, dict):
+        if key in row:
+            return row[key]
+        if key == 'pk' and pk_name in row:
+            return row[pk_name]
+        raise KeyError("Unable to lookup key '%s' of item. Did you forget to "
+                       "include it in a values query?" % key)
+    if isinstance(row, (tuple, list)):
+        raise ValueError("Unable to lookup key '%s' in a tuple. Use values() "
+                         "or a flat values_list() instead." % key)
+    return row
+
+
+def _after_keys(keys, values):
+    """Make a Q object that matches rows that come after the given values in
+    the ordering given by keys.
+
+    For keys (a, b) and values (x, y), that's: a > x OR (a = x AND b > y).
+    Keys that start with a '-' are descending, and use < instead of >.
+    """
+    q = None
+    for i, key in enumerate(keys):
+        if key.startswith('-'):
+            clause = Q(**{'%s__lt' % key[1:]: values[i]})
+        else:
+            clause = Q(**{'%s__gt' % key: values[i]})
+        for prev_key, prev_value in zip(keys[:i], values[:i]):
+            clause &= Q(**{prev_key.lstrip('-'): prev_value})
+        q = clause if q is None else q | clause
+    return q
+
+
+class _RateReporter(object):
+    """Log the number of rows streamed so far, and the rate at which they're
+    coming in.
+    """
+    def __init__(self, every):
+        self.every = every
+        self.count = 0
+        self.start = time.time()
+
+    def tick(self):
+        self.count += 1
+        if self.every and self.count % self.every == 0:
+            self.report()
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 0.001)
+        logger.info("Streamed %s rows (%0.1f rows/s)." % (
+            self.count, self.count / elapsed))
+
+
+def _keyset_rows(queryset, keys, chunksize, prefetch, reporter):
+    pk_name = queryset.model._meta.pk.name
+    queryset = queryset.order_by(*keys)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    last_values = None
+    while True:
+        window = queryset
+        if last_values is not None:
+            window = window.filter(_after_keys(keys, last_values))
+        # Evaluating the slice runs the prefetches for this window only.
+        rows = list(window[:chunksize])
+        for row in rows:
+            yield row
+            reporter.tick()
+        if len(rows) < chunksize:
+            break
+        last_values = [_get_key_value(rows[-1], key.lstrip('-'), pk_name)
+                       for key in keys]
+
+
+def _server_cursor_rows(queryset, chunksize, reporter):
+    using = queryset.db
+    connection = connections[using]
+    sql, params = queryset.query.sql_with_params()
+    # Named cursors only live as long as the transaction they're in.
+    with transaction.atomic(using=using):
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(
+            name='cl_stream_%s' % uuid.uuid4().hex)
+        cursor.itersize = chunksize
+        try:
+            cursor.execute(sql, params)
+            columns = None
+            for row in cursor:
+                if columns is None:
+                    columns = [col[0] for col in cursor.description]
+                yield dict(zip(columns, row))
+                reporter.tick()
+        finally:
+            cursor.close()
+
+
+def stream_queryset(queryset, keys=('pk',), chunksize=1000, prefetch=(),
+                    server_cursor=False, report_every=100000):
+    """Iterate over a large queryset without loading it all into memory.
+
+    By default this uses keyset pagination: the queryset is ordered by keys,
+    and each window of chunksize rows is fetched with a WHERE clause that
+    starts just after the last row of the previous window. Unlike OFFSET
+    paging, every window costs the same, however deep into the table it is,
+    and no count or min/max queries are needed up front.
+
+    Projections work: pass a values() queryset to get dicts, a flat
+    values_list() queryset to get scalars, or use only() to get slim model
+    instances. Whatever the projection, it has to include the key fields.
+
+    :param queryset: The queryset to iterate over. Its ordering is replaced.
+    :param keys: The fields to page by. Together they must be unique and not
+    null. They can be of any type that can be compared, and can be composite,
+    e.g. ('date_filed', 'pk'). Prefix a key with '-' to page descending.
+    :param chunksize: The number of rows to fetch per window.
+    :param prefetch: Lookups to prefetch for each window, as you'd pass to
+    prefetch_related.
+    :param server_cursor: Instead of keyset pagination, run the query once on
+    a PostgreSQL named (server-side) cursor, fetching chunksize rows per round
+    trip. In this mode rows are dicts keyed by column name, the queryset's own
+    ordering is kept, and prefetching isn't available.
+    :param report_every: Log the number of rows streamed and the rate every
+    this many rows. Use None to turn this off.
+    """
+    reporter = _RateReporter(report_every)
+    if server_cursor:
+        if prefetch:
+            raise ValueError("Prefetching isn't available when using a "
+                             "server-side cursor.")
+        rows = _server_cursor_rows(queryset, chunksize, reporter)
+    else:
+        rows = _keyset_rows(queryset, list(keys), chunksize, prefetch,
+                            reporter)
+    for row in rows:
+        yield row
+    if report_every:
+        reporter.report()
+
 
 def queryset_generator(queryset, chunksize=1000):
     """
-    from: http://djangosnippets.org/snippets/1949/
     Iterate over a Django Queryset ordered by the primary key
 
     This method loads a maximum of chunksize (default: 1000) rows in its
@@ -12,40 +166,11 @@ def queryset_generator(queryset, chunksize=1000):
     classes.
 
     Note that the implementation of the iterator does not support ordered query
-    sets.
+    sets. See stream_queryset for more options.
     """
-    def get_attr_or_value(obj, key):
-        """Get an attr of an object that's either a dict or a Django object"""
-        try:
-            return getattr(obj, key)
-        except AttributeError:
-            try:
-                return obj.get(key)
-            except KeyError:
-                raise Exception("Unable to lookup key '%s' of item. Did you "
-                                "forget to include it in a values query?" % key)
-
     # Make a query that doesn't do related fetching for optimization
-    queryset = queryset.order_by('pk').prefetch_related(None)
-    count = queryset.count()
-    if count == 0:
-        return
-
-    lowest_pk = get_attr_or_value(queryset.order_by('pk')[0], 'id')
-    highest_pk = get_attr_or_value(queryset.order_by('-pk')[0], 'id')
-    lookup = 'pk__gte'
-    while lowest_pk <= highest_pk:
-        for row in queryset.filter(**{lookup: lowest_pk})[:chunksize]:
-            yield row
-            row_id = get_attr_or_value(row, 'id')
-            if row_id == highest_pk:
-                raise StopIteration
-            else:
-                # After first loop, tweak lookup to be a gt query. This allows
-                # the loop to support single results, which require gte, and
-                # n > 1 results, which require gte for subsequent iterations.
-                lookup = 'pk__gt'
-                lowest_pk = row_id
+    queryset = queryset.prefetch_related(None)
+    return stream_queryset(queryset, chunksize=chunksize, report_every=None)
 
 
 def queryset_generator_by_date(queryset, date_field, start_date, end_date,
@@ -73,3 +198,35 @@ def queryset_generator_by_date(queryset, date_field, start_date, end_date,
         top_date = top_date + chunksize
         for row in queryset.filter(**keywords):
             yield row
+
+
+def bulk_update(model, rows, fields, batch_size=500, **extra):
+    """Update many rows of a model, each with its own values, with one UPDATE
+    per batch instead of one per row.
+
+    Like queryset.update(), this skips save() and signals.
+
+    :param model: The model class.
+    :param rows: A dict mapping primary keys to dicts of field names and their
+    new values.
+    :param fields: The fields to update. Every row needs a value for each.
+    :param batch_size: The number of rows to update per query.
+    :param extra: Values to set on every row, like date_modified=now().
+    """
+    pks = list(rows.keys())
+    for i in range(0, len(pks), batch_size):
+        batch = pks[i:i + batch_size]
+        updates = dict(extra)
+        for field_name in fields:
+            values = [rows[pk][field_name] for pk in batch]
+            if all(value == values[0] for value in values):
+                # Set it directly. Postgres can't tell the type of a CASE
+                # that only has NULLs, and Django 1.8 doesn't cast it.
+                updates[field_name] = values[0]
+                continue
+            updates[field_name] = Case(
+                *[When(pk=pk, then=Value(rows[pk][field_name]))
+                  for pk in batch],
+                output_field=model._meta.get_field(field_name)
+            )
+        model.objects.filter(pk__in=batch).update(**updates)
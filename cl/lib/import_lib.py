@@ -1,9 +1,13 @@
+from collections import defaultdict
+from datetime import datetime
+
 from dateutil.relativedelta import relativedelta
 from django.db.models import Min, Q
 from reporters_db import REPORTERS
 
 from cl.corpus_importer.import_columbia.parse_judges import find_judge_names
-from cl.people_db.models import Person
+from cl.people_db.models import Person, Position, \
+    get_judge_cache_version
 from cl.search.models import Court, Opinion
 
 
@@ -62,18 +66,87 @@ def map_citations_to_models(citations):
     return cite_mapping
 
 
+class JudgeIndex(object):
+    """An in-memory index of every person who has held a position in a court,
+    keyed by their lowercased last name and the court.
+
+    Lookups give the same answers as filtering Person on name_last__iexact
+    and positions__court_id, without hitting the database.
+    """
+    def __init__(self):
+        people = {p.pk: p for p in Person.objects.filter(
+            positions__court__isnull=False,
+        ).distinct()}
+        positions = Position.objects.filter(
+            court__isnull=False,
+        ).order_by('person_id', 'pk').values_list(
+            'person_id', 'court_id', 'date_start', 'date_termination',
+        )
+        self._positions = defaultdict(list)
+        for person_id, court_id, date_start, date_termination in positions:
+            person = people[person_id]
+            key = (person.name_last.lower(), court_id)
+            self._positions[key].append(
+                (person, date_start, date_termination))
+
+    def lookup(self, name_last, court_id, case_date=None, name_first=None):
+        """Get the people with a last name who held a position in a court.
+
+        :param name_last: The last name of the person, case insensitive.
+        :param court_id: A CL Court ID.
+        :param case_date: If provided, only return people whose position
+        started less than a year after the date and ended less than a year
+        before it (or hasn't ended).
+        :param name_first: If provided, only return people with this first
+        name, case insensitive.
+        :return: A list of distinct Person objects.
+        """
+        if isinstance(case_date, datetime):
+            case_date = case_date.date()
+        candidates = []
+        for person, date_start, date_termination in \
+                self._positions.get((name_last.lower(), court_id), []):
+            if person in candidates:
+                continue
+            if case_date is not None:
+                if date_start >= case_date + relativedelta(years=1):
+                    continue
+                if date_termination is not None and date_termination <= \
+                        case_date - relativedelta(years=1):
+                    continue
+            if name_first is not None and \
+                    person.name_first.lower() != name_first.lower():
+                continue
+            candidates.append(person)
+        return candidates
+
+
+_judge_index = {}
+
+
+def get_judge_index():
+    """Get the judge index for this process.
+
+    It is rebuilt the next time it's requested after a person or a position
+    is saved or deleted in any process, so treat its people as read-only.
+    """
+    version = get_judge_cache_version()
+    if _judge_index.get('version') != version:
+        _judge_index['index'] = JudgeIndex()
+        _judge_index['version'] = version
+    return _judge_index['index']
+
+
 def find_person(name_last, court_id, name_first=None, case_date=None,
                 require_dates=False, raise_mult=False, raise_zero=False):
     """Uniquely identifies a judge by both name and metadata. Prints a warning
     if couldn't find and raises an exception if not unique.
     """
+    index = get_judge_index()
 
     # don't check for dates
     if not require_dates:
-        candidates = Person.objects.filter(
-            name_last__iexact=name_last,
-            positions__court_id=court_id,
-        )
+        candidates = index.lookup(name_last, court_id)
         if len(candidates) == 0:
             print("No judge: Last name '%s', position '%s'." % (
                 name_last.encode('utf-8'),
@@ -87,12 +160,7 @@ def find_person(name_last, court_id, name_first=None, case_date=None,
         raise Exception("No case date provided.")
 
     # check based on dates
-    candidates = Person.objects.filter(
-        Q(name_last__iexact=name_last),
-        Q(positions__court_id=court_id),
-        Q(positions__date_start__lt=case_date + relativedelta(years=1)),
-        Q(positions__date_termination__gt=case_date - relativedelta(years=1)) | Q(positions__date_termination=None)
-    )
+    candidates = index.lookup(name_last, court_id, case_date=case_date)
     if len(candidates) == 1:
         return candidates[0]
 
@@ -105,14 +173,8 @@ def find_person(name_last, court_id, name_first=None, case_date=None,
             return None
 
     if name_first is not None:
-        candidates = Person.objects.filter(
-            Q(name_last__iexact=name_last),
-            Q(name_first__iexact=name_first),
-            Q(positions__court_id=court_id),
-            Q(positions__date_start__lt=case_date + relativedelta(years=1)),
-            Q(positions__date_termination__gt=case_date - relativedelta(years=1)) |
-            Q(positions__date_termination=None),
-        )
+        candidates = index.lookup(name_last, court_id, case_date=case_date,
+                                  name_first=name_first)
         if len(candidates) == 1:
             return candidates[0]
         print('First name %s not found in group %s' % (name_first, str([c.name_first for c in candidates])))
@@ -0,0 +1,30 @@
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.sitemap import SOLR_SITEMAPS, build_sitemaps
+
+
+class Command(VerboseCommand):
+    help = ('Pre-generate the sitemaps for the Solr cores as gzipped files, '
+            'split by year, and write an index for them. Once the index '
+            'exists, it is served instead of the sitemaps made on request.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sitemap',
+            action='append',
+            choices=SOLR_SITEMAPS.keys(),
+            help='The sitemap to build. Can be given more than once. Defaults '
+                 'to all of them.',
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            default=False,
+            help='Rebuild every year, not just the ones with items indexed '
+                 'since the last build. Run this now and then so that deleted '
+                 'items drop out of the sitemaps.',
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        build_sitemaps(names=options['sitemap'], full=options['full'])
+        logger.info("Done building sitemaps.")
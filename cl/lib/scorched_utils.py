@@ -1,14 +1,160 @@
+import hashlib
+import os
+import threading
+import time
+
+import requests
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
 from scorched import SolrInterface
-from scorched.search import Options, SolrSearch
+from scorched.connection import MAX_LENGTH_GET_URL, SolrConnection
+from scorched.response import SolrResponse
+from scorched.search import Options, SolrSearch, params_from_dict
+
+# How long a core's schema is trusted before it's fetched again, in seconds.
+SCHEMA_TTL = 60 * 10
+
+# How long cached search results are kept, in seconds. Results are also
+# invalidated whenever we commit to the core, but Solr makes changes visible
+# on its own with autoSoftCommit every two minutes, so don't keep them longer
+# than that.
+SEARCH_CACHE_TIMEOUT = 60 * 2
+
+# One keep-alive session and one parsed schema per core URL, per process.
+_registry_lock = threading.Lock()
+_registry_pid = None
+_sessions = {}
+_schemas = {}
+
+
+def _check_pid():
+    """Forget everything if we've been forked since the registry was filled.
+
+    Sockets in a session's pool can't be shared with a child process, so each
+    process (e.g., each celery worker) builds its own.
+    """
+    global _registry_pid
+    if _registry_pid != os.getpid():
+        _sessions.clear()
+        _schemas.clear()
+        _registry_pid = os.getpid()
+
+
+def get_solr_session(url):
+    """Get the pooled HTTP session for a Solr core, creating it if needed.
+
+    :param url: The URL of the core.
+    :return: A requests.Session.
+    """
+    with _registry_lock:
+        _check_pid()
+        session = _sessions.get(url)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=20)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[url] = session
+        return session
+
+
+def get_solr_schema(url, fetch, ttl=SCHEMA_TTL):
+    """Get the schema of a Solr core, fetching it only if we haven't got it
+    or if the one we have is older than ttl seconds.
+
+    :param url: The URL of the core.
+    :param fetch: A function that takes no arguments and returns the schema.
+    :param ttl: The number of seconds a fetched schema is good for.
+    :return: The schema.
+    """
+    with _registry_lock:
+        _check_pid()
+        cached = _schemas.get(url)
+    if cached is not None and time.time() - cached[1] < ttl:
+        return cached[0]
+    schema = fetch()
+    with _registry_lock:
+        _schemas[url] = (schema, time.time())
+    return schema
+
+
+def clear_solr_cache(url=None):
+    """Forget the schemas (and sessions) we have for Solr cores, and the
+    search results cached for them. Use this whenever cores are created,
+    deleted, swapped or reloaded.
+
+    :param url: The URL of a core to forget, or None to forget all of them.
+    """
+    with _registry_lock:
+        if url is None:
+            _schemas.clear()
+            _sessions.clear()
+        else:
+            url = url.rstrip('/') + '/'
+            _schemas.pop(url, None)
+            _sessions.pop(url, None)
+    bump_index_generation(url or '*')
+
+
+def _generation_key(url):
+    return 'solr-generation:%s' % url
+
+
+def get_index_generation(url):
+    """Get the generation of a core's index, which changes every time we
+    commit to it, and every time cores are swapped around.
+
+    :param url: The URL of the core.
+    :return: A tuple of the generation of all the cores, and of this one.
+    """
+    keys = [_generation_key('*'), _generation_key(url)]
+    generations = cache.get_many(keys)
+    return tuple(generations.get(key, 0) for key in keys)
+
+
+def bump_index_generation(url):
+    """Note that a core's index has changed, making cached results for it
+    stale.
+
+    :param url: The URL of the core, or '*' for all of them.
+    """
+    key = _generation_key(url)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Not in the cache yet.
+        cache.set(key, 1, 60 * 60 * 24 * 7)
 
 
 class ExtraSolrInterface(SolrInterface):
     """Extends the SolrInterface class so that it uses the ExtraSolrSearch
     class.
+
+    It also uses the process-wide registry of sessions and schemas, so that
+    making one of these is cheap: no new connections are opened and the
+    schema isn't fetched on every construction, as it is by SolrInterface.
     """
 
-    def __init__(self, *args, **kwargs):
-        super(ExtraSolrInterface, self).__init__(*args, **kwargs)
+    def __init__(self, url, http_connection=None, mode='', retry_timeout=-1,
+                 max_length_get_url=MAX_LENGTH_GET_URL, search_timeout=()):
+        self.conn = SolrConnection(url, http_connection, mode, retry_timeout,
+                                   max_length_get_url, search_timeout)
+        # SolrConnection ignores http_connection and always makes a session
+        # of its own. Swap in the shared one.
+        self.conn.http_connection = (http_connection or
+                                     get_solr_session(self.conn.url))
+        self.schema = get_solr_schema(self.conn.url, self.init_schema)
+        self._datefields = self._extract_datefields(self.schema)
+
+    def commit(self, *args, **kwargs):
+        ret = super(ExtraSolrInterface, self).commit(*args, **kwargs)
+        bump_index_generation(self.conn.url)
+        return ret
+
+    def optimize(self, *args, **kwargs):
+        ret = super(ExtraSolrInterface, self).optimize(*args, **kwargs)
+        bump_index_generation(self.conn.url)
+        return ret
 
     def query(self, *args, **kwargs):
         """
@@ -38,11 +184,52 @@ class ExtraSolrSearch(SolrSearch):
         super(ExtraSolrSearch, self)._init_common_modules()
         self.extra = ExtraOptions()
 
+    _cache_timeout = None
+
+    def clone(self):
+        newself = super(ExtraSolrSearch, self).clone()
+        newself._cache_timeout = self._cache_timeout
+        return newself
+
     def add_extra(self, **kwargs):
         newself = self.clone()
         newself.extra.update(kwargs)
         return newself
 
+    def cache_results(self, timeout=SEARCH_CACHE_TIMEOUT):
+        """Cache the responses to this search, including its count and the
+        pages sliced from it.
+
+        Responses are keyed by the core, its index generation and the exact
+        parameters sent to Solr, so they're dropped as soon as we commit to the
+        core.
+        """
+        newself = self.clone()
+        newself._cache_timeout = timeout
+        return newself
+
+    def execute(self, constructor=None):
+        if self._cache_timeout is None:
+            return super(ExtraSolrSearch, self).execute(constructor)
+
+        conn = self.interface.conn
+        params = params_from_dict(**self.options())
+        key = 'search-results:%s' % hashlib.md5(repr((
+            conn.url,
+            get_index_generation(conn.url),
+            sorted(params),
+        ))).hexdigest()
+        json_str = cache.get(key)
+        if json_str is None:
+            json_str = conn.select(params)
+            cache.set(key, json_str, self._cache_timeout)
+        ret = SolrResponse.from_json(json_str,
+                                     self.interface.schema['uniqueKey'],
+                                     self.interface._datefields)
+        if constructor:
+            ret = self.constructor(ret, constructor)
+        return ret
+
     _count = None
     def count(self):
         if self._count is None:
@@ -1,4 +1,5 @@
 import re
+from copy import copy
 from urllib import urlencode
 from urlparse import parse_qs
 
@@ -6,7 +7,8 @@ from django.conf import settings
 
 from cl.citations.find_citations import get_citations
 from cl.citations.match_citations import match_citation
-from cl.search.models import Court
+from cl.search.models import Court, get_court_cache_version, \
+    get_in_use_courts
 
 boosts = {
     'qf': {
@@ -148,61 +150,13 @@ def make_stats_variable(search_form, paged_results):
     return facet_fields
 
 
-def merge_form_with_courts(courts, search_form):
-    """Merges the courts dict with the values from the search form.
-
-    Final value is like (note that order is significant):
-    courts = {
-        'federal': [
-            {'name': 'Eighth Circuit',
-             'id': 'ca8',
-             'checked': True,
-             'jurisdiction': 'F',
-             'has_oral_argument_scraper': True,
-            },
-            ...
-        ],
-        'district': [
-            {'name': 'D. Delaware',
-             'id': 'deld',
-             'checked' False,
-             'jurisdiction': 'FD',
-             'has_oral_argument_scraper': False,
-            },
-            ...
-        ],
-        'state': [
-            [{}, {}, {}][][]
-        ],
-        ...
-    }
+def make_court_tabs(courts):
+    """Arrange courts into the tabs of the jurisdiction picker.
 
     State courts are a special exception. For layout purposes, they get
     bundled by supreme court and then by hand. Yes, this means new state courts
     requires manual adjustment here.
     """
-    # Are any of the checkboxes checked?
-    checked_statuses = [field.value() for field in search_form
-                        if field.html_name.startswith('court_')]
-    no_facets_selected = not any(checked_statuses)
-    all_facets_selected = all(checked_statuses)
-    court_count = len([status for status in checked_statuses if status is True])
-    court_count_human = court_count
-    if all_facets_selected:
-        court_count_human = 'All'
-
-    for field in search_form:
-        if no_facets_selected:
-            for court in courts:
-                court.checked = True
-        else:
-            for court in courts:
-                # We're merging two lists, so we have to do a nested loop
-                # to find the right value.
-                if 'court_%s' % court.pk == field.html_name:
-                    court.checked = field.value()
-                    break
-
     # Build the dict with jurisdiction keys and arrange courts into tabs
     court_tabs = {
         'federal': [],
@@ -250,6 +204,83 @@ def merge_form_with_courts(courts, search_form):
     court_tabs['state'].append(state_bundles[17:34])
     court_tabs['state'].append(state_bundles[34:])
 
+    return court_tabs
+
+
+_court_tabs_cache = {}
+
+
+def get_all_checked_court_tabs():
+    """Get the court tabs with every court checked, which is what almost every
+    search uses. They're only rebuilt when a court changes.
+    """
+    version = get_court_cache_version()
+    if _court_tabs_cache.get('version') != version:
+        courts = []
+        for court in get_in_use_courts():
+            court = copy(court)
+            court.checked = True
+            courts.append(court)
+        _court_tabs_cache['tabs'] = make_court_tabs(courts)
+        _court_tabs_cache['version'] = version
+    return _court_tabs_cache['tabs']
+
+
+def merge_form_with_courts(search_form):
+    """Merges the courts dict with the values from the search form.
+
+    Final value is like (note that order is significant):
+    courts = {
+        'federal': [
+            {'name': 'Eighth Circuit',
+             'id': 'ca8',
+             'checked': True,
+             'jurisdiction': 'F',
+             'has_oral_argument_scraper': True,
+            },
+            ...
+        ],
+        'district': [
+            {'name': 'D. Delaware',
+             'id': 'deld',
+             'checked' False,
+             'jurisdiction': 'FD',
+             'has_oral_argument_scraper': False,
+            },
+            ...
+        ],
+        'state': [
+            [{}, {}, {}][][]
+        ],
+        ...
+    }
+
+    The tabs with every court checked are cached. Only when some courts are
+    unchecked are the tabs built for the request, from copies of the courts.
+    """
+    # Are any of the checkboxes checked?
+    checked = {}
+    for field in search_form:
+        if field.html_name.startswith('court_'):
+            checked[field.html_name[len('court_'):]] = field.value()
+    checked_statuses = checked.values()
+    no_facets_selected = not any(checked_statuses)
+    all_facets_selected = all(checked_statuses)
+    court_count = len([status for status in checked_statuses if status is True])
+    court_count_human = court_count
+    if all_facets_selected:
+        court_count_human = 'All'
+
+    if no_facets_selected or all_facets_selected:
+        court_tabs = get_all_checked_court_tabs()
+    else:
+        courts = []
+        for court in get_in_use_courts():
+            court = copy(court)
+            court.checked = checked.get(court.pk)
+            courts.append(court)
+        court_tabs = make_court_tabs(courts)
+
     return court_tabs, court_count_human, court_count
 
 
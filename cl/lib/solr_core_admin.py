@@ -6,6 +6,7 @@ import shutil
 import lxml
 import requests
 
+from cl.lib.scorched_utils import clear_solr_cache
 from cl.lib.sunburnt import SolrError
 
 
@@ -48,6 +49,7 @@ def create_temp_solr_core(core_name, schema_path, delete_if_present=True):
     if r.status_code != 200:
         raise Exception("Problem creating core. Got status_code of %s. Check "
                         "the Solr logs for details." % r.status_code)
+    clear_solr_cache()
 
 
 def delete_solr_core(core_name, delete_index=True, delete_data=True,
@@ -65,6 +67,7 @@ def delete_solr_core(core_name, delete_index=True, delete_data=True,
     if r.status_code != 200:
         raise Exception("Problem deleting core. Got status_code of %s. Check "
                         "the Solr logs for details." % r.status_code)
+    clear_solr_cache()
 
 
 def swap_solr_core(current_core, desired_core):
@@ -83,6 +86,7 @@ def swap_solr_core(current_core, desired_core):
     if r.status_code != 200:
         print "Problem swapping cores. Got status_code of %s. Check the Solr " \
               "logs for details." % r.status_code
+    clear_solr_cache()
 
 
 def get_solr_core_status(core='all'):
@@ -7,6 +7,7 @@ from django.test import TestCase
 from django.test.utils import override_settings
 from lxml import etree
 
+from cl.citations.match_citations import candidate_cache
 from cl.lib import sunburnt
 from cl.lib.solr_core_admin import delete_solr_core, create_temp_solr_core
 from cl.search.models import Court
@@ -26,6 +27,9 @@ class EmptySolrTestCase(TestCase):
     """
 
     def setUp(self):
+        # Forget citation lookups made against other tests' cores.
+        candidate_cache.clear()
+
         # Set up testing cores in Solr and swap them in
         self.core_name_opinion = settings.SOLR_OPINION_TEST_CORE_NAME
         self.core_name_audio = settings.SOLR_AUDIO_TEST_CORE_NAME
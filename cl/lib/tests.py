@@ -2,9 +2,12 @@
 from __future__ import print_function
 
 import datetime
+import gzip
+import mock
 import re
 
 import os
+import shutil
 import tempfile
 
 from django.core.files.base import ContentFile
@@ -13,23 +16,30 @@ from django.test import TestCase, SimpleTestCase
 from django.test import override_settings
 from rest_framework.status import HTTP_503_SERVICE_UNAVAILABLE, HTTP_200_OK
 
-from cl.lib.db_tools import queryset_generator
+from cl.lib.db_tools import bulk_update, queryset_generator, \
+    stream_queryset
+from cl.lib.import_lib import find_person, get_judge_index
 from cl.lib.mime_types import lookup_mime_type
 from cl.lib.model_helpers import make_upload_path
 from cl.lib.pacer import normalize_attorney_role, normalize_attorney_contact,\
     normalize_us_state, make_address_lookup_key
+from cl.lib.scorched_utils import clear_solr_cache, get_solr_schema, \
+    get_solr_session
 from cl.lib.search_utils import make_fq
 from cl.lib.storage import UUIDFileSystemStorage
+from cl.lib.utils import LRUCache
 from cl.lib.string_utils import trunc
-from cl.people_db.models import Role
+from cl.people_db.models import GRANULARITY_DAY, Person, Position, Role
 from cl.scrapers.models import UrlHash
 from cl.search.models import Opinion, OpinionCluster, Docket, Court
+from cl.sitemap import get_sitemap_years, write_sitemap_index, \
+    write_sitemap_shards
 
 
 class TestDBTools(TestCase):
     # This fixture uses UrlHash objects b/c they've been around a long while and
     # are wickedly simple objects.
-    fixtures = ['test_queryset_generator.json']
+    fixtures = ['test_queryset_generator.json', 'test_court.json']
 
     def test_queryset_generator(self):
         """Does the generator work properly with a variety of queries?"""
@@ -80,6 +90,48 @@ class TestDBTools(TestCase):
         )
         print('✓')
 
+    def test_stream_queryset_projections(self):
+        """Does streaming work with values and values_list projections?"""
+        self.assertEqual(
+            list(stream_queryset(UrlHash.objects.values_list('pk', flat=True),
+                                 chunksize=1)),
+            ['0', '1'],
+        )
+        self.assertEqual(
+            [row['sha1'] for row in
+             stream_queryset(UrlHash.objects.values('pk', 'sha1'),
+                             chunksize=1)],
+            ['0', '1'],
+        )
+
+    def test_stream_queryset_composite_descending_keys(self):
+        """Can we page by several keys, in descending order?"""
+        results = stream_queryset(UrlHash.objects.all(),
+                                  keys=('-sha1', '-pk'), chunksize=1)
+        self.assertEqual([r.pk for r in results], ['1', '0'])
+
+    def test_bulk_update(self):
+        """Can we give several rows their own values in one query?"""
+        with self.assertNumQueries(1):
+            bulk_update(UrlHash, {'0': {'sha1': 'a'}, '1': {'sha1': 'b'}},
+                        ['sha1'])
+        self.assertEqual(
+            list(UrlHash.objects.order_by('pk').values_list('sha1', flat=True)),
+            ['a', 'b'],
+        )
+
+    def test_bulk_update_with_only_nulls(self):
+        """Can a batch set a date column to NULL on every row?"""
+        court = Court.objects.get(pk='test')
+        pks = [Docket.objects.create(
+            case_name=u'foo', court=court, source=Docket.DEFAULT,
+            date_filed=datetime.date(2015, 8, 16),
+        ).pk for _ in range(2)]
+        bulk_update(Docket, {pk: {'date_filed': None} for pk in pks},
+                    ['date_filed'])
+        self.assertEqual(
+            Docket.objects.filter(pk__in=pks, date_filed=None).count(), 2)
+
 
 class TestStringUtils(TestCase):
     def test_trunc(self):
@@ -189,6 +241,143 @@ class UUIDFileSystemStorageTest(SimpleTestCase):
         self.assertTrue(re.match('[a-f0-9]{32}', file_root_created))
 
 
+class SitemapShardTest(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_urls(self, count):
+        return [{
+            'location': 'https://www.courtlistener.com/opinion/%s/foo/' % i,
+            'changefreq': 'monthly',
+            'lastmod': datetime.datetime(2017, 1, 1),
+            'priority': '0.5',
+        } for i in range(count)]
+
+    def test_shards_are_split_and_stale_ones_removed(self):
+        """Are big years split into files, and are files left from a bigger
+        earlier build removed?"""
+        prefix = 'sitemap-opinions-2017'
+        with mock.patch('cl.sitemap.items_per_sitemap_shard', 2):
+            self.assertEqual(
+                write_sitemap_shards(self.temp_dir, prefix,
+                                     self.make_urls(5)), 3)
+            self.assertEqual(
+                write_sitemap_shards(self.temp_dir, prefix,
+                                     self.make_urls(3)), 2)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), [
+            '%s-1.xml.gz' % prefix,
+            '%s-2.xml.gz' % prefix,
+        ])
+        with gzip.open(os.path.join(self.temp_dir,
+                                    '%s-2.xml.gz' % prefix)) as f:
+            self.assertEqual(f.read().count('<url>'), 1)
+
+        write_sitemap_index(self.temp_dir)
+        with open(os.path.join(self.temp_dir, 'sitemap.xml')) as f:
+            index = f.read()
+        self.assertIn(reverse('sitemap_shard',
+                              args=['%s-2.xml.gz' % prefix]), index)
+
+    def test_years_outside_the_range_are_kept(self):
+        """Are items dated before or after the years that get their own
+        shards, or not dated at all, still put in the sitemaps?"""
+        conn = mock.MagicMock()
+        r = conn.query().add_extra().execute()
+        r.facet_counts.facet_ranges = {'dob': {
+            'counts': [('1950-01-01T00:00:00Z', 2),
+                       ('1951-01-01T00:00:00Z', 0)],
+            'before': 1,
+            'after': 0,
+        }}
+        r.facet_counts.facet_queries = {'-dob:[* TO *]': 3}
+        self.assertEqual(get_sitemap_years(conn, 'dob'),
+                         [1950, 'before', 'undated'])
+
+    def test_missing_shard(self):
+        """Is a shard that hasn't been built a 404?"""
+        with self.settings(SITEMAP_DIR=self.temp_dir):
+            r = self.client.get(reverse(
+                'sitemap_shard', args=['sitemap-opinions-1999-1.xml.gz']))
+        self.assertEqual(r.status_code, 404)
+
+
+class LRUCacheTest(SimpleTestCase):
+    def test_least_recently_used_is_evicted(self):
+        """Does the item used longest ago get evicted first?"""
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_expired_items_are_misses(self):
+        """Do items older than the TTL get ignored?"""
+        cache = LRUCache(ttl=-1)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class SolrRegistryTest(SimpleTestCase):
+
+    def setUp(self):
+        clear_solr_cache()
+        self.url = 'http://example.com/solr/collection1/'
+        self.fetches = 0
+
+    def tearDown(self):
+        clear_solr_cache()
+
+    def fetch(self):
+        self.fetches += 1
+        return {'fields': [], 'dynamicFields': []}
+
+    def test_schema_is_fetched_once(self):
+        for _ in range(3):
+            get_solr_schema(self.url, self.fetch)
+        self.assertEqual(self.fetches, 1)
+        self.assertIs(get_solr_session(self.url), get_solr_session(self.url))
+
+    def test_schema_is_refetched_after_ttl_or_clear(self):
+        get_solr_schema(self.url, self.fetch)
+        get_solr_schema(self.url, self.fetch, ttl=0)
+        self.assertEqual(self.fetches, 2)
+        clear_solr_cache(self.url)
+        get_solr_schema(self.url, self.fetch)
+        self.assertEqual(self.fetches, 3)
+
+
+class JudgeIndexTest(TestCase):
+    fixtures = ['test_court.json', 'judge_judy.json']
+
+    def test_lookups_use_the_index(self):
+        """Can we find a judge without querying once the index is built?"""
+        judy = Person.objects.get(name_last='Sheindlin')
+        get_judge_index()
+        with self.assertNumQueries(0):
+            self.assertEqual(find_person('sheindlin', 'ca1'), judy)
+        self.assertIsNone(find_person('Sheindlin', 'test'))
+
+    def test_saving_a_position_refreshes_the_index(self):
+        """Do new positions show up in lookups right away?"""
+        bill = Person.objects.get(name_last='Clinton')
+        self.assertIsNone(find_person('Clinton', 'test'))
+        Position.objects.create(
+            person=bill,
+            court_id='test',
+            position_type='jud',
+            date_start=datetime.date(2000, 1, 1),
+            date_granularity_start=GRANULARITY_DAY,
+        )
+        self.assertEqual(find_person('Clinton', 'test'), bill)
+
+
 class TestMimeLookup(TestCase):
     """ Test the Mime type lookup function(s)"""
 
@@ -1,6 +1,7 @@
 import collections
 import errno
 import os
+import time
 from itertools import tee, islice, chain, izip
 
 
@@ -90,3 +91,44 @@ def remove_duplicate_dicts(l):
     See: http://stackoverflow.com/a/9427216/64911
     """
     return [dict(t) for t in set([tuple(d.items()) for d in l])]
+
+
+class LRUCache(object):
+    """A small in-memory least-recently-used cache, with an optional time to
+    live for its entries.
+
+    Once the cache holds maxsize items, setting a new one evicts the one that
+    was used longest ago.
+    """
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value, set_at = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        if self.ttl is not None and time.time() - set_at > self.ttl:
+            self.misses += 1
+            return default
+        # Put it back at the most recently used end.
+        self._data[key] = (value, set_at)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (value, time.time())
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
@@ -1,8 +1,11 @@
 # coding=utf-8
 from datetime import datetime, time
 
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template import loader
 from django.utils.text import slugify
 from localflavor.us import models as local_models
@@ -874,6 +877,26 @@ class Position(models.Model):
         super(Position, self).clean_fields(*args, **kwargs)
 
 
+JUDGE_CACHE_VERSION_KEY = 'judge-cache-version'
+
+
+def get_judge_cache_version():
+    """Get the version of the judges, which changes whenever a person or a
+    position is saved or deleted.
+    """
+    return cache.get(JUDGE_CACHE_VERSION_KEY, 0)
+
+
+@receiver([post_save, post_delete], sender=Person)
+@receiver([post_save, post_delete], sender=Position)
+def bump_judge_cache_version(sender, **kwargs):
+    try:
+        cache.incr(JUDGE_CACHE_VERSION_KEY)
+    except ValueError:
+        # Not in the cache yet.
+        cache.set(JUDGE_CACHE_VERSION_KEY, 1, None)
+
+
 class RetentionEvent(models.Model):
     RETENTION_TYPES = (
         ('reapp_gov', 'Governor Reappointment'),
@@ -2,24 +2,26 @@
 import hashlib
 import logging
 import os
+from collections import OrderedDict, defaultdict
 
-from django.core.files.base import ContentFile
-from django.db import IntegrityError
+from django.core.files.base import ContentFile, File
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.utils import timezone
 from juriscraper.lib.string_utils import CaseNameTweaker
 from juriscraper.pacer import DocketReport, AttachmentPage
 
 from cl.celery import app
+from cl.lib.db_tools import bulk_update
 from cl.lib.import_lib import get_candidate_judges
 from cl.lib.pacer import map_cl_to_pacer_id, normalize_attorney_contact, \
     normalize_attorney_role, get_blocked_status
 from cl.lib.recap_utils import get_document_filename
-from cl.lib.utils import remove_duplicate_dicts
+from cl.lib.utils import mkdir_p, remove_duplicate_dicts
 from cl.people_db.models import Party, PartyType, Attorney, \
     AttorneyOrganization, AttorneyOrganizationAssociation, Role
 from cl.recap.models import ProcessingQueue, PacerHtmlFiles
-from cl.scrapers.tasks import get_page_count, extract_recap_pdf
+from cl.scrapers.tasks import extract_recap_pdf
 from cl.search.models import Docket, RECAPDocument, DocketEntry
 from cl.search.tasks import add_or_update_recap_document
 
@@ -85,6 +87,74 @@ def mark_pq_status(pq, msg, status):
     pq.save()
 
 
+def get_file_sha1(f):
+    """Get the SHA1 of a file, reading it in chunks so that it's never all in
+    memory at once.
+
+    :param f: A Django File or FieldFile.
+    :return: The hex digest of the file's SHA1.
+    """
+    sha1 = hashlib.sha1()
+    f.open('rb')
+    try:
+        for chunk in f.chunks():
+            sha1.update(chunk)
+    finally:
+        f.close()
+    return sha1.hexdigest()
+
+
+def link_or_copy_file(field_file, file_name, src_path):
+    """Put a file on disk into a FileField without reading it into memory.
+
+    The file is hard linked into place if it's on the same file system as the
+    field's storage, and is otherwise copied over in chunks by the storage.
+    Either way, the source file is left alone.
+
+    :param field_file: The FieldFile to put the file into. Its instance isn't
+    saved.
+    :param file_name: The name to give the file. It's passed through the
+    field's upload_to, and incremented if it's taken.
+    :param src_path: The path of the file to put into place.
+    """
+    storage = field_file.storage
+    name = storage.get_available_name(
+        field_file.field.generate_filename(field_file.instance, file_name))
+    dest = storage.path(name)
+    try:
+        mkdir_p(os.path.dirname(dest))
+        os.link(src_path, dest)
+    except OSError:
+        # Different file system, or somebody took the name in the meantime.
+        with open(src_path, 'rb') as f:
+            field_file.save(file_name, File(f), save=False)
+    else:
+        setattr(field_file.instance, field_file.field.name, name)
+
+
+def find_extracted_duplicate(rd):
+    """Find another RECAPDocument with the same contents that already has its
+    page count and text.
+
+    :param rd: The RECAPDocument, with its sha1 set.
+    :return: The duplicate RECAPDocument or None if there isn't one.
+    """
+    duplicates = RECAPDocument.objects.filter(
+        sha1=rd.sha1,
+        is_available=True,
+        ocr_status__in=[RECAPDocument.OCR_COMPLETE,
+                        RECAPDocument.OCR_UNNECESSARY],
+    ).exclude(filepath_local='').only(
+        'filepath_local', 'page_count', 'plain_text', 'ocr_status',
+    )
+    if rd.pk is not None:
+        duplicates = duplicates.exclude(pk=rd.pk)
+    for duplicate in duplicates[:5]:
+        if os.path.isfile(duplicate.filepath_local.path):
+            return duplicate
+    return None
+
+
 @app.task(bind=True, max_retries=2, interval_start=5 * 60,
           interval_step=10 * 60)
 def process_recap_pdf(self, pk):
@@ -181,8 +251,7 @@ def process_recap_pdf(self, pk):
     rd.attachment_number = pq.attachment_number
 
     # Do the file, finally.
-    content = pq.filepath_local.read()
-    new_sha1 = hashlib.sha1(content).hexdigest()
+    new_sha1 = get_file_sha1(pq.filepath_local)
     existing_document = all([
         rd.sha1 == new_sha1,
         rd.is_available,
@@ -191,21 +260,30 @@ def process_recap_pdf(self, pk):
     if not existing_document:
         # Different sha1, it wasn't available, or it's missing from disk. Move
         # the new file over from the processing queue storage.
-        cf = ContentFile(content)
         file_name = get_document_filename(
             rd.docket_entry.docket.court_id,
             rd.docket_entry.docket.pacer_case_id,
             rd.document_number,
             rd.attachment_number,
         )
-        rd.filepath_local.save(file_name, cf, save=False)
         rd.is_available = True
         rd.sha1 = new_sha1
 
-        # Do page count and extraction
-        extension = rd.filepath_local.path.split('.')[-1]
-        rd.page_count = get_page_count(rd.filepath_local.path, extension)
-        rd.ocr_status = None
+        duplicate = find_extracted_duplicate(rd)
+        if duplicate is not None:
+            # The same PDF is already in RECAP, likely on another docket.
+            # Share its file and reuse its page count and text.
+            link_or_copy_file(rd.filepath_local, file_name,
+                              duplicate.filepath_local.path)
+            rd.page_count = duplicate.page_count
+            rd.plain_text = duplicate.plain_text
+            rd.ocr_status = duplicate.ocr_status
+        else:
+            link_or_copy_file(rd.filepath_local, file_name,
+                              pq.filepath_local.path)
+            # Page count and text are done together during extraction.
+            rd.page_count = None
+            rd.ocr_status = None
 
     if not pq.debug:
         try:
@@ -224,102 +302,242 @@ def process_recap_pdf(self, pk):
     return rd
 
 
-def add_attorney(atty, p, d):
-    """Add/update an attorney.
-
-    Given an attorney node, and a party and a docket object, add the attorney
-    to the database or link the attorney to the new docket. Also add/update the
-    attorney organization, and the attorney's role in the case.
+class AttorneyResolver(object):
+    """Resolve the attorneys and organizations on a docket in bulk.
 
-    :param atty: A dict representing an attorney, as provided by Juriscraper.
-    :param p: A Party object
-    :param d: A Docket object
-    :return: None if there's an error, or an Attorney object if not.
+    Every attorney's contact info is normalized once, then all the candidate
+    attorneys, their organizations and the docket's existing associations are
+    loaded in a few set-based queries. Attorneys and organizations are then
+    matched in memory and cached for the life of the resolver, so an attorney
+    who appears on a docket dozens of times is looked up once. Roles are
+    collected and written together by save_roles().
     """
-    newest_docket_date = max([dt for dt in [d.date_filed, d.date_terminated,
-                                            d.date_last_filing] if dt])
-    atty_org_info, atty_info = normalize_attorney_contact(
-        atty['contact'],
-        fallback_name=atty['name'],
-    )
-    try:
-        q = Q()
-        fields = {
+
+    def __init__(self, d, attys):
+        """
+        :param d: The Docket the attorneys are on.
+        :param attys: Every attorney dict that will be added, as provided by
+        Juriscraper.
+        """
+        self.d = d
+        self._contacts = {}
+        self._attorneys = {}
+        self._updated = set()
+        self._roles = OrderedDict()
+
+        names = set()
+        org_keys = set()
+        for atty in attys:
+            names.add(atty['name'])
+            atty_org_info, _ = self.normalize(atty)
+            if atty_org_info:
+                org_keys.add(atty_org_info['lookup_key'])
+
+        self._candidates = defaultdict(list)
+        attorneys_by_pk = {}
+        for a in Attorney.objects.filter(name__in=names):
+            a.org_keys = set()
+            self._candidates[a.name].append(a)
+            attorneys_by_pk[a.pk] = a
+        if attorneys_by_pk:
+            associations = AttorneyOrganizationAssociation.objects.filter(
+                attorney_id__in=attorneys_by_pk.keys(),
+            ).values_list(
+                'attorney_id', 'attorney_organization__lookup_key',
+            ).distinct()
+            for atty_id, lookup_key in associations:
+                attorneys_by_pk[atty_id].org_keys.add(lookup_key)
+        self._orgs = dict((org.lookup_key, org) for org in
+                          AttorneyOrganization.objects.filter(
+                              lookup_key__in=org_keys))
+        self._associations = set(
+            AttorneyOrganizationAssociation.objects.filter(
+                docket=d,
+            ).values_list('attorney_id', 'attorney_organization_id')
+        )
+
+    @property
+    def newest_docket_date(self):
+        """The newest date on the docket, used to date attorney info.
+
+        Only worked out when an attorney needs it, since dockets without any
+        dates can still be added if they have no attorneys.
+        """
+        d = self.d
+        return max([dt for dt in [d.date_filed, d.date_terminated,
+                                  d.date_last_filing] if dt])
+
+    def normalize(self, atty):
+        """Normalize an attorney's contact info, once per name and contact."""
+        key = (atty['name'], atty['contact'])
+        if key not in self._contacts:
+            self._contacts[key] = normalize_attorney_contact(
+                atty['contact'],
+                fallback_name=atty['name'],
+            )
+        return self._contacts[key]
+
+    def find_attorney(self, atty, atty_org_info, atty_info):
+        """Find the attorney with the same name and one of several IDs, or
+        create them if they're not found.
+
+        :return: None if there's more than one match, else the Attorney.
+        """
+        lookups = [
             ('phone', atty_info['phone']),
             ('fax', atty_info['fax']),
             ('email', atty_info['email']),
             ('contact_raw', atty['contact']),
-            ('organizations__lookup_key', atty_org_info.get('lookup_key')),
-        }
-        for field, lookup in fields:
-            if lookup:
-                q |= Q(**{field: lookup})
-        a, created = Attorney.objects.filter(
-            Q(name=atty['name']) & q,
-        ).get_or_create(
-            defaults={
-                'name': atty['name'],
-                'date_sourced': newest_docket_date,
-                'contact_raw': atty['contact'],
-            },
-        )
-    except Attorney.MultipleObjectsReturned:
-        logger.info("Got too many results for attorney: '%s'. Punting." % atty)
-        return None
+        ]
+        lookups = [(field, value) for field, value in lookups if value]
+        org_key = atty_org_info.get('lookup_key')
+        matches = []
+        for a in self._candidates[atty['name']]:
+            if not lookups and not org_key:
+                # Nothing to go on but the name.
+                matches.append(a)
+            elif any(getattr(a, field) == value for field, value in lookups) \
+                    or (org_key and org_key in a.org_keys):
+                matches.append(a)
+
+        if len(matches) > 1:
+            logger.info("Got too many results for attorney: '%s'. Punting." %
+                        atty)
+            return None
+        if matches:
+            return matches[0]
 
-    # Associate the attorney with an org and update their contact info.
-    if atty['contact']:
-        if atty_org_info:
-            logger.info("Adding organization information to '%s': '%s'" %
-                        (atty['name'], atty_org_info))
-            try:
-                org = AttorneyOrganization.objects.get(
-                    lookup_key=atty_org_info['lookup_key'],
+        try:
+            with transaction.atomic():
+                a = Attorney.objects.create(
+                    name=atty['name'],
+                    date_sourced=self.newest_docket_date,
+                    contact_raw=atty['contact'],
                 )
-            except AttorneyOrganization.DoesNotExist:
-                try:
+        except IntegrityError:
+            # Race condition. Item was created after we looked. Get it.
+            a = Attorney.objects.get(name=atty['name'],
+                                     contact_raw=atty['contact'])
+        a.org_keys = set()
+        self._candidates[a.name].append(a)
+        return a
+
+    def get_organization(self, atty_org_info):
+        """Get or create an attorney organization by its lookup key."""
+        lookup_key = atty_org_info['lookup_key']
+        org = self._orgs.get(lookup_key)
+        if org is None:
+            try:
+                with transaction.atomic():
                     org = AttorneyOrganization.objects.create(**atty_org_info)
-                except IntegrityError:
-                    # Race condition. Item was created after get. Try again.
-                    org = AttorneyOrganization.objects.get(
-                        lookup_key=atty_org_info['lookup_key'],
+            except IntegrityError:
+                # Race condition. Item was created after we looked. Get it.
+                org = AttorneyOrganization.objects.get(lookup_key=lookup_key)
+            self._orgs[lookup_key] = org
+        return org
+
+    def add_attorney(self, atty, p):
+        """Add/update an attorney.
+
+        Given an attorney dict and a party, add the attorney to the database or
+        link the attorney to the docket. Also add/update the attorney
+        organization, and queue up the attorney's roles in the case.
+
+        :param atty: A dict representing an attorney, as provided by
+        Juriscraper.
+        :param p: A Party object
+        :return: None if there's an error, or an Attorney object if not.
+        """
+        atty_org_info, atty_info = self.normalize(atty)
+        key = (atty['name'], atty['contact'])
+        if key not in self._attorneys:
+            self._attorneys[key] = self.find_attorney(atty, atty_org_info,
+                                                      atty_info)
+        a = self._attorneys[key]
+        if a is None:
+            return None
+
+        # Associate the attorney with an org and update their contact info.
+        if atty['contact']:
+            if atty_org_info:
+                logger.info("Adding organization information to '%s': '%s'" %
+                            (atty['name'], atty_org_info))
+                org = self.get_organization(atty_org_info)
+
+                # Add the attorney to the organization
+                if (a.pk, org.pk) not in self._associations:
+                    AttorneyOrganizationAssociation.objects.get_or_create(
+                        attorney=a,
+                        attorney_organization=org,
+                        docket=self.d,
                     )
+                    self._associations.add((a.pk, org.pk))
+                    a.org_keys.add(org.lookup_key)
+
+            docket_info_is_newer = (a.date_sourced <= self.newest_docket_date)
+            if atty_info and docket_info_is_newer and \
+                    (a.pk, atty['contact']) not in self._updated:
+                logger.info("Updating atty info because %s is more recent "
+                            "than %s." % (self.newest_docket_date,
+                                          a.date_sourced))
+                a.date_sourced = self.newest_docket_date
+                a.contact_raw = atty['contact']
+                a.email = atty_info['email']
+                a.phone = atty_info['phone']
+                a.fax = atty_info['fax']
+                a.save()
+                self._updated.add((a.pk, atty['contact']))
+
+        # Do roles
+        atty_roles = [normalize_attorney_role(r) for r in atty['roles']]
+        atty_roles = filter(lambda r: r['role'] is not None, atty_roles)
+        atty_roles = remove_duplicate_dicts(atty_roles)
+        if len(atty_roles) > 0:
+            logger.info("Linking attorney '%s' to party '%s' via %s roles: %s"
+                        % (atty['name'], p.name, len(atty_roles), atty_roles))
+        else:
+            logger.info("No role data parsed. Linking via 'UNKNOWN' role.")
+            atty_roles = [{'role': Role.UNKNOWN, 'date_action': None}]
+        # The latest roles for an attorney and party win.
+        self._roles[(a.pk, p.pk)] = [
+            Role(attorney=a, party=p, docket=self.d, **atty_role) for
+            atty_role in atty_roles
+        ]
+        return a
+
+    def save_roles(self, batch_size=200):
+        """Replace the old roles of every attorney and party that were added
+        with the new ones.
+        """
+        pairs = list(self._roles.keys())
+        with transaction.atomic():
+            for i in range(0, len(pairs), batch_size):
+                q = Q()
+                for atty_id, party_id in pairs[i:i + batch_size]:
+                    q |= Q(attorney_id=atty_id, party_id=party_id)
+                Role.objects.filter(q, docket=self.d).delete()
+            Role.objects.bulk_create([role for roles in self._roles.values()
+                                      for role in roles])
+        self._roles.clear()
 
-            # Add the attorney to the organization
-            AttorneyOrganizationAssociation.objects.get_or_create(
-                attorney=a,
-                attorney_organization=org,
-                docket=d,
-            )
 
-        docket_info_is_newer = (a.date_sourced <= newest_docket_date)
-        if atty_info and docket_info_is_newer:
-            logger.info("Updating atty info because %s is more recent than %s."
-                        % (newest_docket_date, a.date_sourced))
-            a.date_sourced = newest_docket_date
-            a.contact_raw = atty['contact']
-            a.email = atty_info['email']
-            a.phone = atty_info['phone']
-            a.fax = atty_info['fax']
-            a.save()
-
-    # Do roles
-    atty_roles = [normalize_attorney_role(r) for r in atty['roles']]
-    atty_roles = filter(lambda r: r['role'] is not None, atty_roles)
-    atty_roles = remove_duplicate_dicts(atty_roles)
-    if len(atty_roles) > 0:
-        logger.info("Linking attorney '%s' to party '%s' via %s roles: %s" %
-                    (atty['name'], p.name, len(atty_roles), atty_roles))
-    else:
-        logger.info("No role data parsed. Linking via 'UNKNOWN' role.")
-        atty_roles = [{'role': Role.UNKNOWN, 'date_action': None}]
-
-    # Delete the old roles, replace with new.
-    Role.objects.filter(attorney=a, party=p, docket=d).delete()
-    Role.objects.bulk_create([
-        Role(attorney=a, party=p, docket=d, **atty_role) for
-        atty_role in atty_roles
-    ])
+def add_attorney(atty, p, d):
+    """Add/update an attorney.
+
+    Given an attorney node, and a party and a docket object, add the attorney
+    to the database or link the attorney to the new docket. Also add/update the
+    attorney organization, and the attorney's role in the case.
+
+    To add many attorneys, use an AttorneyResolver instead.
+
+    :param atty: A dict representing an attorney, as provided by Juriscraper.
+    :param p: A Party object
+    :param d: A Docket object
+    :return: None if there's an error, or an Attorney object if not.
+    """
+    resolver = AttorneyResolver(d, [atty])
+    a = resolver.add_attorney(atty, p)
+    resolver.save_roles()
     return a
 
 
@@ -352,20 +570,40 @@ def update_docket_metadata(d, docket_data):
 def add_parties_and_attorneys(d, parties):
     """Add parties and attorneys from the docket data to the docket.
 
+    Parties, party types and attorneys are looked up for the whole docket at
+    once rather than one by one.
+
     :param d: The docket to update
     :param parties: The parties to update the docket with, with their associated
     attorney objects. This is typically the docket_data['parties'] field.
     :return: None
     """
+    resolver = AttorneyResolver(d, [atty for party in parties
+                                    for atty in party.get('attorneys', [])])
+    parties_by_name = defaultdict(list)
+    for p in Party.objects.filter(name__in=set(party['name'] for party in
+                                               parties)):
+        parties_by_name[p.name].append(p)
+    party_types = set(PartyType.objects.filter(docket=d).values_list(
+        'party_id', 'name'))
+    new_party_types = []
+
     for party in parties:
-        try:
-            p = Party.objects.get(name=party['name'])
-        except Party.DoesNotExist:
+        matches = parties_by_name[party['name']]
+        if len(matches) > 1:
+            continue
+        elif matches:
+            p = matches[0]
+            if party['extra_info'] and p.extra_info != party['extra_info']:
+                p.extra_info = party['extra_info']
+                p.save()
+        else:
             try:
-                p = Party.objects.create(
-                    name=party['name'],
-                    extra_info=party['extra_info'],
-                )
+                with transaction.atomic():
+                    p = Party.objects.create(
+                        name=party['name'],
+                        extra_info=party['extra_info'],
+                    )
             except IntegrityError:
                 # Race condition. Object was created after our get and before
                 # our create. Try to get it again.
@@ -373,20 +611,137 @@ def add_parties_and_attorneys(d, parties):
                     name=party['name'],
                     extra_info=party['extra_info'],
                 )
-        except Party.MultipleObjectsReturned:
-            continue
-        else:
-            if party['extra_info']:
-                p.extra_info = party['extra_info']
-                p.save()
+            matches.append(p)
 
         # If the party type doesn't exist, make a new one.
-        if not p.party_types.filter(docket=d, name=party['type']).exists():
-            PartyType.objects.create(docket=d, party=p, name=party['type'])
+        if (p.pk, party['type']) not in party_types:
+            new_party_types.append(
+                PartyType(docket=d, party=p, name=party['type']))
+            party_types.add((p.pk, party['type']))
 
         # Attorneys
         for atty in party.get('attorneys', []):
-            add_attorney(atty, p, d)
+            resolver.add_attorney(atty, p)
+
+    PartyType.objects.bulk_create(new_party_types)
+    resolver.save_roles()
+
+
+def merge_docket_entries(d, docket_entries, pq):
+    """Merge the docket entries from a parsed docket into the DB in bulk.
+
+    The existing entries and their documents are loaded with one query each,
+    compared in memory with the parsed entries, then new rows are inserted
+    with bulk_create and changed rows updated in batches, all in one
+    transaction. This costs a handful of queries however long the docket is.
+
+    :param d: The docket the entries are on. It must already be saved.
+    :param docket_entries: The docket entries from Juriscraper.
+    :param pq: The processing queue item, for logging.
+    """
+    # If an entry is listed twice, the last one wins.
+    entries = OrderedDict()
+    for docket_entry in docket_entries:
+        entries[int(docket_entry['document_number'])] = docket_entry
+
+    with transaction.atomic():
+        # Docket entries
+        existing_des = dict(
+            (de.entry_number, de) for de in
+            DocketEntry.objects.filter(docket=d, entry_number__in=entries)
+        )
+        new_des = []
+        changed_des = {}
+        for number, docket_entry in entries.items():
+            values = {
+                'description': docket_entry['description'],
+                'date_filed': docket_entry['date_filed'],
+            }
+            de = existing_des.get(number)
+            if de is None:
+                new_des.append(DocketEntry(docket=d, entry_number=number,
+                                           **values))
+            elif (de.description, de.date_filed) != (values['description'],
+                                                     values['date_filed']):
+                changed_des[de.pk] = values
+        bulk_update(DocketEntry, changed_des, ['description', 'date_filed'],
+                    date_modified=timezone.now())
+        if new_des:
+            DocketEntry.objects.bulk_create(new_des)
+            # bulk_create doesn't give us the IDs, so get them.
+            existing_des = dict(
+                (de.entry_number, de) for de in
+                DocketEntry.objects.filter(docket=d, entry_number__in=entries)
+            )
+
+        # Then the RECAPDocument objects. No attachments when uploading
+        # dockets. If we find one, fill in its pacer_doc_id if it's blank. If
+        # we can't find it, create it or log an error.
+        rds = {}
+        for rd in RECAPDocument.objects.filter(
+                docket_entry__docket=d,
+                docket_entry__entry_number__in=entries,
+                document_type=RECAPDocument.PACER_DOCUMENT):
+            rds.setdefault((rd.docket_entry_id, rd.document_number),
+                           []).append(rd)
+        pacer_doc_ids = [e['pacer_doc_id'] for e in entries.values()
+                         if e['pacer_doc_id']]
+        taken_ids = set(RECAPDocument.objects.filter(
+            pacer_doc_id__in=pacer_doc_ids,
+        ).values_list('pacer_doc_id', flat=True))
+
+        new_rds = []
+        filled_rds = {}
+        for number, docket_entry in entries.items():
+            de = existing_des[number]
+            pacer_doc_id = docket_entry['pacer_doc_id'] or None
+            matches = rds.get((de.pk, str(number)), [])
+            if len(matches) > 1:
+                logger.error(
+                    "Multiple recap documents found for document entry "
+                    "number'%s' while processing '%s'" % (number, pq)
+                )
+                continue
+            if pacer_doc_id in taken_ids:
+                if not matches:
+                    logger.warn(
+                        "Creating new document with pacer_doc_id of '%s' "
+                        "violates unique constraint on pacer_doc_id field." %
+                        pacer_doc_id
+                    )
+                continue
+            if matches:
+                if not matches[0].pacer_doc_id and pacer_doc_id:
+                    filled_rds[matches[0].pk] = {'pacer_doc_id': pacer_doc_id}
+                    taken_ids.add(pacer_doc_id)
+                continue
+            new_rds.append(RECAPDocument(
+                docket_entry=de,
+                document_type=RECAPDocument.PACER_DOCUMENT,
+                document_number=number,
+                pacer_doc_id=pacer_doc_id,
+                is_available=False,
+            ))
+            if pacer_doc_id:
+                taken_ids.add(pacer_doc_id)
+        bulk_update(RECAPDocument, filled_rds, ['pacer_doc_id'],
+                    date_modified=timezone.now())
+        try:
+            with transaction.atomic():
+                RECAPDocument.objects.bulk_create(new_rds)
+        except IntegrityError:
+            # Another upload took one of the pacer_doc_ids since we checked.
+            # Fall back to creating them one at a time.
+            for rd in new_rds:
+                try:
+                    with transaction.atomic():
+                        rd.save()
+                except IntegrityError:
+                    logger.warn(
+                        "Creating new document with pacer_doc_id of '%s' "
+                        "violates unique constraint on pacer_doc_id field." %
+                        rd.pacer_doc_id
+                    )
 
 
 @app.task
@@ -460,59 +815,7 @@ def process_recap_docket(pk):
         ContentFile(text),
     )
 
-    # Docket entries
-    for docket_entry in docket_data['docket_entries']:
-        try:
-            de, created = DocketEntry.objects.update_or_create(
-                docket=d,
-                entry_number=docket_entry['document_number'],
-                defaults={
-                    'description': docket_entry['description'],
-                    'date_filed': docket_entry['date_filed'],
-                }
-            )
-        except DocketEntry.MultipleObjectsReturned:
-            logger.error(
-                "Multiple docket entries found for document entry number '%s' "
-                "while processing '%s'" % (docket_entry['document_number'], pq)
-            )
-            continue
-
-        # Then make the RECAPDocument object. Try to find it. If we do, update
-        # the pacer_doc_id field if it's blank. If we can't find it, create it
-        # or throw an error.
-        try:
-            rd = RECAPDocument.objects.get(
-                docket_entry=de,
-                # No attachments when uploading dockets.
-                document_type=RECAPDocument.PACER_DOCUMENT,
-                document_number=docket_entry['document_number'],
-            )
-        except RECAPDocument.DoesNotExist:
-            try:
-                RECAPDocument.objects.create(
-                    docket_entry=de,
-                    # No attachments when uploading dockets.
-                    document_type=RECAPDocument.PACER_DOCUMENT,
-                    document_number=docket_entry['document_number'],
-                    pacer_doc_id=docket_entry['pacer_doc_id'],
-                    is_available=False,
-                )
-            except IntegrityError:
-                logger.warn(
-                    "Creating new document with pacer_doc_id of '%s' violates "
-                    "unique constraint on pacer_doc_id field." %
-                    docket_entry['pacer_doc_id']
-                )
-                continue
-        except RECAPDocument.MultipleObjectsReturned:
-            logger.error(
-                "Multiple recap documents found for document entry number'%s' "
-                "while processing '%s'" % (docket_entry['document_number'], pq)
-            )
-            continue
-        else:
-            rd.pacer_doc_id = rd.pacer_doc_id or pq.pacer_doc_id
+    merge_docket_entries(d, docket_data['docket_entries'], pq)
 
     add_parties_and_attorneys(d, docket_data['parties'])
     mark_pq_successful(pq, d_id=d.pk)
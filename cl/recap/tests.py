@@ -20,10 +20,11 @@ from rest_framework.status import (
 from rest_framework.test import APIClient
 
 from cl.people_db.models import Party, AttorneyOrganizationAssociation, \
-    Attorney, Role
+    Attorney, PartyType, Role
 from cl.recap.models import ProcessingQueue
 from cl.recap.tasks import process_recap_pdf, add_attorney, \
-    process_recap_docket, process_recap_attachment
+    add_parties_and_attorneys, process_recap_docket, \
+    process_recap_attachment, AttorneyResolver
 from cl.search.models import Docket, RECAPDocument, DocketEntry
 from cl.recap.management.commands.import_idb import Command
 
@@ -254,8 +255,8 @@ class DebugRecapUploadtest(TestCase):
         self.assertEqual(RECAPDocument.objects.count(), 0)
         mock.assert_not_called()
 
-    @mock.patch('cl.recap.tasks.add_attorney')
-    def test_debug_does_not_create_docket(self, add_atty_mock):
+    @mock.patch('cl.recap.tasks.AttorneyResolver')
+    def test_debug_does_not_create_docket(self, resolver_mock):
         """If debug is passed, do we avoid creating a docket?"""
         pq = ProcessingQueue.objects.create(
             court_id='scotus',
@@ -395,6 +396,40 @@ class RecapPdfTaskTest(TestCase):
         self.assertEqual(self.pq.error_message, "Successful upload! Nice work.")
         self.assertFalse(self.pq.filepath_local)
 
+    @mock.patch('cl.recap.tasks.extract_recap_pdf')
+    def test_duplicate_pdf_is_shared(self, mock):
+        """Is a PDF we already have on another docket linked, not extracted
+        again?"""
+        self.rd.delete()
+        other_docket = Docket.objects.create(source=0, court_id='scotus',
+                                             pacer_case_id='other')
+        other_de = DocketEntry.objects.create(docket=other_docket,
+                                              entry_number=1)
+        other_rd = RECAPDocument(
+            docket_entry=other_de,
+            document_type=1,
+            document_number=1,
+            pacer_doc_id='other',
+            sha1='dcfdea519bef494e9672b94a4a03a49d591e3762',
+            is_available=True,
+            page_count=3,
+            plain_text=u'Some text',
+            ocr_status=RECAPDocument.OCR_UNNECESSARY,
+        )
+        other_rd.filepath_local.save(self.filename,
+                                     ContentFile(self.file_content))
+        try:
+            rd = process_recap_pdf(self.pq.pk)
+            self.assertEqual(rd.page_count, 3)
+            self.assertEqual(rd.plain_text, u'Some text')
+            self.assertEqual(rd.ocr_status, RECAPDocument.OCR_UNNECESSARY)
+            self.assertTrue(os.path.samefile(rd.filepath_local.path,
+                                             other_rd.filepath_local.path))
+            rd.filepath_local.delete()
+        finally:
+            other_rd.filepath_local.delete()
+            other_docket.delete()
+
     def test_nothing_already_exists(self):
         """If a PDF is uploaded but there's no recap document and no docket do
         we fail?
@@ -512,8 +547,35 @@ class RecapAddAttorneyTest(TestCase):
         self.assertEqual(roles.count(), 2)
         self.assertNotIn(r, roles)
 
+    def test_resolver_reuses_attorneys_across_parties(self):
+        """Is an attorney who appears on several parties resolved once, and
+        linked to each of them?"""
+        p2 = Party.objects.create(name="Jane Doe")
+        resolver = AttorneyResolver(self.d, [self.atty, self.atty])
+        a1 = resolver.add_attorney(self.atty, self.p)
+        with self.assertNumQueries(0):
+            a2 = resolver.add_attorney(self.atty, p2)
+        resolver.save_roles()
+        self.assertEqual(a1.pk, a2.pk)
+        self.assertEqual(Attorney.objects.filter(name=self.atty_name).count(),
+                         1)
+        self.assertEqual(a1.roles.filter(party=p2).count(), 2)
+        self.assertEqual(a1.roles.count(), 4)
+
+    def test_parties_without_attorneys_on_a_dateless_docket(self):
+        """Can we add parties with no attorneys to a docket with no dates?"""
+        d = Docket.objects.create(source=0, court_id='scotus',
+                                  pacer_case_id='no-dates')
+        add_parties_and_attorneys(d, [{
+            'name': 'Jane Doe',
+            'extra_info': '',
+            'type': 'Plaintiff',
+            'attorneys': [],
+        }])
+        self.assertEqual(PartyType.objects.filter(docket=d).count(), 1)
 
-@mock.patch('cl.recap.tasks.add_attorney')
+
+@mock.patch('cl.recap.tasks.AttorneyResolver')
 class RecapDocketTaskTest(TestCase):
     def setUp(self):
         user = User.objects.get(username='recap')
@@ -535,14 +597,14 @@ class RecapDocketTaskTest(TestCase):
         self.pq.delete()
         Docket.objects.all().delete()
 
-    def test_parsing_docket_does_not_exist(self, add_atty_mock):
+    def test_parsing_docket_does_not_exist(self, resolver_mock):
         """Can we parse an HTML docket we have never seen before?"""
         d = process_recap_docket(self.pq.pk)
         self.assertEqual(d.source, Docket.RECAP)
         self.assertTrue(d.case_name)
         self.assertEqual(d.jury_demand, "None")
 
-    def test_parsing_docket_already_exists(self, add_atty_mock):
+    def test_parsing_docket_already_exists(self, resolver_mock):
         """Can we parse an HTML docket for a docket we have in the DB?"""
         existing_d = Docket.objects.create(
             source=Docket.DEFAULT,
@@ -554,7 +616,7 @@ class RecapDocketTaskTest(TestCase):
         self.assertTrue(d.case_name)
         self.assertEqual(existing_d.pacer_case_id, d.pacer_case_id)
 
-    def test_docket_and_de_already_exist(self, add_atty_mock):
+    def test_docket_and_de_already_exist(self, resolver_mock):
         """Can we parse if the docket and the docket entry already exist?"""
         existing_d = Docket.objects.create(
             source=Docket.DEFAULT,
@@ -582,6 +644,21 @@ class RecapDocketTaskTest(TestCase):
             msg="New docket entry didn't get created."
         )
 
+    def test_parsing_docket_twice_changes_nothing(self, resolver_mock):
+        """Does merging the same docket again leave its entries and documents
+        alone?"""
+        d = process_recap_docket(self.pq.pk)
+        de_count = d.docket_entries.count()
+        rd_count = RECAPDocument.objects.filter(docket_entry__docket=d).count()
+        self.assertGreater(de_count, 0)
+
+        d = process_recap_docket(self.pq.pk)
+        self.assertEqual(d.docket_entries.count(), de_count)
+        self.assertEqual(
+            RECAPDocument.objects.filter(docket_entry__docket=d).count(),
+            rd_count,
+        )
+
 
 @mock.patch('cl.recap.tasks.add_or_update_recap_document')
 class RecapAttachmentPageTaskTest(TestCase):
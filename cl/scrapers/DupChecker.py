@@ -5,7 +5,12 @@ from juriscraper.AbstractSite import logger
 
 class DupChecker(dict):
     def __init__(self, court, full_crawl=False, dup_threshold=5,
-                 *args, **kwargs):
+                 recent_sha1s=None, *args, **kwargs):
+        """
+        :param recent_sha1s: An LRUCache of SHA-1s known to be in the corpus
+        for the court. Pass the same one each time the court is scraped, and
+        the items that were seen last time won't be looked up again.
+        """
         self.full_crawl = full_crawl
         self.court = court
         self.dup_threshold = dup_threshold
@@ -13,6 +18,11 @@ class DupChecker(dict):
         self.dup_count = 0
         self.last_found_date = None
         self.emulate_break = False
+        self.recent_sha1s = recent_sha1s
+        # The values that were looked up with look_up_many, and the ones of
+        # those that were found, by lookup_by.
+        self.checked = {'sha1': set(), 'download_url': set()}
+        self.known = {'sha1': set(), 'download_url': set()}
         super(DupChecker, self).__init__(*args, **kwargs)
 
     def _increment(self, current_date):
@@ -27,6 +37,52 @@ class DupChecker(dict):
         self.dup_count = 0
         self.last_found_date = None
 
+    def _is_recent_sha1(self, sha1):
+        return (self.recent_sha1s is not None and
+                self.recent_sha1s.get(sha1) is not None)
+
+    def look_up_many(self, object_type, lookup_by, lookup_values):
+        """Check many values against the corpus in one query, so that
+        press_on doesn't have to query for each item.
+
+        :param object_type: The model to look in, like Opinion or Audio.
+        :param lookup_by: The field to look up, 'sha1' or 'download_url'.
+        :param lookup_values: The values to look up.
+        :return: The set of the values that are in the corpus.
+        """
+        if lookup_by not in self.checked:
+            raise NotImplementedError('Unknown lookup_by parameter.')
+        lookup_values = set(v for v in lookup_values if v)
+        to_check = lookup_values - self.checked[lookup_by]
+        if lookup_by == 'sha1':
+            recent = set(v for v in to_check if self._is_recent_sha1(v))
+            self.known['sha1'].update(recent)
+            self.checked['sha1'].update(recent)
+            to_check -= recent
+        if to_check:
+            found = set(object_type.objects.filter(**{
+                '%s__in' % lookup_by: to_check,
+            }).values_list(lookup_by, flat=True))
+            self.known[lookup_by].update(found)
+            self.checked[lookup_by].update(to_check)
+            if lookup_by == 'sha1' and self.recent_sha1s is not None:
+                for sha1 in found:
+                    self.recent_sha1s.set(sha1, True)
+        return lookup_values & self.known[lookup_by]
+
+    def add_known(self, sha1=None, download_url=None):
+        """Note an item that was just added to the corpus, so press_on knows
+        it's there without asking the DB again.
+        """
+        if sha1:
+            self.known['sha1'].add(sha1)
+            self.checked['sha1'].add(sha1)
+            if self.recent_sha1s is not None:
+                self.recent_sha1s.set(sha1, True)
+        if download_url:
+            self.known['download_url'].add(download_url)
+            self.checked['download_url'].add(download_url)
+
     def update_site_hash(self, hash):
         self.url_hash.sha1 = hash
         self.url_hash.save()
@@ -93,13 +149,19 @@ class DupChecker(dict):
         if self.emulate_break:
             return False
 
-        # check for a duplicate in the db.
-        if lookup_by == 'sha1':
+        # check for a duplicate, first in what we already know, then in the
+        # db.
+        if lookup_by not in self.checked:
+            raise NotImplementedError('Unknown lookup_by parameter.')
+        if lookup_value in self.known[lookup_by] or (
+                lookup_by == 'sha1' and self._is_recent_sha1(lookup_value)):
+            exists = True
+        elif lookup_value in self.checked[lookup_by]:
+            exists = False
+        elif lookup_by == 'sha1':
             exists = object_type.objects.filter(sha1=lookup_value).exists()
-        elif lookup_by == 'download_url':
-            exists = object_type.objects.filter(download_url=lookup_value).exists()
         else:
-            raise NotImplementedError('Unknown lookup_by parameter.')
+            exists = object_type.objects.filter(download_url=lookup_value).exists()
 
         if exists:
             logger.info('Duplicate found on date: %s, with lookup value: %s' %
@@ -2,13 +2,16 @@ import hashlib
 import random
 import signal
 import sys
+import threading
 import time
 import traceback
 from datetime import date
+from multiprocessing.pool import ThreadPool
 
 from celery.task.sets import subtask
 from django.core.files.base import ContentFile
 from django.core.management.base import CommandError
+from django.db import connection
 from django.utils.encoding import force_bytes
 from juriscraper.lib.importer import build_module_list
 from juriscraper.lib.string_utils import CaseNameTweaker
@@ -17,11 +20,13 @@ from cl.alerts.models import RealTimeQueue
 from cl.lib.command_utils import VerboseCommand, logger
 from cl.lib.import_lib import get_candidate_judges
 from cl.lib.string_utils import trunc
+from cl.lib.utils import LRUCache
 from cl.scrapers.DupChecker import DupChecker
 from cl.scrapers.models import ErrorLog
 from cl.scrapers.tasks import extract_doc_content, extract_by_ocr
 from cl.scrapers.utils import (
-    get_extension, get_binary_content, signal_handler
+    BinaryPrefetcher, HostLimiter, get_extension, make_scraper_session,
+    signal_handler,
 )
 from cl.search.models import Court
 from cl.search.models import Docket
@@ -31,6 +36,16 @@ from cl.search.models import OpinionCluster
 # for use in catching the SIGINT (Ctrl+4)
 die_now = False
 
+# Politeness limits for downloading items. Courts that share a host share
+# these limits.
+DOWNLOADS_PER_HOST = 2
+SECONDS_BETWEEN_DOWNLOADS = 0.5
+# How many of a court's items to download ahead of the one being processed.
+PREFETCH_WINDOW = 4
+# How many SHA-1s of a court's items to remember between passes of the
+# daemon, so they needn't be looked up again.
+RECENT_SHA1S_PER_COURT = 500
+
 
 class Command(VerboseCommand):
     help = 'Runs the Juriscraper toolkit against one or many jurisdictions.'
@@ -38,6 +53,14 @@ class Command(VerboseCommand):
     def __init__(self, stdout=None, stderr=None, no_color=False):
         super(Command, self).__init__(stdout=None, stderr=None, no_color=False)
         self.cnt = CaseNameTweaker()
+        self.host_limiter = HostLimiter(DOWNLOADS_PER_HOST,
+                                        SECONDS_BETWEEN_DOWNLOADS)
+        self.lock = threading.Lock()
+        # Sessions are kept per court, so their connections are reused on
+        # every pass of the daemon.
+        self.sessions = {}
+        self.recent_sha1s = {}
+        self.running = set()
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -76,6 +99,13 @@ class Command(VerboseCommand):
             default=False,
             help="Disable duplicate aborting.",
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help=('How many courts to scrape at the same time, so that a '
+                  'slow court does not hold up the others. Default is 4.'),
+        )
 
     def make_objects(self, item, court, sha1_hash, content):
         """Takes the meta data from the scraper and associates it with objects.
@@ -164,6 +194,67 @@ class Command(VerboseCommand):
         if not backscrape:
             RealTimeQueue.objects.create(item_type='o', item_pk=opinion.pk)
 
+    def get_session(self, site):
+        """Get the pooled session for a site's court, making it if needed."""
+        with self.lock:
+            if site.court_id not in self.sessions:
+                self.sessions[site.court_id] = make_scraper_session(
+                    site._get_adapter_instance())
+            return self.sessions[site.court_id]
+
+    def get_recent_sha1s(self, site):
+        """Get the cache of the SHA-1s recently seen for a site's court."""
+        with self.lock:
+            if site.court_id not in self.recent_sha1s:
+                self.recent_sha1s[site.court_id] = LRUCache(
+                    maxsize=RECENT_SHA1S_PER_COURT)
+            return self.recent_sha1s[site.court_id]
+
+    def download_items(self, site, dup_checker, object_type, known_urls):
+        """Download and hash a site's items ahead of processing them.
+
+        Items with download URLs that are already in the corpus are skipped.
+        When an item's SHA-1 hasn't been checked against the corpus yet, it's
+        checked in one query with those of the downloads ahead of it that are
+        already done.
+
+        :param site: The parsed Site.
+        :param dup_checker: The DupChecker for the site.
+        :param object_type: The model the items become, like Opinion.
+        :param known_urls: The download URLs that are in the corpus.
+        :return: A generator of (msg, content, sha1_hash) triples, one per
+        item with a download URL that isn't known, in the order of the items.
+        If msg isn't blank, the item couldn't be downloaded.
+        """
+        def hash_download(download):
+            msg, r = download
+            if msg:
+                return msg, None, None
+            content = site.cleanup_content(r.content)
+            # request.content is sometimes a str, sometimes unicode, so
+            # force it all to be bytes, pleasing hashlib.
+            sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
+            return '', content, sha1_hash
+
+        prefetcher = BinaryPrefetcher(
+            [item['download_urls'] for item in site if
+             item['download_urls'] not in known_urls],
+            site.cookies,
+            site._get_adapter_instance(),
+            method=site.method,
+            session=self.get_session(site),
+            limiter=self.host_limiter,
+            window=PREFETCH_WINDOW,
+            transform=hash_download,
+        )
+        for msg, content, sha1_hash in prefetcher:
+            if sha1_hash and sha1_hash not in dup_checker.checked['sha1']:
+                dup_checker.look_up_many(
+                    object_type, 'sha1',
+                    [sha1_hash] + [sha1 for _, _, sha1 in prefetcher.ready()],
+                )
+            yield msg, content, sha1_hash
+
     def scrape_court(self, site, full_crawl=False):
         download_error = False
         # Get the court object early for logging
@@ -171,18 +262,35 @@ class Command(VerboseCommand):
         court_str = site.court_id.split('.')[-1].split('_')[0]
         court = Court.objects.get(pk=court_str)
 
-        dup_checker = DupChecker(court, full_crawl=full_crawl)
+        dup_checker = DupChecker(court, full_crawl=full_crawl,
+                                 recent_sha1s=self.get_recent_sha1s(site))
         abort = dup_checker.abort_by_url_hash(site.url, site.hash)
         if not abort:
             if site.cookies:
                 logger.info("Using cookies: %s" % site.cookies)
+            # Items with download URLs that are in the corpus are duplicates.
+            # Find them all in one query so they needn't be downloaded.
+            known_urls = dup_checker.look_up_many(
+                Opinion, 'download_url',
+                [item['download_urls'] for item in site])
+            downloads = self.download_items(site, dup_checker, Opinion,
+                                            known_urls)
             for i, item in enumerate(site):
-                msg, r = get_binary_content(
-                    item['download_urls'],
-                    site.cookies,
-                    site._get_adapter_instance(),
-                    method=site.method
-                )
+                current_date = item['case_dates']
+                try:
+                    next_date = site[i + 1]['case_dates']
+                except IndexError:
+                    next_date = None
+
+                if item['download_urls'] in known_urls:
+                    dup_checker.press_on(Opinion, current_date, next_date,
+                                         lookup_value=item['download_urls'],
+                                         lookup_by='download_url')
+                    if dup_checker.emulate_break:
+                        break
+                    continue
+
+                msg, content, sha1_hash = next(downloads)
                 if msg:
                     logger.warn(msg)
                     ErrorLog(log_level='WARNING',
@@ -190,17 +298,6 @@ class Command(VerboseCommand):
                              message=msg).save()
                     continue
 
-                content = site.cleanup_content(r.content)
-
-                current_date = item['case_dates']
-                try:
-                    next_date = site[i + 1]['case_dates']
-                except IndexError:
-                    next_date = None
-
-                # request.content is sometimes a str, sometimes unicode, so
-                # force it all to be bytes, pleasing hashlib.
-                sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
                 if (court_str == 'nev' and
                         item['precedential_statuses'] == 'Unpublished'):
                     # Nevada's non-precedential cases have different SHA1
@@ -238,6 +335,7 @@ class Command(VerboseCommand):
                         },
                         index=False
                     )
+                    dup_checker.add_known(sha1_hash, item['download_urls'])
                     extract_doc_content.delay(
                         opinion.pk,
                         callback=subtask(extract_by_ocr),
@@ -259,6 +357,64 @@ class Command(VerboseCommand):
         site = mod.Site().parse()
         self.scrape_court(site, full_crawl)
 
+    def scrape_module(self, module_string, full_crawl, slots):
+        """Import a scraper module and scrape its court, logging any crash.
+
+        This is run in a worker thread. The same module is never scraped twice
+        at once; if it's still going from the last pass, it's skipped.
+
+        :param module_string: The module, like
+        'juriscraper.opinions.united_states.federal_appellate.ca1'.
+        :param full_crawl: Whether to disable duplicate aborting.
+        :param slots: The semaphore of worker slots to release when done.
+        """
+        with self.lock:
+            if module_string in self.running:
+                logger.info("%s is still running from the last pass. "
+                            "Skipping it." % module_string)
+                slots.release()
+                return
+            self.running.add(module_string)
+
+        package, module = module_string.rsplit('.', 1)
+        # noinspection PyBroadException
+        try:
+            mod = __import__(
+                "%s.%s" % (package, module),
+                globals(),
+                locals(),
+                [module]
+            )
+            self.parse_and_scrape_site(mod, full_crawl)
+        except Exception as e:
+            # noinspection PyBroadException
+            try:
+                msg = ('********!! CRAWLER DOWN !!***********\n'
+                       '*****scrape_court method failed!*****\n'
+                       '********!! ACTION NEEDED !!**********\n%s' %
+                       traceback.format_exc())
+                logger.critical(msg)
+
+                # opinions.united_states.federal.ca9_u --> ca9
+                court_str = module.split('_')[0]
+                court = Court.objects.get(pk=court_str)
+                ErrorLog(
+                    log_level='CRITICAL',
+                    court=court,
+                    message=msg
+                ).save()
+            except Exception as e:
+                # This is very important. Without this, an exception
+                # above will crash the caller.
+                pass
+        finally:
+            # Each worker thread has its own DB connection. Don't leave it
+            # open while the thread waits for its next court.
+            connection.close()
+            with self.lock:
+                self.running.discard(module_string)
+            slots.release()
+
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
         global die_now
@@ -274,55 +430,36 @@ class Command(VerboseCommand):
         logger.info("Starting up the scraper.")
         num_courts = len(module_strings)
         wait = (options['rate'] * 60) / num_courts
+        # Courts are started `wait` seconds apart, as before, but each is
+        # scraped in a worker so a slow one doesn't hold up the rest. When
+        # every worker is busy, the next court waits for one to free up.
+        workers = max(options['workers'], 1)
+        pool = ThreadPool(workers)
+        slots = threading.BoundedSemaphore(workers)
         i = 0
         while i < num_courts:
             # this catches SIGTERM, so the code can be killed safely.
             if die_now:
+                logger.info("Finishing the courts that are running.")
+                pool.close()
+                pool.join()
                 logger.info("The scraper has stopped.")
                 sys.exit(1)
 
-            package, module = module_strings[i].rsplit('.', 1)
-
-            mod = __import__(
-                "%s.%s" % (package, module),
-                globals(),
-                locals(),
-                [module]
-            )
-            # noinspection PyBroadException
-            try:
-                self.parse_and_scrape_site(mod, options['full_crawl'])
-            except Exception as e:
-                # noinspection PyBroadException
-                try:
-                    msg = ('********!! CRAWLER DOWN !!***********\n'
-                           '*****scrape_court method failed!*****\n'
-                           '********!! ACTION NEEDED !!**********\n%s' %
-                           traceback.format_exc())
-                    logger.critical(msg)
-
-                    # opinions.united_states.federal.ca9_u --> ca9
-                    court_str = mod.Site.__module__.split('.')[-1].split('_')[0]
-                    court = Court.objects.get(pk=court_str)
-                    ErrorLog(
-                        log_level='CRITICAL',
-                        court=court,
-                        message=msg
-                    ).save()
-                except Exception as e:
-                    # This is very important. Without this, an exception
-                    # above will crash the caller.
-                    pass
-            finally:
-                time.sleep(wait)
-                last_court_in_list = (i == (num_courts - 1))
-                if last_court_in_list and options['daemon']:
-                    # Start over...
-                    logger.info("All jurisdictions done. Looping back to "
-                                "the beginning because daemon mode is enabled.")
-                    i = 0
-                else:
-                    i += 1
-
+            slots.acquire()
+            pool.apply_async(self.scrape_module,
+                             (module_strings[i], options['full_crawl'], slots))
+            time.sleep(wait)
+            last_court_in_list = (i == (num_courts - 1))
+            if last_court_in_list and options['daemon']:
+                # Start over...
+                logger.info("All jurisdictions dispatched. Looping back to "
+                            "the beginning because daemon mode is enabled.")
+                i = 0
+            else:
+                i += 1
+
+        pool.close()
+        pool.join()
         logger.info("The scraper has stopped.")
         sys.exit(0)
@@ -1,10 +1,8 @@
-import hashlib
 import random
 import traceback
 from datetime import date
 
 from django.core.files.base import ContentFile
-from django.utils.encoding import force_bytes
 
 from cl.alerts.models import RealTimeQueue
 from cl.audio.models import Audio
@@ -15,7 +13,7 @@ from cl.scrapers.DupChecker import DupChecker
 from cl.scrapers.management.commands import cl_scrape_opinions
 from cl.scrapers.models import ErrorLog
 from cl.scrapers.tasks import process_audio_file
-from cl.scrapers.utils import get_extension, get_binary_content
+from cl.scrapers.utils import get_extension
 from cl.search.models import Court, Docket
 
 
@@ -101,18 +99,35 @@ class Command(cl_scrape_opinions.Command):
         court_str = site.court_id.split('.')[-1].split('_')[0]
         court = Court.objects.get(pk=court_str)
 
-        dup_checker = DupChecker(court, full_crawl=full_crawl)
+        dup_checker = DupChecker(court, full_crawl=full_crawl,
+                                 recent_sha1s=self.get_recent_sha1s(site))
         abort = dup_checker.abort_by_url_hash(site.url, site.hash)
         if not abort:
             if site.cookies:
                 logger.info("Using cookies: %s" % site.cookies)
+            # Items with download URLs that are in the corpus are duplicates.
+            # Find them all in one query so they needn't be downloaded.
+            known_urls = dup_checker.look_up_many(
+                Audio, 'download_url',
+                [item['download_urls'] for item in site])
+            downloads = self.download_items(site, dup_checker, Audio,
+                                            known_urls)
             for i, item in enumerate(site):
-                msg, r = get_binary_content(
-                    item['download_urls'],
-                    site.cookies,
-                    site._get_adapter_instance(),
-                    method=site.method
-                )
+                current_date = item['case_dates']
+                try:
+                    next_date = site[i + 1]['case_dates']
+                except IndexError:
+                    next_date = None
+
+                if item['download_urls'] in known_urls:
+                    dup_checker.press_on(Audio, current_date, next_date,
+                                         lookup_value=item['download_urls'],
+                                         lookup_by='download_url')
+                    if dup_checker.emulate_break:
+                        break
+                    continue
+
+                msg, content, sha1_hash = next(downloads)
                 if msg:
                     logger.warn(msg)
                     ErrorLog(log_level='WARNING',
@@ -120,17 +135,6 @@ class Command(cl_scrape_opinions.Command):
                              message=msg).save()
                     continue
 
-                content = site.cleanup_content(r.content)
-
-                current_date = item['case_dates']
-                try:
-                    next_date = site[i + 1]['case_dates']
-                except IndexError:
-                    next_date = None
-
-                # request.content is sometimes a str, sometimes unicode, so
-                # force it all to be bytes, pleasing hashlib.
-                sha1_hash = hashlib.sha1(force_bytes(content)).hexdigest()
                 onwards = dup_checker.press_on(
                     Audio,
                     current_date,
@@ -162,6 +166,7 @@ class Command(cl_scrape_opinions.Command):
                         },
                         index=False,
                     )
+                    dup_checker.add_known(sha1_hash, item['download_urls'])
                     process_audio_file.apply_async(
                         (audio_file.pk,),
                         countdown=random.randint(0, 3600)
@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import logging
 import os
+import shutil
 import subprocess
+import threading
+import time
 import traceback
 import uuid
-from tempfile import NamedTemporaryFile
+from collections import OrderedDict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from tempfile import mkdtemp
 
 import eyed3
 from PyPDF2 import PdfFileReader
@@ -22,6 +29,7 @@ from cl.audio.models import Audio
 from cl.celery import app
 from cl.citations.tasks import update_document_by_id
 from cl.custom_filters.templatetags.text_filters import best_case_name
+from cl.lib.db_tools import bulk_update
 from cl.lib.mojibake import fix_mojibake
 from cl.lib.recap_utils import needs_ocr
 from cl.lib.string_utils import anonymize, trunc
@@ -29,8 +37,16 @@ from cl.lib.utils import is_iter
 from cl.scrapers.models import ErrorLog
 from cl.search.models import Opinion, RECAPDocument
 
+logger = logging.getLogger(__name__)
+
 DEVNULL = open('/dev/null', 'w')
 
+# How many seconds pdftotext gets before it's killed.
+PDFTOTEXT_TIMEOUT = 5 * 60
+
+# How many pages each OCR worker rasterizes with a single ghostscript call.
+OCR_PAGES_PER_RANGE = 10
+
 
 def get_clean_body_content(content):
     """Parse out the body from an html string, clean it up, and send it along.
@@ -154,10 +170,14 @@ def extract_from_wpd(opinion, path):
 
 def convert_file_to_txt(path):
     tesseract_command = ['tesseract', path, 'stdout', '-l', 'eng']
+    # Pages are already recognized in parallel, so keep each Tesseract to a
+    # single thread rather than having them fight over the cores.
+    env = dict(os.environ, OMP_THREAD_LIMIT='1')
     p = subprocess.Popen(
         tesseract_command,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
+        env=env,
     )
     return p.communicate()[0].decode('utf-8')
 
@@ -271,54 +291,173 @@ def extract_doc_content(pk, callback=None, citation_countdown=0):
     return opinion
 
 
-@app.task
-def extract_recap_pdf(pks, skip_ocr=False, check_if_needed=True):
-    """Extract the contents from a RECAP PDF if necessary."""
-    if not is_iter(pks):
-        pks = [pks]
+def run_pdftotext(path, timeout=PDFTOTEXT_TIMEOUT):
+    """Run pdftotext on a file, killing it if it takes too long.
 
-    processed = []
-    for pk in pks:
-        rd = RECAPDocument.objects.get(pk=pk)
-        if check_if_needed and not rd.needs_extraction:
-            # Early abort if the item doesn't need extraction and the user
-            # hasn't disabled early abortion.
-            processed.append(pk)
-            continue
-        path = rd.filepath_local.path
-        process = make_pdftotext_process(path)
+    :param path: The path to the PDF.
+    :param timeout: How many seconds to give pdftotext.
+    :return: The text of the PDF, or None if pdftotext timed out.
+    """
+    process = make_pdftotext_process(path)
+    killed = []
+
+    def kill():
+        killed.append(True)
+        try:
+            process.kill()
+        except OSError:
+            # It finished just in time.
+            pass
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
         content, err = process.communicate()
+    finally:
+        timer.cancel()
+    if killed:
+        return None
+    return content
+
+
+def extract_recap_text(rd, content, skip_ocr):
+    """Work out the text of a RECAP PDF from its pdftotext output, doing OCR
+    on any pages that lack text if requested.
+
+    Sets the ocr_status of the RECAPDocument, and its page_count if it's not
+    known yet, but doesn't save it.
 
-        if needs_ocr(content):
-            if not skip_ocr:
-                # probably an image PDF. Send it to OCR.
-                success, content = extract_by_ocr(path)
-                if success:
-                    rd.ocr_status = RECAPDocument.OCR_COMPLETE
-                elif content == u'' or not success:
-                    content = u'Unable to extract document content.'
-                    rd.ocr_status = RECAPDocument.OCR_FAILED
+    :param rd: The RECAPDocument.
+    :param content: The output of pdftotext for the document.
+    :param skip_ocr: Whether to mark documents as needing OCR instead of
+    doing it.
+    :return: The text of the document.
+    """
+    path = rd.filepath_local.path
+
+    # pdftotext ends every page with a form feed.
+    pages = content.split('\f')
+    if len(pages) > 1 and pages[-1] == '':
+        pages.pop()
+    if rd.page_count is None:
+        # Count the pages while we're here instead of parsing the PDF
+        # again. Fall back to parsing it if pdftotext choked on it.
+        rd.page_count = content.count('\f') or get_page_count(path, 'pdf')
+    empty_pages = [i + 1 for i, page in enumerate(pages) if
+                   needs_ocr(page)]
+
+    if len(empty_pages) == len(pages):
+        if not skip_ocr:
+            # probably an image PDF. Send it to OCR.
+            success, content = extract_by_ocr(path)
+            if success:
+                rd.ocr_status = RECAPDocument.OCR_COMPLETE
+            elif content == u'' or not success:
+                content = u'Unable to extract document content.'
+                rd.ocr_status = RECAPDocument.OCR_FAILED
+        else:
+            content = u''
+            rd.ocr_status = RECAPDocument.OCR_NEEDED
+    elif empty_pages:
+        # Some pages have text and others are images. Keep the text we
+        # have and only OCR the images.
+        if not skip_ocr:
+            ocr_txt = ocr_pdf_pages(path, empty_pages)
+            if ocr_txt is not None:
+                for page_number, txt in ocr_txt.items():
+                    pages[page_number - 1] = txt
+                rd.ocr_status = RECAPDocument.OCR_COMPLETE
             else:
-                content = u''
-                rd.ocr_status = RECAPDocument.OCR_NEEDED
+                rd.ocr_status = RECAPDocument.OCR_FAILED
         else:
-            rd.ocr_status = RECAPDocument.OCR_UNNECESSARY
-
-        rd.plain_text, _ = anonymize(content)
-        # Do not do indexing here. Creates race condition in celery.
-        rd.save(index=False, do_extraction=False)
-        processed.append(pk)
+            rd.ocr_status = RECAPDocument.OCR_NEEDED
+        content = u'\f'.join(
+            page if isinstance(page, unicode) else
+            page.decode('utf-8', 'ignore') for page in pages
+        )
+    else:
+        rd.ocr_status = RECAPDocument.OCR_UNNECESSARY
+    return content
 
-    return processed
 
+@app.task
+def extract_recap_pdf(pks, skip_ocr=False, check_if_needed=True):
+    """Extract the contents from RECAP PDFs if necessary.
+
+    The documents are loaded in one query, pdftotext is run on them
+    concurrently, one process per core, and the results are written back
+    with one update per batch. OCR, if needed, is done one document at a
+    time, since it's parallel already.
+
+    :param pks: A RECAPDocument PK or a list of them.
+    :param skip_ocr: Whether to mark documents as needing OCR instead of
+    doing it.
+    :param check_if_needed: Whether to skip documents that don't need
+    extraction.
+    :return: The PKs that were processed, in order. Documents that timed out
+    in pdftotext are left out.
+    """
+    if not is_iter(pks):
+        pks = [pks]
 
-def rasterize_pdf(path, destination):
+    start = time.time()
+    rds = RECAPDocument.objects.filter(pk__in=pks).defer('plain_text')
+    rds = {rd.pk: rd for rd in rds}
+    to_extract = [rds[pk] for pk in pks if pk in rds]
+    if check_if_needed:
+        # Early abort for items that don't need extraction unless the user
+        # has disabled early abortion.
+        to_extract = [rd for rd in to_extract if rd.needs_extraction]
+
+    get_text = lambda rd: run_pdftotext(rd.filepath_local.path)
+    if len(to_extract) > 1:
+        pool = ThreadPool(min(len(to_extract), cpu_count()))
+        try:
+            contents = pool.map(get_text, to_extract)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        contents = map(get_text, to_extract)
+
+    timed_out = set()
+    rows = {}
+    for rd, content in zip(to_extract, contents):
+        if content is None:
+            logger.warning("pdftotext timed out on RECAPDocument %s." % rd.pk)
+            timed_out.add(rd.pk)
+            continue
+        content = extract_recap_text(rd, content, skip_ocr)
+        rows[rd.pk] = {
+            'plain_text': anonymize(content)[0],
+            'ocr_status': rd.ocr_status,
+            'page_count': rd.page_count,
+        }
+    # Do not do indexing here. Creates race condition in celery.
+    bulk_update(RECAPDocument, rows,
+                ['plain_text', 'ocr_status', 'page_count'],
+                date_modified=now())
+
+    if len(pks) > 1:
+        elapsed = time.time() - start
+        logger.info("Extracted %s of %s RECAP documents in %.1fs (%.1f/s)." %
+                    (len(rows), len(pks), elapsed,
+                     len(rows) / max(elapsed, 0.001)))
+    return [pk for pk in pks if pk in rds and pk not in timed_out]
+
+
+def rasterize_pdf(path, destination, first_page=None, last_page=None):
     """Convert the PDF into a multipage Tiff file.
 
     This function uses ghostscript for processing and borrows heavily from:
 
         https://github.com/jbarlow83/OCRmyPDF/blob/636d1903b35fed6b07a01af53769fea81f388b82/ocrmypdf/ghostscript.py#L11
 
+    :param path: The path to the PDF.
+    :param destination: Where to write the Tiff. If it contains a format
+    like %04d, ghostscript writes one file per page instead.
+    :param first_page: The first page to rasterize, if not the first one.
+    :param last_page: The last page to rasterize, if not the last one.
     """
     # gs docs, see: http://ghostscript.com/doc/7.07/Use.htm
     # gs devices, see: http://ghostscript.com/doc/current/Devices.htm
@@ -336,9 +475,12 @@ def rasterize_pdf(path, destination):
         '-sDEVICE=tiffgray',
         '-sCompression=lzw',
         '-r300x300',
-        '-o', destination,
-        path,
     ]
+    if first_page is not None:
+        gs.append('-dFirstPage=%d' % first_page)
+    if last_page is not None:
+        gs.append('-dLastPage=%d' % last_page)
+    gs.extend(['-o', destination, path])
     p = subprocess.Popen(gs, close_fds=True, stdout=subprocess.PIPE,
                          stderr=subprocess.PIPE, universal_newlines=True)
     stdout, stderr = p.communicate()
@@ -362,20 +504,115 @@ def cleanup_ocr_text(txt):
     return txt
 
 
+def make_page_ranges(page_numbers, max_size):
+    """Group page numbers into runs of consecutive pages.
+
+    :param page_numbers: An iterable of page numbers.
+    :param max_size: The most pages to put in a single range.
+    :return: A list of (first_page, last_page) tuples, in order.
+    """
+    ranges = []
+    for page_number in sorted(set(page_numbers)):
+        if ranges and ranges[-1][1] == page_number - 1 and \
+                page_number - ranges[-1][0] < max_size:
+            ranges[-1][1] = page_number
+        else:
+            ranges.append([page_number, page_number])
+    return [tuple(r) for r in ranges]
+
+
+def ocr_page_range(path, first_page=None, last_page=None, progress=None):
+    """Rasterize a range of pages in a PDF and OCR them one at a time.
+
+    :param path: The path to the PDF.
+    :param first_page: The first page to OCR, or None to start at the
+    beginning.
+    :param last_page: The last page to OCR, or None to go to the end.
+    :param progress: A function to call with the page number and its text as
+    each page is finished.
+    :return: A list of (page_number, text) tuples, or None if the pages
+    couldn't be rasterized.
+    """
+    tmp_dir = mkdtemp(prefix='ocr_')
+    try:
+        out, err, returncode = rasterize_pdf(
+            path, os.path.join(tmp_dir, 'page-%04d.tiff'), first_page,
+            last_page,
+        )
+        if returncode != 0:
+            return None
+
+        pages = []
+        for i, filename in enumerate(sorted(os.listdir(tmp_dir))):
+            page_number = (first_page or 1) + i
+            txt = convert_file_to_txt(os.path.join(tmp_dir, filename))
+            txt = cleanup_ocr_text(txt).rstrip(u'\f')
+            pages.append((page_number, txt))
+            if progress is not None:
+                progress(page_number, txt)
+        return pages
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def ocr_pdf_pages(path, page_numbers=None, progress=None):
+    """OCR the pages of a PDF concurrently.
+
+    The pages are split into ranges that are rasterized and recognized at
+    the same time, one range per core. The work happens in the gs and
+    tesseract subprocesses, so threads are enough to drive them, and unlike
+    a multiprocessing pool, they work inside daemonic celery workers.
+
+    :param path: The path to the PDF.
+    :param page_numbers: The pages to OCR, or None for all of them.
+    :param progress: A function to call with the page number and its text as
+    each page is finished. Pages finish out of order.
+    :return: An OrderedDict mapping page numbers to their text, in page
+    order, or None if any of the pages couldn't be rasterized.
+    """
+    if page_numbers is None:
+        page_count = get_page_count(path, 'pdf')
+        if page_count:
+            page_numbers = range(1, page_count + 1)
+    if page_numbers is None:
+        # Couldn't count the pages. Let ghostscript do the whole thing.
+        ranges = [(None, None)]
+    else:
+        ranges = make_page_ranges(page_numbers, OCR_PAGES_PER_RANGE)
+
+    pool = ThreadPool(min(len(ranges), cpu_count()))
+    try:
+        results = pool.map(
+            lambda r: ocr_page_range(path, r[0], r[1], progress),
+            ranges,
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+    if any(result is None for result in results):
+        return None
+    pages = OrderedDict()
+    for result in results:
+        pages.update(result)
+    return pages
+
+
 @app.task
-def extract_by_ocr(path):
-    """Extract the contents of a PDF using OCR."""
+def extract_by_ocr(path, progress=None):
+    """Extract the contents of a PDF using OCR.
+
+    :param path: The path to the PDF.
+    :param progress: A function to call with the page number and its text as
+    each page is finished. See ocr_pdf_pages.
+    """
     fail_msg = (u"Unable to extract the content from this file. Please try "
                 u"reading the original.")
-    with NamedTemporaryFile(prefix='ocr_', suffix=".tiff") as tmp:
-        out, err, returncode = rasterize_pdf(path, tmp.name)
-        if returncode != 0:
-            return False, fail_msg
-
-        txt = convert_file_to_txt(tmp.name)
-        txt = cleanup_ocr_text(txt)
+    pages = ocr_pdf_pages(path, progress=progress)
+    if pages is None:
+        return False, fail_msg
 
-    return True, txt
+    return True, u'\f'.join(pages.values())
 
 
 def set_mp3_meta_data(audio_obj, mp3_path):
@@ -1,25 +1,32 @@
 # coding=utf-8
 import os
+import subprocess
+import time
 from datetime import timedelta
 
+import mock
 from celery.task.sets import subtask
 from django.conf import settings
+from django.core.files.base import ContentFile
 from django.test import TestCase, override_settings
 from django.utils.timezone import now
 
 from cl.audio.models import Audio
 from cl.lib.test_helpers import IndexedSolrTestCase
+from cl.lib.utils import LRUCache
 from cl.scrapers.DupChecker import DupChecker
 from cl.scrapers.management.commands import (
     cl_report_scrape_status, cl_scrape_opinions, cl_scrape_oral_arguments
 )
 from cl.scrapers.models import UrlHash, ErrorLog
 from cl.scrapers.tasks import (
-    extract_from_txt, extract_doc_content, extract_by_ocr, process_audio_file
+    extract_from_txt, extract_doc_content, extract_by_ocr, extract_recap_pdf,
+    make_page_ranges, process_audio_file, run_pdftotext
 )
 from cl.scrapers.test_assets import test_opinion_scraper, test_oral_arg_scraper
-from cl.scrapers.utils import get_extension
-from cl.search.models import Court, Opinion
+from cl.scrapers.utils import BinaryPrefetcher, HostLimiter, get_extension
+from cl.search.models import Court, Docket, DocketEntry, Opinion, \
+    RECAPDocument
 
 
 class IngestionTest(IndexedSolrTestCase):
@@ -93,6 +100,100 @@ class ExtractionTest(TestCase):
         self.assertIn(u'¶  1.  DOOLEY, J.   Plaintiffs', content,
                       "Issue extracting/encoding text from file at: %s" % path)
 
+    def test_making_ocr_page_ranges(self):
+        """Are pages split into capped runs of consecutive pages?"""
+        self.assertEqual(
+            make_page_ranges([7, 1, 2, 3, 4, 5, 9, 10], 3),
+            [(1, 3), (4, 5), (7, 7), (9, 10)],
+        )
+
+    @mock.patch('cl.scrapers.tasks.make_pdftotext_process')
+    def test_pdftotext_timeout(self, mock_process):
+        """Is a hung pdftotext killed?"""
+        mock_process.return_value = subprocess.Popen(
+            ['sleep', '10'], stdout=subprocess.PIPE)
+        self.assertIsNone(run_pdftotext('/dev/null', timeout=0.1))
+
+
+class PrefetchTest(TestCase):
+    @mock.patch('cl.scrapers.utils.get_binary_content')
+    def test_prefetch_keeps_order(self, mock_get):
+        """Are downloads handed back in order, even when they finish out of
+        order?"""
+        def fake_get(url, *args, **kwargs):
+            time.sleep(0.05 * (5 - int(url)))
+            return '', url
+        mock_get.side_effect = fake_get
+        urls = [str(i) for i in range(5)]
+        results = list(BinaryPrefetcher(urls, None, None, window=3))
+        self.assertEqual([r for msg, r in results], urls)
+
+    def test_host_limiter_spaces_requests(self):
+        """Do requests to one host start at least the interval apart?"""
+        limiter = HostLimiter(max_per_host=2, min_interval=0.1)
+        starts = []
+        for _ in range(3):
+            with limiter.limit('https://www.example.com/a.pdf'):
+                starts.append(time.time())
+        self.assertGreaterEqual(starts[2] - starts[0], 0.19)
+
+
+class RecapExtractionTest(TestCase):
+    fixtures = ['test_court.json']
+
+    def setUp(self):
+        docket = Docket.objects.create(source=Docket.RECAP, court_id='test',
+                                       pacer_case_id='asdf')
+        de = DocketEntry.objects.create(docket=docket, entry_number=1)
+        self.rds = []
+        for i in range(3):
+            rd = RECAPDocument(
+                docket_entry=de,
+                document_type=RECAPDocument.PACER_DOCUMENT,
+                document_number=i + 1,
+                pacer_doc_id=str(i),
+                is_available=True,
+            )
+            rd.filepath_local.save('%s.pdf' % i,
+                                   ContentFile('Not really a PDF.'))
+            self.rds.append(rd)
+
+    def tearDown(self):
+        for rd in self.rds:
+            rd.filepath_local.delete(save=False)
+
+    @mock.patch('cl.scrapers.tasks.run_pdftotext')
+    def test_extracting_a_batch(self, mock_pdftotext):
+        """Is a batch loaded in one query and written in one update, with
+        timed out documents left alone?"""
+        mock_pdftotext.side_effect = [
+            'Page one.\fPage two.\f',
+            None,
+            'Text without form feeds.',
+        ]
+        pks = [rd.pk for rd in self.rds]
+        with self.assertNumQueries(2):
+            processed = extract_recap_pdf(pks, skip_ocr=True)
+        self.assertEqual(processed, [pks[0], pks[2]])
+
+        rds = [RECAPDocument.objects.get(pk=pk) for pk in pks]
+        self.assertEqual(rds[0].page_count, 2)
+        self.assertIn('Page two.', rds[0].plain_text)
+        self.assertIsNone(rds[1].ocr_status)
+        self.assertEqual(rds[1].plain_text, '')
+        # Not a real PDF, so its pages can't be counted.
+        self.assertIsNone(rds[2].page_count)
+        self.assertEqual(rds[2].ocr_status, RECAPDocument.OCR_UNNECESSARY)
+
+    @mock.patch('cl.scrapers.tasks.run_pdftotext')
+    def test_extracting_one_corrupt_document(self, mock_pdftotext):
+        """Can a lone document with no page count be written?"""
+        mock_pdftotext.return_value = 'Text without form feeds.'
+        extract_recap_pdf(self.rds[0].pk, skip_ocr=True)
+        rd = RECAPDocument.objects.get(pk=self.rds[0].pk)
+        self.assertIsNone(rd.page_count)
+        self.assertIn('without form feeds', rd.plain_text)
+
 
 class ReportScrapeStatusTest(TestCase):
     fixtures = ['test_court.json', 'judge_judy.json',
@@ -315,6 +416,29 @@ class DupcheckerWithFixturesTest(TestCase):
                     "We should have hit a break but didn't."
                 )
 
+    def test_batched_lookups(self):
+        """Once values are looked up together, does press_on answer from
+        what it learned, and are recent SHA-1s remembered by the next
+        DupChecker for the court?"""
+        recent_sha1s = LRUCache()
+        dup_checker = DupChecker(self.court, full_crawl=True,
+                                 recent_sha1s=recent_sha1s)
+        with self.assertNumQueries(1):
+            known = dup_checker.look_up_many(
+                Opinion, 'sha1', [self.content_hash, 'not a known hash'])
+        self.assertEqual(known, {self.content_hash})
+        with self.assertNumQueries(0):
+            self.assertFalse(dup_checker.press_on(
+                Opinion, now(), now(), lookup_value=self.content_hash))
+            self.assertTrue(dup_checker.press_on(
+                Opinion, now(), now(), lookup_value='not a known hash'))
+
+        dup_checker = DupChecker(self.court, full_crawl=True,
+                                 recent_sha1s=recent_sha1s)
+        with self.assertNumQueries(0):
+            self.assertFalse(dup_checker.press_on(
+                Opinion, now(), now(), lookup_value=self.content_hash))
+
 
 @override_settings(
     MEDIA_ROOT=os.path.join(settings.INSTALL_ROOT, 'cl/assets/media/test/')
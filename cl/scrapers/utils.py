@@ -1,7 +1,13 @@
 import mimetypes
 import os
+import threading
+import time
 import traceback
-from urlparse import urljoin
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from urlparse import urljoin, urlparse
 
 import requests
 import sys
@@ -82,7 +88,22 @@ def get_extension(content):
     return extension
 
 
-def get_binary_content(download_url, cookies, adapter, method='GET'):
+def make_scraper_session(adapter):
+    """Make a session for downloading a court's items.
+
+    Keep the session around between downloads so that its connections are
+    reused instead of opening new ones for every item.
+
+    :param adapter: An HTTPAdapter for use when getting content.
+    """
+    s = requests.session()
+    s.mount('https://', adapter)
+    s.headers.update({'User-Agent': 'CourtListener'})
+    return s
+
+
+def get_binary_content(download_url, cookies, adapter, method='GET',
+                       session=None):
     """ Downloads the file, covering a few special cases such as invalid SSL
     certificates and empty file errors.
 
@@ -91,6 +112,8 @@ def get_binary_content(download_url, cookies, adapter, method='GET'):
     :param adapter: An HTTPAdapter for use when getting content.
     :param method: The HTTP method used to get the item, or "LOCAL" to get an
     item during testing
+    :param session: A session from make_scraper_session to download with. If
+    not provided, a new one is made.
     :return: Two values. The first is a msg indicating any errors encountered.
     If blank, that indicates success. The second value is the response object
     containing the downloaded file.
@@ -111,14 +134,10 @@ def get_binary_content(download_url, cookies, adapter, method='GET'):
         else:
             # Note that we do a GET even if site.method is POST. This is
             # deliberate.
-            s = requests.session()
-            s.mount('https://', adapter)
-            headers = {'User-Agent': 'CourtListener'}
-
+            s = session or make_scraper_session(adapter)
             r = s.get(
                 download_url,
                 verify=False,  # WA has a certificate we don't understand
-                headers=headers,
                 cookies=cookies,
                 timeout=300,
             )
@@ -142,6 +161,101 @@ def get_binary_content(download_url, cookies, adapter, method='GET'):
     return '', r
 
 
+class HostLimiter(object):
+    """Keep downloads polite when they run concurrently.
+
+    No more than `max_per_host` requests go to a host at once, and they start
+    at least `min_interval` seconds apart. One limiter can be shared by every
+    thread that downloads.
+    """
+    def __init__(self, max_per_host=2, min_interval=0.5):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.next_start = {}
+
+    @contextmanager
+    def limit(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            semaphore = self.semaphores.setdefault(
+                host, threading.BoundedSemaphore(self.max_per_host))
+        with semaphore:
+            with self.lock:
+                start = max(time.time(), self.next_start.get(host, 0))
+                self.next_start[host] = start + self.min_interval
+            delay = start - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            yield
+
+
+class BinaryPrefetcher(object):
+    """Download many files concurrently, but hand them back in order.
+
+    Iterate over it to get the results. Only `window` downloads are ahead of
+    the caller at a time, so a caller that stops early, like when it finds
+    that a court is up to date, wastes few downloads.
+    """
+    def __init__(self, download_urls, cookies, adapter, method='GET',
+                 session=None, limiter=None, window=4, transform=None):
+        """
+        :param download_urls: The URLs to download.
+        :param limiter: A HostLimiter to keep the downloads polite.
+        :param window: How many downloads to run ahead of the caller.
+        :param transform: A function to apply to each (msg, r) pair from
+        get_binary_content in the downloading thread, like hashing the
+        content. Its return values are handed back instead of the pairs.
+
+        See get_binary_content for the other params.
+        """
+        self.download_urls = iter(download_urls)
+        self.cookies = cookies
+        self.adapter = adapter
+        self.method = method
+        self.session = session
+        self.limiter = limiter
+        self.window = window
+        self.transform = transform
+        self.pending = deque()
+
+    def fetch(self, download_url):
+        if self.limiter is None or self.method == 'LOCAL':
+            result = get_binary_content(download_url, self.cookies,
+                                        self.adapter, method=self.method,
+                                        session=self.session)
+        else:
+            with self.limiter.limit(download_url or ''):
+                result = get_binary_content(download_url, self.cookies,
+                                            self.adapter, method=self.method,
+                                            session=self.session)
+        if self.transform is not None:
+            result = self.transform(result)
+        return result
+
+    def ready(self):
+        """Get the results of the downloads ahead of the caller that have
+        already finished, without waiting for the others.
+        """
+        return [r.get() for r in list(self.pending) if
+                r.ready() and r.successful()]
+
+    def __iter__(self):
+        pool = ThreadPool(self.window)
+        try:
+            self.pending.extend(pool.apply_async(self.fetch, (url,)) for url in
+                                islice(self.download_urls, self.window))
+            while self.pending:
+                result = self.pending.popleft().get()
+                for url in islice(self.download_urls, 1):
+                    self.pending.append(pool.apply_async(self.fetch, (url,)))
+                yield result
+        finally:
+            # Let any downloads that are in flight finish in the background.
+            pool.close()
+
+
 def signal_handler(signal, frame):
     # Trigger this with CTRL+4
     logger.info('**************')
@@ -151,7 +265,8 @@ def signal_handler(signal, frame):
     die_now = True
 
 
-def extract_recap_documents(docs, skip_ocr=False, order_by=None, queue=None):
+def extract_recap_documents(docs, skip_ocr=False, order_by=None, queue=None,
+                            batch_size=1):
     """Loop over RECAPDocuments and extract their contents. Use OCR if requested.
 
     :param docs: A queryset containing the RECAPDocuments to be processed.
@@ -164,6 +279,10 @@ def extract_recap_documents(docs, skip_ocr=False, order_by=None, queue=None):
     :type order_by: str
     :param queue: The celery queue to send the content to.
     :type queue: str
+    :param batch_size: How many items to send to each task. Only used when
+    skipping OCR, since OCR can take minutes per item and batching it would
+    keep other workers idle.
+    :type batch_size: int
     """
     docs = docs.exclude(filepath_local='')
     if skip_ocr:
@@ -172,6 +291,7 @@ def extract_recap_documents(docs, skip_ocr=False, order_by=None, queue=None):
     else:
         # We're doing OCR. Only work with those items that require it.
         docs = docs.filter(ocr_status=RECAPDocument.OCR_NEEDED)
+        batch_size = 1
 
     if order_by is not None:
         if order_by == 'small-first':
@@ -181,11 +301,20 @@ def extract_recap_documents(docs, skip_ocr=False, order_by=None, queue=None):
 
     count = docs.count()
     throttle = CeleryThrottle(queue_name=queue)
-    for i, pk in enumerate(docs.values_list('pk', flat=True)):
-        throttle.maybe_wait()
-        extract_recap_pdf.apply_async((pk, skip_ocr), priority=5, queue=queue)
+    batch = []
+    for i, pk in enumerate(docs.values_list('pk', flat=True).iterator()):
+        batch.append(pk)
+        if len(batch) >= batch_size:
+            throttle.maybe_wait()
+            extract_recap_pdf.apply_async((batch, skip_ocr), priority=5,
+                                          queue=queue)
+            batch = []
         if i % 1000 == 0:
-            msg = "Sent %s/%s tasks to celery so far." % (i + 1, count)
+            msg = "Sent %s/%s items to celery so far." % (i + 1, count)
             logger.info(msg)
             sys.stdout.write("\r%s" % msg)
             sys.stdout.flush()
+    if batch:
+        throttle.maybe_wait()
+        extract_recap_pdf.apply_async((batch, skip_ocr), priority=5,
+                                      queue=queue)
@@ -6,13 +6,21 @@ from cl.search import forms
 
 
 def get_object_list(request=None, **kwargs):
-    """Perform the Solr work"""
+    """Perform the Solr work
+
+    If the request has a cursor parameter, the list pages with Solr's
+    cursorMark instead of with an offset. Pass '*' to get the first page.
+    """
     # Set the offset value
     paginator = kwargs['paginator']
     page_number = int(request.GET.get(paginator.page_query_param, 1))
     # Assume page_size = 20, then: 1 --> 0, 2 --> 19, 3 --> 39
     offset = max(0, (page_number - 1) * paginator.page_size - 1)
     limit = 20
+    cursor = request.GET.get('cursor')
+    if cursor is not None:
+        offset = 0
+        cursor = cursor or '*'
     try:
         main_query = search_utils.build_main_query(
             kwargs['cd'],
@@ -26,6 +34,7 @@ def get_object_list(request=None, **kwargs):
             offset=offset,
             limit=limit,
             type=kwargs['cd']['type'],
+            cursor=cursor,
         )
     except KeyError:
         sf = forms.SearchForm({'q': '*'})
@@ -41,22 +50,49 @@ def get_object_list(request=None, **kwargs):
             main_query=main_query,
             offset=offset,
             limit=limit,
+            cursor=cursor,
         )
     return sl
 
 
+def add_sort_tie_breaker(sort):
+    """Make sure a sort ends with the unique key, as cursorMark requires.
+
+    :param sort: A Solr sort parameter, like 'dateFiled desc'. Can be empty.
+    :return: The sort, with 'id asc' appended if id isn't already in it.
+    """
+    fields = [f.strip() for f in (sort or '').split(',') if f.strip()]
+    if not fields:
+        fields = ['score desc']
+    if not any(f.split()[0] == 'id' for f in fields):
+        fields.append('id asc')
+    return ', '.join(fields)
+
+
 class SolrList(object):
     """This implements a yielding list object that fetches items as they are
     queried.
+
+    The count and the results come from a single query to Solr, which is made
+    the first time either is needed.
+
+    If a cursor is given, the page is fetched with cursorMark instead of with
+    start, and self.next_cursor has the cursor for the following page
+    afterwards. Unlike start, a cursor costs the same however deep into the
+    results it is.
     """
 
-    def __init__(self, main_query, offset, limit, type=None, length=None):
+    def __init__(self, main_query, offset, limit, type=None, length=None,
+                 cursor=None):
         super(SolrList, self).__init__()
         self.main_query = main_query
         self.offset = offset
         self.limit = limit
         self.type = type
+        self.cursor = cursor
+        self.next_cursor = None
         self._item_cache = []
+        self._response = None
         if self.type == 'o':
             self.conn = ExtraSolrInterface(
                 settings.SOLR_OPINION_URL,
@@ -79,38 +115,58 @@ class SolrList(object):
             )
         self._length = length
 
-    def __len__(self):
-        if self._length is None:
-            mq = self.main_query.copy()  # local copy for manipulation
-            mq['caller'] = 'api_search_count'
-            count = self.conn.query().add_extra(**mq).count()
-            self._length = count
-        return self._length
-
-    def __iter__(self):
-        for item in range(0, len(self)):
-            try:
-                yield self._item_cache[item]
-            except IndexError:
-                yield self.__getitem__(item)
+    def _execute(self):
+        """Run the query, if we haven't already, and cache the count and the
+        results from its response.
+        """
+        if self._response is not None:
+            return self._response
 
-    def __getitem__(self, item):
-        self.main_query['start'] = self.offset
-        r = self.conn.query().add_extra(**self.main_query).execute()
+        mq = self.main_query.copy()  # local copy for manipulation
+        if self.cursor is None:
+            mq['start'] = self.offset
+        else:
+            mq['cursorMark'] = self.cursor
+            mq['rows'] = self.limit
+            mq['sort'] = add_sort_tie_breaker(mq.get('sort'))
+        r = self.conn.query().add_extra(**mq).execute()
+        self._response = r
+        self.next_cursor = r.next_cursor_mark
 
         if r.group_field is None:
+            if self._length is None:
+                self._length = r.result.numFound
             # Pull the text snippet up a level
             for result in r.result.docs:
                 result['snippet'] = '&hellip;'.join(
                         result['solr_highlights']['text'])
                 self._item_cache.append(SolrObject(initial=result))
         else:
+            groups = getattr(r.groups, r.group_field)
+            if self._length is None:
+                self._length = groups['ngroups']
             # Flatten group results, and pull up the text snippet as above.
-            for group in getattr(r.groups, r.group_field)['groups']:
+            for group in groups['groups']:
                 for doc in group['doclist']['docs']:
                     doc['snippet'] = '&hellip;'.join(
                         doc['solr_highlights']['text'])
                     self._item_cache.append(SolrObject(initial=doc))
+        return r
+
+    def __len__(self):
+        if self._length is None:
+            self._execute()
+        return self._length
+
+    def __iter__(self):
+        for item in range(0, len(self)):
+            try:
+                yield self._item_cache[item]
+            except IndexError:
+                yield self.__getitem__(item)
+
+    def __getitem__(self, item):
+        self._execute()
 
         # Now, assuming our _item_cache is all set, we just get the item.
         if isinstance(item, slice):
@@ -126,6 +182,11 @@ class SolrList(object):
                 # No results!
                 return []
 
+    def page(self):
+        """Get the items of the page the cursor points to."""
+        self._execute()
+        return self._item_cache
+
     def append(self, p_object):
         """Lightly override the append method so we get items duplicated in
         our cache.
@@ -1,4 +1,7 @@
+from collections import OrderedDict
+
 from rest_framework import status, pagination, viewsets, permissions, response
+from rest_framework.utils.urls import replace_query_param
 
 from cl.api.utils import LoggingMixin, RECAPUsersReadOnly
 from cl.search import api_utils
@@ -128,6 +131,25 @@ class SearchViewSet(LoggingMixin, viewsets.ViewSet):
             paginator = pagination.PageNumberPagination()
             sl = api_utils.get_object_list(request, cd=cd, paginator=paginator)
 
+            if sl.cursor is not None:
+                serializer = SearchResultSerializer(
+                    sl.page(),
+                    many=True,
+                    context={'schema': sl.conn.schema}
+                )
+                next_url = None
+                if sl.next_cursor and sl.next_cursor != sl.cursor:
+                    next_url = replace_query_param(
+                        request.build_absolute_uri(), 'cursor',
+                        sl.next_cursor,
+                    )
+                return response.Response(OrderedDict([
+                    ('count', len(sl)),
+                    ('next', next_url),
+                    ('previous', None),
+                    ('results', serializer.data),
+                ]))
+
             result_page = paginator.paginate_queryset(sl, request)
             serializer = SearchResultSerializer(
                 result_page,
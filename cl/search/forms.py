@@ -7,7 +7,7 @@ from localflavor.us.us_states import STATE_CHOICES
 from cl.people_db.models import Position, PoliticalAffiliation
 from cl.search.fields import CeilingDateField
 from cl.search.fields import FloorDateField
-from cl.search.models import Court
+from cl.search.models import get_in_use_courts
 from cl.search.models import DOCUMENT_STATUSES
 
 
@@ -375,7 +375,7 @@ class SearchForm(forms.Form):
         names coming from the database, we need to interact directly with the
         fields dict.
         """
-        courts = Court.objects.filter(in_use=True)
+        courts = get_in_use_courts()
         for court in courts:
             self.fields['court_' + court.pk] = forms.BooleanField(
                 label=court.short_name,
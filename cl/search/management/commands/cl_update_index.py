@@ -1,23 +1,35 @@
 import ast
+import json
 import sys
+import time
+import traceback
+from datetime import datetime
+from multiprocessing import Process, Queue, cpu_count
 
+import requests
 from django.conf import settings
+from django.db import connections
+from django.utils.timezone import is_naive, utc
 from six.moves import input
+from six.moves.queue import Full
 
 from cl.audio.models import Audio
 from cl.lib.command_utils import VerboseCommand, logger
 from cl.lib.argparse_types import valid_date_time, valid_obj_type
 from cl.lib.celery_utils import CeleryThrottle
-from cl.lib.db_tools import queryset_generator
+from cl.lib.db_tools import queryset_generator, stream_queryset
 from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.search_index_utils import InvalidDocumentError
 from cl.lib.timer import print_timing
 from cl.people_db.models import Person
-from cl.search.models import Opinion, RECAPDocument, Docket
+from cl.search.models import Opinion, RECAPDocument, Docket, \
+    make_opinion_search_dicts
 from cl.search.tasks import (delete_items, add_or_update_audio_files,
                              add_or_update_opinions, add_or_update_items,
                              add_or_update_people, add_or_update_recap_document)
 
 VALID_OBJ_TYPES = ('opinions', 'audio', 'people', 'recap', 'recap-dockets')
+ENGINES = ('celery', 'local')
 
 
 def proceed_with_deletion(out, count, noinput):
@@ -47,6 +59,137 @@ def proceed_with_deletion(out, count, noinput):
     return proceed
 
 
+def make_search_dicts(obj_type, pks):
+    """Load a batch of items from the DB and make their search dicts.
+
+    :param obj_type: The model class of the items.
+    :param pks: The PKs of the items to load.
+    :return: A list of search dicts. Items that can't be converted are logged
+    and skipped.
+    """
+    if obj_type == Opinion:
+        return make_opinion_search_dicts(pks)
+
+    search_dicts = []
+    for item in obj_type.objects.filter(pk__in=pks).order_by():
+        try:
+            if obj_type == Docket:
+                search_dicts.extend(item.as_search_list())
+            else:
+                search_dicts.append(item.as_search_dict())
+        except (AttributeError, ValueError, InvalidDocumentError) as e:
+            logger.warn("Unable to make search dict for %s: %s" % (item, e))
+    return search_dicts
+
+
+def solr_json_default(obj):
+    """Serialize the values that json can't handle on its own, the way Solr
+    wants them.
+    """
+    if isinstance(obj, datetime):
+        if not is_naive(obj):
+            obj = obj.astimezone(utc).replace(tzinfo=None)
+        return obj.isoformat() + 'Z'
+    if isinstance(obj, set):
+        return list(obj)
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def build_search_docs(obj_type, pk_queue, doc_queue):
+    """Pipeline stage: Take chunks of PKs, fetch the items from the DB, and
+    serialize their search dicts to JSON for posting.
+
+    Runs until it gets a None from pk_queue.
+    """
+    while True:
+        pks = pk_queue.get()
+        if pks is None:
+            break
+        try:
+            docs = make_search_dicts(obj_type, pks)
+            if docs:
+                docs = json.dumps(docs, default=solr_json_default)
+        except Exception:
+            # Lose the chunk, not the process. If this process died, the
+            # queues would fill up and the whole pipeline would stall.
+            logger.error("Unable to build the chunk starting at pk %s:\n%s" %
+                         (pks[0], traceback.format_exc()))
+            continue
+        if docs:
+            doc_queue.put((pks[0], docs))
+
+
+def post_search_docs(solr_url, doc_queue, batch_size):
+    """Pipeline stage: Take serialized chunks of search dicts and post them to
+    Solr, a few chunks per request, over one keep-alive session.
+
+    Runs until it gets a None from doc_queue.
+    """
+    session = requests.Session()
+    update_url = '%s/update' % solr_url.rstrip('/')
+
+    def post(batch):
+        body = '[%s]' % ','.join(docs[1:-1] for _, docs in batch)
+        try:
+            r = session.post(update_url, data=body, params={'wt': 'json'},
+                             headers={'Content-Type': 'application/json'})
+        except requests.RequestException as e:
+            logger.error("Unable to post chunks starting at pks %s to Solr: "
+                         "%s" % ([pk for pk, _ in batch], e))
+            return
+        if r.status_code != 200:
+            logger.error("Got status %s from Solr while posting chunks "
+                         "starting at pks %s: %s" % (
+                             r.status_code, [pk for pk, _ in batch], r.text))
+
+    batch = []
+    while True:
+        item = doc_queue.get()
+        if item is None:
+            break
+        batch.append(item)
+        if len(batch) >= batch_size:
+            post(batch)
+            batch = []
+    if batch:
+        post(batch)
+
+
+class PipelineStageError(Exception):
+    """A stage of the local indexing pipeline died."""
+
+
+def check_stages(stages):
+    """Raise a PipelineStageError if any of the stage processes died."""
+    for p in stages:
+        if p.exitcode not in (None, 0):
+            raise PipelineStageError("%s died with exit code %s." %
+                                     (p.name, p.exitcode))
+
+
+def put_while_stages_live(queue, item, stages):
+    """Put an item on a bounded queue, failing instead of blocking forever if
+    the stages that would empty it die.
+    """
+    while True:
+        try:
+            queue.put(item, timeout=1)
+            return
+        except Full:
+            check_stages(stages)
+
+
+def join_while_stages_live(processes, stages):
+    """Wait for processes to finish, failing if any of the stages dies, since
+    that could leave the processes waiting forever.
+    """
+    for p in processes:
+        while p.is_alive():
+            check_stages(stages)
+            p.join(1)
+    check_stages(stages)
+
+
 class Command(VerboseCommand):
     help = ('Adds, updates, deletes items in an index, committing changes and '
             'optimizing it, if requested.')
@@ -86,6 +229,37 @@ class Command(VerboseCommand):
             default='batch3',
             help="The celery queue where the tasks should be processed.",
         )
+        parser.add_argument(
+            '--engine',
+            choices=ENGINES,
+            default='celery',
+            help="How to do the indexing when adding or updating many items. "
+                 "'celery' sends the items to Celery in chunks. 'local' "
+                 "streams PKs through a pipeline of local processes that "
+                 "load the items, build their search dicts and post them "
+                 "straight to Solr, so nothing goes through the broker.",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=cpu_count(),
+            help="When using the local engine, the number of processes to "
+                 "use for building search dicts.",
+        )
+        parser.add_argument(
+            '--posters',
+            type=int,
+            default=2,
+            help="When using the local engine, the number of processes to "
+                 "use for posting to Solr.",
+        )
+        parser.add_argument(
+            '--chunksize',
+            type=int,
+            default=250,
+            help="When using the local engine, the number of items to load "
+                 "from the DB at a time.",
+        )
 
         actions_group = parser.add_mutually_exclusive_group()
         actions_group.add_argument(
@@ -239,6 +413,86 @@ class Command(VerboseCommand):
                 self.stdout.flush()
         self.stdout.write('\n')
 
+    def process_pks_locally(self, pks, count):
+        """Send the PKs in chunks through a pipeline of local processes that
+        build search dicts and post them to Solr.
+
+        The stages are:
+
+         1. This process, which reads PKs from the DB and queues them up in
+            chunks.
+         2. Builder processes, which load each chunk of items from the DB,
+            make their search dicts, and serialize them to JSON.
+         3. Poster processes, which send the JSON to Solr, a few chunks per
+            request.
+
+        The queues between the stages are bounded, so a slow stage holds up
+        the ones before it instead of piling items up in memory.
+        """
+        num_workers = max(self.options['workers'], 1)
+        num_posters = max(self.options['posters'], 1)
+        if not self.solr_url:
+            self.stderr.write("The local engine requires --solr-url.\n")
+            sys.exit(1)
+
+        pk_queue = Queue(maxsize=num_workers * 2)
+        doc_queue = Queue(maxsize=num_posters * 4)
+
+        # Don't share DB connections with the child processes.
+        for conn in connections.all():
+            conn.close()
+        workers = [Process(target=build_search_docs,
+                           args=(self.type, pk_queue, doc_queue))
+                   for _ in range(num_workers)]
+        posters = [Process(target=post_search_docs,
+                           args=(self.solr_url, doc_queue, 4))
+                   for _ in range(num_posters)]
+        for p in workers + posters:
+            p.start()
+
+        stages = workers + posters
+        try:
+            self.queue_pks(pks, count, pk_queue, stages)
+            for _ in workers:
+                put_while_stages_live(pk_queue, None, stages)
+            join_while_stages_live(workers, stages)
+            for _ in posters:
+                put_while_stages_live(doc_queue, None, stages)
+            join_while_stages_live(posters, stages)
+        except PipelineStageError as e:
+            for p in stages:
+                if p.is_alive():
+                    p.terminate()
+            self.stderr.write("\n%s Aborting.\n" % e)
+            sys.exit(1)
+        self.stdout.write('\n')
+
+    def queue_pks(self, pks, count, pk_queue, stages):
+        """Queue up the PKs in chunks for the builder processes."""
+        chunksize = self.options['chunksize']
+        start_at = self.options['start_at']
+        t1 = time.time()
+        processed_count = 0
+        chunk = []
+        for pk in pks:
+            processed_count += 1
+            if processed_count < start_at:
+                continue
+            chunk.append(pk)
+            if len(chunk) == chunksize or processed_count == count:
+                put_while_stages_live(pk_queue, chunk, stages)
+                chunk = []
+                sys.stdout.write(
+                    "\rQueued {}/{} ({:.0%}, {:.0f} items/s)".format(
+                        processed_count,
+                        count,
+                        processed_count * 1.0 / count,
+                        processed_count / max(time.time() - t1, 0.001),
+                    ))
+                self.stdout.flush()
+        if chunk:
+            put_while_stages_live(pk_queue, chunk, stages)
+
     @print_timing
     def delete(self, items):
         """
@@ -319,9 +573,14 @@ class Command(VerboseCommand):
         """
         self.stdout.write("Adding or updating items(s) newer than %s\n" % dt)
         qs = self.type.objects.filter(date_created__gte=dt)
-        items = queryset_generator(qs, chunksize=5000)
         count = qs.count()
-        self.process_queryset(items, count)
+        if self.options['engine'] == 'local':
+            pks = stream_queryset(qs.values_list('pk', flat=True),
+                                  chunksize=5000)
+            self.process_pks_locally(pks, count)
+        else:
+            items = queryset_generator(qs, chunksize=5000)
+            self.process_queryset(items, count)
 
     @print_timing
     def add_or_update_all(self):
@@ -350,19 +609,23 @@ class Command(VerboseCommand):
             # Filter out non-judges -- they don't get searched.
             q = [item for item in q if item.is_judge]
             count = len(q)
-        elif self.type == RECAPDocument:
-            q = self.type.objects.all()
-            count = q.count()
-            q = queryset_generator(q, chunksize=5000)
+            if self.options['engine'] == 'local':
+                self.process_pks_locally((item.pk for item in q), count)
+                return
+            self.process_queryset(q, count)
+            return
         elif self.type == Docket:
             q = Docket.objects.filter(source__in=Docket.RECAP_SOURCES)
-            count = q.count()
-            q = queryset_generator(q, chunksize=5000)
         else:
             q = self.type.objects.all()
-            count = q.count()
+        count = q.count()
+        if self.options['engine'] == 'local':
+            pks = stream_queryset(q.values_list('pk', flat=True),
+                                  chunksize=5000)
+            self.process_pks_locally(pks, count)
+        else:
             q = queryset_generator(q, chunksize=5000)
-        self.process_queryset(q, count)
+            self.process_queryset(q, count)
 
     @print_timing
     def optimize(self):
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0058_auto_20171012_1437'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recapdocument',
+            name='sha1',
+            field=models.CharField(help_text=b'The ID used for a document in RECAP', max_length=40, db_index=True, blank=True),
+        ),
+    ]
@@ -6,10 +6,13 @@ from datetime import datetime, time
 from celery.canvas import chain
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.db import models
 from django.db.models import Prefetch
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template import loader
 from django.utils.encoding import smart_unicode
 from django.utils.text import slugify
@@ -598,6 +601,7 @@ class RECAPDocument(models.Model):
     sha1 = models.CharField(
         help_text="The ID used for a document in RECAP",
         max_length=40,  # As in RECAP
+        db_index=True,
         blank=True,
     )
     page_count = models.IntegerField(
@@ -1020,6 +1024,39 @@ class Court(models.Model):
         ordering = ["position"]
 
 
+COURT_CACHE_VERSION_KEY = 'court-cache-version'
+_court_cache = {}
+
+
+def get_court_cache_version():
+    """Get the version of the courts table, which changes whenever a court
+    is saved or deleted.
+    """
+    return cache.get(COURT_CACHE_VERSION_KEY, 0)
+
+
+def get_in_use_courts():
+    """Get the courts that are in use, in order.
+
+    They're kept in memory until a court is saved or deleted in any process,
+    so treat them as read-only.
+    """
+    version = get_court_cache_version()
+    if _court_cache.get('version') != version:
+        _court_cache['courts'] = list(Court.objects.filter(in_use=True))
+        _court_cache['version'] = version
+    return _court_cache['courts']
+
+
+@receiver([post_save, post_delete], sender=Court)
+def bump_court_cache_version(sender, **kwargs):
+    try:
+        cache.incr(COURT_CACHE_VERSION_KEY)
+    except ValueError:
+        # Not in the cache yet.
+        cache.set(COURT_CACHE_VERSION_KEY, 1, None)
+
+
 class OpinionCluster(models.Model):
     """A class representing a cluster of court opinions."""
     SCDB_DECISION_DIRECTIONS = (
@@ -1540,7 +1577,7 @@ class Opinion(models.Model):
         # Opinion
         out.update({
             'cites': [opinion.pk for opinion in self.opinions_cited.all()],
-            'author_id': getattr(self.author, 'pk', None),
+            'author_id': self.author_id,
             # 'per_curiam': self.per_curiam,
             'joined_by_ids': [judge.pk for judge in self.joined_by.all()],
             'type': self.type,
@@ -1622,6 +1659,54 @@ class Opinion(models.Model):
         return normalize_search_dicts(out)
 
 
+def prefetched_opinions_for_search(pks):
+    """Get a queryset of opinions with everything that as_search_dict needs
+    joined or prefetched.
+
+    Calling as_search_dict on each opinion in a loop otherwise costs about a
+    dozen queries per opinion. This uses a fixed number of queries for the
+    whole batch: one for the opinions, clusters, dockets and courts, and one
+    per related set.
+
+    :param pks: The PKs of the opinions to get.
+    :return: An Opinion queryset with the related objects loaded.
+    """
+    from cl.people_db.models import Person
+    return Opinion.objects.filter(pk__in=pks).select_related(
+        'cluster__docket__court',
+    ).prefetch_related(
+        Prefetch('opinions_cited', queryset=Opinion.objects.only('pk')),
+        Prefetch('joined_by', queryset=Person.objects.only('pk')),
+        Prefetch('cluster__sub_opinions',
+                 queryset=Opinion.objects.only('pk', 'cluster')),
+        'cluster__panel',
+        Prefetch('cluster__non_participating_judges',
+                 queryset=Person.objects.only('pk')),
+    ).order_by()
+
+
+def make_opinion_search_dicts(pks):
+    """Make the Solr dicts for a batch of opinions.
+
+    Items that cannot be made into search dicts are skipped, with a message,
+    so that one bad opinion doesn't sink the batch.
+
+    :param pks: The PKs of the opinions to convert.
+    :return: A list of search dicts, one per valid opinion.
+    """
+    search_dicts = []
+    for opinion in prefetched_opinions_for_search(pks):
+        try:
+            search_dicts.append(opinion.as_search_dict())
+        except AttributeError as e:
+            print("AttributeError trying to add: %s\n  %s" % (opinion, e))
+        except ValueError as e:
+            print("ValueError trying to add: %s\n  %s" % (opinion, e))
+        except InvalidDocumentError:
+            print("Unable to parse: %s" % opinion)
+    return search_dicts
+
+
 class OpinionsCited(models.Model):
     citing_opinion = models.ForeignKey(
         Opinion,
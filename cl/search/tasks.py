@@ -1,17 +1,29 @@
 from __future__ import print_function
 from __future__ import print_function
 from __future__ import print_function
-import scorched
 import socket
+from datetime import date, datetime, timedelta
 
+import redis
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.utils.timezone import make_aware, utc
 
 from cl.audio.models import Audio
 from cl.celery import app
+from cl.custom_filters.templatetags.text_filters import naturalduration
+from cl.lib.scorched_utils import ExtraSolrInterface
 from cl.lib.search_index_utils import InvalidDocumentError
 from cl.lib.sunburnt import SolrError
 from cl.people_db.models import Person
-from cl.search.models import Opinion, OpinionCluster, RECAPDocument, Docket
+from cl.search.models import Opinion, RECAPDocument, Docket, \
+    make_opinion_search_dicts
+from cl.stats.models import Stat
+from cl.visualizations.models import SCOTUSMap
+
+HOMEPAGE_STATS_CACHE_KEY = 'homepage-stats'
 
 
 @app.task
@@ -24,16 +36,20 @@ def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
     not passing objects around, but thread safety shouldn't be an issue since
     this is only used by the update_index command, and we want to get the
     objects in the task, not in its caller.
+
+    Opinions are pulled out of the items and converted together so that their
+    related objects can be loaded in bulk.
     """
-    si = scorched.SolrInterface(solr_url, mode='w')
+    si = ExtraSolrInterface(solr_url, mode='w')
     if hasattr(items, "items") or not hasattr(items, "__iter__"):
         # If it's a dict or a single item make it a list
         items = [items]
     search_item_list = []
+    opinion_pks = []
     for item in items:
         try:
             if type(item) == Opinion:
-                search_item_list.append(item.as_search_dict())
+                opinion_pks.append(item.pk)
             elif type(item) == RECAPDocument:
                 search_item_list.append(item.as_search_dict())
             elif type(item) == Docket:
@@ -50,6 +66,8 @@ def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
             print("ValueError trying to add: %s\n  %s" % (item, e))
         except InvalidDocumentError:
             print("Unable to parse: %s" % item)
+    if opinion_pks:
+        search_item_list.extend(make_opinion_search_dicts(opinion_pks))
 
     try:
         si.add(search_item_list)
@@ -59,10 +77,9 @@ def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
 
 @app.task
 def add_or_update_opinions(item_pks, force_commit=False):
-    si = scorched.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
+    si = ExtraSolrInterface(settings.SOLR_OPINION_URL, mode='w')
     try:
-        si.add([item.as_search_dict() for item in
-                Opinion.objects.filter(pk__in=item_pks)])
+        si.add(make_opinion_search_dicts(item_pks))
         if force_commit:
             si.commit()
     except SolrError as exc:
@@ -71,7 +88,7 @@ def add_or_update_opinions(item_pks, force_commit=False):
 
 @app.task
 def add_or_update_audio_files(item_pks, force_commit=False):
-    si = scorched.SolrInterface(settings.SOLR_AUDIO_URL, mode='w')
+    si = ExtraSolrInterface(settings.SOLR_AUDIO_URL, mode='w')
     try:
         si.add([item.as_search_dict() for item in
                 Audio.objects.filter(pk__in=item_pks)])
@@ -83,7 +100,7 @@ def add_or_update_audio_files(item_pks, force_commit=False):
 
 @app.task
 def add_or_update_people(item_pks, force_commit=False):
-    si = scorched.SolrInterface(settings.SOLR_PEOPLE_URL, mode='w')
+    si = ExtraSolrInterface(settings.SOLR_PEOPLE_URL, mode='w')
     try:
         si.add([item.as_search_dict() for item in
                 Person.objects.filter(pk__in=item_pks)])
@@ -110,7 +127,7 @@ def add_or_update_recap_document(item_pks, coalesce_docket=False,
     updates?
     :return: None
     """
-    si = scorched.SolrInterface(settings.SOLR_RECAP_URL, mode='w')
+    si = ExtraSolrInterface(settings.SOLR_RECAP_URL, mode='w')
     rds = RECAPDocument.objects.filter(pk__in=item_pks).order_by()
     if coalesce_docket:
         try:
@@ -130,7 +147,7 @@ def add_or_update_recap_document(item_pks, coalesce_docket=False,
 
 @app.task
 def delete_items(items, solr_url, force_commit=False):
-    si = scorched.SolrInterface(solr_url, mode='w')
+    si = ExtraSolrInterface(solr_url, mode='w')
     try:
         si.delete_by_ids(list(items))
         if force_commit:
@@ -141,11 +158,103 @@ def delete_items(items, solr_url, force_commit=False):
 
 @app.task
 def add_or_update_cluster(pk, force_commit=False):
-    si = scorched.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
+    si = ExtraSolrInterface(settings.SOLR_OPINION_URL, mode='w')
     try:
-        si.add([item.as_search_dict() for item in
-                OpinionCluster.objects.get(pk=pk).sub_opinions.all()])
+        si.add(make_opinion_search_dicts(
+            Opinion.objects.filter(cluster_id=pk).values_list('pk', flat=True)
+        ))
         if force_commit:
             si.commit()
     except SolrError as exc:
         add_or_update_cluster.retry(exc=exc, countdown=30)
+
+
+def get_homepage_stats():
+    """Get any stats that are displayed on the homepage and return them as a
+    dict
+    """
+    ten_days_ago = make_aware(datetime.today() - timedelta(days=10), utc)
+    alerts_in_last_ten = Stat.objects.filter(
+        name__contains='alerts.sent',
+        date_logged__gte=ten_days_ago
+    ).aggregate(Sum('count'))['count__sum']
+    queries_in_last_ten = Stat.objects.filter(
+        name='search.results',
+        date_logged__gte=ten_days_ago
+    ).aggregate(Sum('count'))['count__sum']
+    bulk_in_last_ten = Stat.objects.filter(
+        name__contains='bulk_data',
+        date_logged__gte=ten_days_ago
+    ).aggregate(Sum('count'))['count__sum']
+    r = redis.StrictRedis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DATABASES['STATS'],
+    )
+    last_ten_days = ['api:v3.d:%s.count' %
+                     (date.today() - timedelta(days=x)).isoformat()
+                     for x in range(0, 10)]
+    api_in_last_ten = sum(
+        [int(result) for result in
+         r.mget(*last_ten_days) if result is not None]
+    )
+    users_in_last_ten = User.objects.filter(
+        date_joined__gte=ten_days_ago
+    ).count()
+    opinions_in_last_ten = Opinion.objects.filter(
+        date_created__gte=ten_days_ago
+    ).count()
+    oral_arguments_in_last_ten = Audio.objects.filter(
+        date_created__gte=ten_days_ago
+    ).count()
+    days_of_oa = naturalduration(
+        Audio.objects.aggregate(
+            Sum('duration')
+        )['duration__sum'],
+        as_dict=True,
+    )['d']
+    viz_in_last_ten = SCOTUSMap.objects.filter(
+        date_published__gte=ten_days_ago,
+        published=True,
+    ).count()
+    # Evaluated, so that the stats can be cached.
+    visualizations = list(SCOTUSMap.objects.filter(
+        published=True,
+        deleted=False,
+    ).annotate(
+        Count('clusters'),
+    ).filter(
+        # Ensures that we only show good stuff on homepage
+        clusters__count__gt=10,
+    ).order_by(
+        '-date_published',
+        '-date_modified',
+        '-date_created',
+    )[:1])
+    return {
+        'alerts_in_last_ten': alerts_in_last_ten,
+        'queries_in_last_ten': queries_in_last_ten,
+        'opinions_in_last_ten': opinions_in_last_ten,
+        'oral_arguments_in_last_ten': oral_arguments_in_last_ten,
+        'bulk_in_last_ten': bulk_in_last_ten,
+        'api_in_last_ten': api_in_last_ten,
+        'users_in_last_ten': users_in_last_ten,
+        'days_of_oa': days_of_oa,
+        'viz_in_last_ten': viz_in_last_ten,
+        'visualizations': visualizations,
+        'private': False,  # VERY IMPORTANT!
+    }
+
+
+@app.task(ignore_result=True)
+def cache_homepage_stats():
+    """Compute the homepage stats and cache them for the homepage to use.
+
+    This is run periodically by celerybeat, so that the homepage doesn't have
+    to run the queries on every hit.
+
+    :return: The stats.
+    """
+    stats = get_homepage_stats()
+    cache.set(HOMEPAGE_STATS_CACHE_KEY, stats, 60 * 60)
+    return stats
@@ -12,17 +12,27 @@ from django.db import IntegrityError, transaction
 from django.http import HttpRequest
 from django.test import RequestFactory
 from django.test import TestCase, override_settings
+from django.utils.timezone import make_aware
+import mock
+import numpy as np
 from lxml import etree, html
+from pytz import timezone
 from rest_framework.status import HTTP_200_OK
+from six.moves.queue import Queue
 from timeout_decorator import timeout_decorator
 
+from cl.lib.scorched_utils import ExtraSolrInterface
 from cl.lib.solr_core_admin import get_data_dir
 from cl.lib.test_helpers import SolrTestCase, IndexedSolrTestCase, \
     EmptySolrTestCase
 from cl.search.feeds import JurisdictionFeed
-from cl.search.management.commands.cl_calculate_pagerank import Command
+from cl.search.management.commands.cl_calculate_pagerank import Command, \
+    calculate_pagerank
+from cl.search.management.commands.cl_update_index import \
+    PipelineStageError, build_search_docs, put_while_stages_live, \
+    solr_json_default
 from cl.search.models import Court, Docket, Opinion, OpinionCluster, \
-    RECAPDocument, DocketEntry
+    RECAPDocument, DocketEntry, get_in_use_courts, make_opinion_search_dicts
 from cl.search.tasks import add_or_update_recap_document
 from cl.search.views import do_search
 from cl.tests.base import BaseSeleniumTest, SELENIUM_TIMEOUT
@@ -132,6 +142,42 @@ class UpdateIndexCommandTest(SolrTestCase):
         )
 
 
+class SolrJsonTest(TestCase):
+    def test_datetimes_are_serialized_for_solr(self):
+        """Are naive and aware datetimes sent to Solr as UTC?"""
+        naive = datetime.datetime(2015, 1, 2)
+        self.assertEqual(solr_json_default(naive), '2015-01-02T00:00:00Z')
+        aware = make_aware(datetime.datetime(2015, 1, 2, 1),
+                           timezone('US/Pacific'))
+        self.assertEqual(solr_json_default(aware), '2015-01-02T09:00:00Z')
+        self.assertEqual(solr_json_default({1}), [1])
+        with self.assertRaises(TypeError):
+            solr_json_default(object())
+
+
+class IndexPipelineTest(TestCase):
+    @mock.patch('cl.search.management.commands.cl_update_index.'
+                'make_search_dicts')
+    def test_builder_survives_a_bad_chunk(self, mock_make_dicts):
+        """Does a builder log a chunk it can't build and move on?"""
+        mock_make_dicts.side_effect = [ValueError('Bad item'), [{'id': 2}]]
+        pk_queue, doc_queue = Queue(), Queue()
+        for item in ([1], [2], None):
+            pk_queue.put(item)
+        build_search_docs(Opinion, pk_queue, doc_queue)
+        self.assertEqual(doc_queue.get_nowait(), (2, '[{"id": 2}]'))
+        self.assertTrue(doc_queue.empty())
+
+    def test_dead_stage_is_noticed(self):
+        """Does the parent fail instead of waiting forever on a queue that a
+        dead stage won't empty?"""
+        queue = Queue(maxsize=1)
+        queue.put('waiting')
+        dead_stage = mock.Mock(exitcode=1)
+        with self.assertRaises(PipelineStageError):
+            put_while_stages_live(queue, 'more', [dead_stage])
+
+
 class ModelTest(TestCase):
     fixtures = ['test_court.json']
 
@@ -158,6 +204,18 @@ class ModelTest(TestCase):
                              "try to use `strftime`...again?")
 
 
+class CourtCacheTest(TestCase):
+    fixtures = ['test_court.json']
+
+    def test_saving_a_court_refreshes_the_cache(self):
+        """Do in-use courts get reloaded when a court is saved?"""
+        self.assertIn('test', [c.pk for c in get_in_use_courts()])
+        court = Court.objects.get(pk='test')
+        court.in_use = False
+        court.save()
+        self.assertNotIn('test', [c.pk for c in get_in_use_courts()])
+
+
 class DocketValidationTest(TestCase):
     fixtures = ['test_court.json']
 
@@ -187,6 +245,26 @@ class DocketValidationTest(TestCase):
                 )
 
 
+class OpinionSearchDictTest(TestCase):
+    fixtures = ['test_objects_search.json', 'judge_judy.json']
+
+    def test_bulk_dicts_match_single_dicts(self):
+        """Does the bulk builder make the same dicts as as_search_dict?"""
+        pks = Opinion.objects.values_list('pk', flat=True)
+        expected = {o.pk: o.as_search_dict() for o in Opinion.objects.all()}
+        with self.assertNumQueries(6):
+            actual = make_opinion_search_dicts(list(pks))
+        self.assertEqual(len(actual), len(expected))
+        for d in actual:
+            e = expected[d['id']]
+            self.assertEqual(sorted(d.keys()), sorted(e.keys()))
+            for k, v in d.items():
+                if isinstance(v, list):
+                    self.assertEqual(sorted(v), sorted(e[k]))
+                else:
+                    self.assertEqual(v, e[k])
+
+
 class IndexingTest(EmptySolrTestCase):
     """Are things indexed properly?"""
     fixtures = ['test_court.json']
@@ -461,6 +539,32 @@ class SearchTest(IndexedSolrTestCase):
             msg="Did not get good status code from oral arguments API endpoint"
         )
 
+    def test_cached_results_are_dropped_on_commit(self):
+        """Are cached search results used until we commit to the core?"""
+        si = ExtraSolrInterface(settings.SOLR_OPINION_URL, mode='rw')
+        search = si.query().add_extra(q='*', caller='test').cache_results()
+        first = search.execute()
+        with mock.patch.object(si.conn, 'select',
+                               return_value=first.original_json) as select:
+            second = search.execute()
+            self.assertFalse(select.called)
+            self.assertEqual(first.result.numFound, second.result.numFound)
+            si.commit()
+            search.execute()
+            self.assertTrue(select.called)
+
+    def test_cursor_paging_search_api(self):
+        """Can we walk every result on the search endpoint with cursors?"""
+        url = reverse('search-list', kwargs={'version': 'v3'})
+        r = self.client.get(url, {'type': 'o', 'cursor': '*'}).data
+        count = r['count']
+        ids = [result['id'] for result in r['results']]
+        while r['next']:
+            r = self.client.get(r['next']).data
+            ids.extend([result['id'] for result in r['results']])
+        self.assertEqual(count, self.expected_num_results_opinion)
+        self.assertEqual(len(set(ids)), count)
+
     def test_homepage(self):
         """Is the homepage loaded when no GET parameters are provided?"""
         response = self.client.get(reverse('show_results'))
@@ -803,6 +907,18 @@ class PagerankTest(TestCase):
                             answers[key],)
             )
 
+    def test_warm_start_gives_the_same_answer(self):
+        """Starting from a previous run's scores should converge to the same
+        result as starting from scratch.
+        """
+        citing = np.array([1, 1, 2, 3], dtype=np.int32)
+        cited = np.array([2, 3, 3, 1], dtype=np.int32)
+        cold = calculate_pagerank(citing, cited)
+        start = np.array([0.1, 0.2, 0.3, 0.4])
+        warm = calculate_pagerank(citing, cited, start=start)
+        self.assertTrue(np.allclose(cold, warm, atol=1e-8))
+        self.assertAlmostEqual(cold.sum(), 1.0)
+
 
 class OpinionSearchFunctionalTest(BaseSeleniumTest):
     """
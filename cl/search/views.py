@@ -1,44 +1,44 @@
 import logging
 import traceback
-from datetime import date, datetime, timedelta
+from datetime import date
 from urllib import quote
 
-import redis
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.core.urlresolvers import reverse
-from django.db.models import Sum, Count
 from django.shortcuts import HttpResponseRedirect, render, get_object_or_404
-from django.utils.timezone import utc, make_aware
 from django.views.decorators.cache import never_cache
 
 from cl.alerts.forms import CreateAlertForm
 from cl.alerts.models import Alert
-from cl.audio.models import Audio
-from cl.custom_filters.templatetags.text_filters import naturalduration
 from cl.lib.bot_detector import is_bot
 from cl.lib.scorched_utils import ExtraSolrInterface
 from cl.lib.search_utils import build_main_query, get_query_citation, \
     make_stats_variable, merge_form_with_courts,  make_get_string, \
     regroup_snippets
 from cl.search.forms import SearchForm, _clean_form
-from cl.search.models import Court, Opinion
-from cl.stats.models import Stat
+from cl.search.models import get_in_use_courts
+from cl.search.tasks import HOMEPAGE_STATS_CACHE_KEY, cache_homepage_stats
 from cl.stats.utils import tally_stat
-from cl.visualizations.models import SCOTUSMap
 
 logger = logging.getLogger(__name__)
 
 
-def do_search(request, rows=20, order_by=None, type=None, facet=True):
+def do_search(request, rows=20, order_by=None, type=None, facet=True,
+              cache_results=False):
+    """Run the search in the request's GET parameters.
+
+    If cache_results is True, Solr's responses are cached until the index
+    changes, so that repeats of the query don't hit Solr.
+    """
 
     query_citation = None
     error = False
     paged_results = None
     search_form = SearchForm(request.GET)
-    courts = Court.objects.filter(in_use=True)
+    courts = get_in_use_courts()
 
     if search_form.is_valid():
         cd = search_form.cleaned_data
@@ -62,6 +62,8 @@ def do_search(request, rows=20, order_by=None, type=None, facet=True):
         elif cd['type'] == 'p':
             si = ExtraSolrInterface(settings.SOLR_PEOPLE_URL, mode='r')
             results = si.query().add_extra(**build_main_query(cd, facet=facet))
+        if cache_results:
+            results = results.cache_results()
 
         # Set up pagination
         try:
@@ -91,8 +93,8 @@ def do_search(request, rows=20, order_by=None, type=None, facet=True):
     else:
         error = True
 
-    courts, court_count_human, court_count = merge_form_with_courts(courts,
-                                                                    search_form)
+    courts, court_count_human, court_count = merge_form_with_courts(
+        search_form)
     return {
         'results': paged_results,
         'search_form': search_form,
@@ -105,82 +107,6 @@ def do_search(request, rows=20, order_by=None, type=None, facet=True):
     }
 
 
-def get_homepage_stats():
-    """Get any stats that are displayed on the homepage and return them as a
-    dict
-    """
-    ten_days_ago = make_aware(datetime.today() - timedelta(days=10), utc)
-    alerts_in_last_ten = Stat.objects.filter(
-        name__contains='alerts.sent',
-        date_logged__gte=ten_days_ago
-    ).aggregate(Sum('count'))['count__sum']
-    queries_in_last_ten = Stat.objects.filter(
-        name='search.results',
-        date_logged__gte=ten_days_ago
-    ).aggregate(Sum('count'))['count__sum']
-    bulk_in_last_ten = Stat.objects.filter(
-        name__contains='bulk_data',
-        date_logged__gte=ten_days_ago
-    ).aggregate(Sum('count'))['count__sum']
-    r = redis.StrictRedis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        db=settings.REDIS_DATABASES['STATS'],
-    )
-    last_ten_days = ['api:v3.d:%s.count' %
-                     (date.today() - timedelta(days=x)).isoformat()
-                     for x in range(0, 10)]
-    api_in_last_ten = sum(
-        [int(result) for result in
-         r.mget(*last_ten_days) if result is not None]
-    )
-    users_in_last_ten = User.objects.filter(
-        date_joined__gte=ten_days_ago
-    ).count()
-    opinions_in_last_ten = Opinion.objects.filter(
-        date_created__gte=ten_days_ago
-    ).count()
-    oral_arguments_in_last_ten = Audio.objects.filter(
-        date_created__gte=ten_days_ago
-    ).count()
-    days_of_oa = naturalduration(
-        Audio.objects.aggregate(
-            Sum('duration')
-        )['duration__sum'],
-        as_dict=True,
-    )['d']
-    viz_in_last_ten = SCOTUSMap.objects.filter(
-        date_published__gte=ten_days_ago,
-        published=True,
-    ).count()
-    visualizations = SCOTUSMap.objects.filter(
-        published=True,
-        deleted=False,
-    ).annotate(
-        Count('clusters'),
-    ).filter(
-        # Ensures that we only show good stuff on homepage
-        clusters__count__gt=10,
-    ).order_by(
-        '-date_published',
-        '-date_modified',
-        '-date_created',
-    )[:1]
-    return {
-        'alerts_in_last_ten': alerts_in_last_ten,
-        'queries_in_last_ten': queries_in_last_ten,
-        'opinions_in_last_ten': opinions_in_last_ten,
-        'oral_arguments_in_last_ten': oral_arguments_in_last_ten,
-        'bulk_in_last_ten': bulk_in_last_ten,
-        'api_in_last_ten': api_in_last_ten,
-        'users_in_last_ten': users_in_last_ten,
-        'days_of_oa': days_of_oa,
-        'viz_in_last_ten': viz_in_last_ten,
-        'visualizations': visualizations,
-        'private': False,  # VERY IMPORTANT!
-    }
-
-
 @never_cache
 def show_results(request):
     """
@@ -260,16 +186,20 @@ def show_results(request):
             # "Latest Cases" section
             render_dict.update(do_search(request, rows=5,
                                          order_by='dateFiled desc',
-                                         facet=False))
+                                         facet=False, cache_results=True))
             # Get the results from the oral arguments as well
             oa_dict = do_search(request, rows=5, order_by='dateArgued desc',
-                                type='oa', facet=False)
+                                type='oa', facet=False, cache_results=True)
             render_dict.update({'results_oa': oa_dict['results']})
             # But give it a fresh form for the advanced search section
             render_dict.update({'search_form': SearchForm(request.GET)})
 
-            # Get a bunch of stats.
-            render_dict.update(get_homepage_stats())
+            # Get a bunch of stats. These are kept up to date by a periodic
+            # task, so only compute them here if it hasn't run yet.
+            stats = cache.get(HOMEPAGE_STATS_CACHE_KEY)
+            if stats is None:
+                stats = cache_homepage_stats()
+            render_dict.update(stats)
 
             return render(request, 'homepage.html', render_dict)
         else:
@@ -305,7 +235,10 @@ def show_results(request):
                              'rate': "dly"},
                     user=request.user
                 )
-            render_dict.update(do_search(request))
+            render_dict.update(do_search(
+                request,
+                cache_results=request.user.is_anonymous(),
+            ))
             render_dict.update({'alert_form': alert_form})
             return render(request, 'search.html', render_dict)
 
@@ -331,10 +264,9 @@ def advanced(request):
         else:
             raise NotImplementedError("Unknown path: %s" % request.path)
 
-        courts = Court.objects.filter(in_use=True)
         search_form = SearchForm({'type': obj_type})
         courts, court_count_human, court_count = merge_form_with_courts(
-            courts, search_form)
+            search_form)
         render_dict.update({
             'search_form': search_form,
             'courts': courts,
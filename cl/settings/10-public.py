@@ -199,6 +199,14 @@ else:
 CELERY_DISABLE_RATE_LIMITS = True
 CELERY_SEND_TASK_ERROR_EMAILS = True
 
+# Periodic tasks, run by celerybeat.
+CELERYBEAT_SCHEDULE = {
+    'cache-homepage-stats': {
+        'task': 'cl.search.tasks.cache_homepage_stats',
+        'schedule': datetime.timedelta(minutes=10),
+    },
+}
+
 
 ####################
 # Cache & Sessions #
@@ -243,6 +251,7 @@ STATIC_ROOT = os.path.join(INSTALL_ROOT, 'cl/assets/static/')
 
 # Where should the bulk data be stored?
 BULK_DATA_DIR = os.path.join(INSTALL_ROOT, 'cl/assets/media/bulk-data/')
+SITEMAP_DIR = os.path.join(INSTALL_ROOT, 'cl/assets/media/sitemaps/')
 
 
 #####################
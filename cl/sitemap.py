@@ -1,14 +1,68 @@
+import glob
+import gzip
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import islice
+
 from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, \
+    HttpResponsePermanentRedirect
 from django.template import loader
 from django.utils.encoding import smart_str
+from django.utils.timezone import utc
 from django.views.decorators.cache import never_cache
 
 from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.utils import mkdir_p
+
+logger = logging.getLogger(__name__)
 
 items_per_sitemap = 250
 
+# Pre-generated sitemaps. Each is split into shards by the year of its date
+# field, and each year into files of up to this many URLs.
+items_per_sitemap_shard = 10000
+SITEMAP_FIRST_YEAR = 1600
+SOLR_SITEMAPS = OrderedDict([
+    ('opinions', {
+        'solr_url': 'SOLR_OPINION_URL',
+        'date_field': 'dateFiled',
+        'changefreq': 'monthly',
+        'low_priority_pages': ['pdf', 'doc', 'wpd'],
+        'url_field': 'absolute_url',
+        'group_field': None,
+    }),
+    ('recap', {
+        'solr_url': 'SOLR_RECAP_URL',
+        'date_field': 'dateFiled',
+        'changefreq': 'weekly',
+        'low_priority_pages': [],
+        'url_field': 'docket_absolute_url',
+        'group_field': 'docket_id',
+    }),
+    ('oral-arguments', {
+        'solr_url': 'SOLR_AUDIO_URL',
+        'date_field': 'dateArgued',
+        'changefreq': 'monthly',
+        'low_priority_pages': ['mp3'],
+        'url_field': 'absolute_url',
+        'group_field': None,
+    }),
+    ('people', {
+        'solr_url': 'SOLR_PEOPLE_URL',
+        'date_field': 'dob',
+        'changefreq': 'monthly',
+        'low_priority_pages': [],
+        'url_field': 'absolute_url',
+        'group_field': None,
+    }),
+])
+SITEMAP_INDEX_NAME = 'sitemap.xml'
+
 
 def make_index_params(group):
     params = {
@@ -63,32 +117,48 @@ def normalize_grouping(result):
         return result
 
 
+def make_sitemap_urls(result, changefreq, low_priority_pages, url_field):
+    """Make the sitemap entries for a result from Solr.
+
+    :return: A list of dicts for the sitemap.xml template. Items with a local
+    file get a second entry for the file.
+    """
+    urls = []
+    cl = 'https://www.courtlistener.com'
+    url_strs = ['%s%s' % (cl, result[url_field])]
+    if result.get('local_path') and \
+            not result['local_path'].endswith('.xml'):
+        url_strs.append('%s/%s' % (cl, result['local_path']))
+
+    item = {}
+    for url_str in url_strs:
+        item['location'] = url_str
+        item['changefreq'] = changefreq
+        item['lastmod'] = result['timestamp']
+        if any(s in url_str for s in low_priority_pages):
+            item['priority'] = '0.3'
+        else:
+            item['priority'] = '0.5'
+        urls.append(item.copy())
+    return urls
+
+
 def make_solr_sitemap(request, solr_url, params, changefreq, low_priority_pages,
                       url_field):
+    if os.path.isfile(os.path.join(settings.SITEMAP_DIR, SITEMAP_INDEX_NAME)):
+        # The sitemaps have been pre-generated, and the index doesn't link
+        # here anymore. Send crawlers with old links to it.
+        return HttpResponsePermanentRedirect('/sitemap.xml')
     solr = ExtraSolrInterface(solr_url)
     page = int(request.GET.get('p', 1))
     params['start'] = (page - 1) * items_per_sitemap
     results = solr.query().add_extra(**params).execute()
 
     urls = []
-    cl = 'https://www.courtlistener.com'
     for result in results:
         result = normalize_grouping(result)
-        url_strs = ['%s%s' % (cl, result[url_field])]
-        if result.get('local_path') and \
-                not result['local_path'].endswith('.xml'):
-            url_strs.append('%s/%s' % (cl, result['local_path']))
-
-        item = {}
-        for url_str in url_strs:
-            item['location'] = url_str
-            item['changefreq'] = changefreq
-            item['lastmod'] = result['timestamp']
-            if any(s in url_str for s in low_priority_pages):
-                item['priority'] = '0.3'
-            else:
-                item['priority'] = '0.5'
-            urls.append(item.copy())
+        urls.extend(make_sitemap_urls(result, changefreq, low_priority_pages,
+                                      url_field))
 
     xml = smart_str(loader.render_to_string('sitemap.xml', {'urlset': urls}))
     response = HttpResponse(xml, content_type='application/xml')
@@ -102,7 +172,17 @@ def index_sitemap_maker(request):
 
     Counts the number of cases in the site, divides by `items_per_sitemap` and
     provides links items.
+
+    If the sitemaps have been pre-generated by cl_make_sitemaps, their index
+    is served instead.
     """
+    index_path = os.path.join(settings.SITEMAP_DIR, SITEMAP_INDEX_NAME)
+    if os.path.isfile(index_path):
+        response = FileResponse(open(index_path, 'rb'),
+                                content_type='application/xml')
+        response['X-Robots-Tag'] = 'noindex, noodp, noarchive, noimageindex'
+        return response
+
     connection_string_sitemap_path_pairs = (
         (settings.SOLR_OPINION_URL, reverse('opinion_sitemap'), False),
         (settings.SOLR_RECAP_URL, reverse('recap_sitemap'), True),
@@ -130,3 +210,216 @@ def index_sitemap_maker(request):
     response = HttpResponse(xml, content_type='application/xml')
     response['X-Robots-Tag'] = 'noindex, noodp, noarchive, noimageindex'
     return response
+
+
+def sitemap_shard(request, file_name):
+    """Serve a pre-generated sitemap shard."""
+    path = os.path.join(settings.SITEMAP_DIR, os.path.basename(file_name))
+    if not os.path.isfile(path):
+        raise Http404("No such sitemap.")
+    response = FileResponse(open(path, 'rb'),
+                            content_type='application/x-gzip')
+    response['X-Robots-Tag'] = 'noindex, noodp, noarchive, noimageindex'
+    return response
+
+
+def get_sitemap_end_year():
+    """Get the year after the last one that gets its own sitemap shards.
+    Items dated in it or later go in the 'after' shards.
+    """
+    return datetime.utcnow().year + 1
+
+
+def get_sitemap_years(conn, date_field, since=None):
+    """Get the years that have items in a core.
+
+    :param conn: An ExtraSolrInterface for the core.
+    :param date_field: The date field to split the items by.
+    :param since: If provided, only get the years that have items indexed
+    after this datetime.
+    :return: A list of years. Items outside the years that get their own
+    shards are covered by 'before' and 'after', and the ones without a date
+    by 'undated'.
+    """
+    missing_query = '-%s:[* TO *]' % date_field
+    params = {
+        'q': '*',
+        'rows': 0,
+        'facet': 'true',
+        'facet.range': date_field,
+        'facet.range.start': '%s-01-01T00:00:00Z' % SITEMAP_FIRST_YEAR,
+        'facet.range.end': '%s-01-01T00:00:00Z' % get_sitemap_end_year(),
+        'facet.range.gap': '+1YEAR',
+        # Count the items outside the range too, bad dates and all.
+        'facet.range.other': ['before', 'after'],
+        'facet.range.include': ['lower', 'outer'],
+        'facet.mincount': 1,
+        'facet.query': missing_query,
+        'caller': 'sitemap_build',
+    }
+    if since is not None:
+        params['fq'] = ['timestamp:[%s TO *]' %
+                        since.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ')]
+    r = conn.query().add_extra(**params).execute()
+    facet_counts = r.facet_counts
+    facet_range = facet_counts.facet_ranges[date_field]
+    years = [int(date[:4]) for date, count in facet_range['counts'] if count]
+    for other in ['before', 'after']:
+        if facet_range.get(other):
+            years.append(other)
+    if facet_counts.facet_queries.get(missing_query):
+        years.append('undated')
+    return years
+
+
+def iter_sitemap_urls(conn, sitemap, year):
+    """Walk every item in a year of a core with a cursor, and yield the
+    sitemap entries for them.
+
+    Unlike paging with start, every request costs the same, no matter how
+    far in the walk is.
+
+    :param conn: An ExtraSolrInterface for the core.
+    :param sitemap: A dict from SOLR_SITEMAPS.
+    :param year: The year to walk, or one of the other values from
+    get_sitemap_years.
+    """
+    date_field = sitemap['date_field']
+    if year == 'undated':
+        fq = '-%s:[* TO *]' % date_field
+    elif year == 'before':
+        fq = '%s:[* TO %s-01-01T00:00:00Z}' % (date_field, SITEMAP_FIRST_YEAR)
+    elif year == 'after':
+        fq = '%s:[%s-01-01T00:00:00Z TO *]' % (date_field,
+                                               get_sitemap_end_year())
+    else:
+        fq = '%s:[%s-01-01T00:00:00Z TO %s-01-01T00:00:00Z}' % (
+            date_field, year, year + 1)
+    fields = ['id', 'absolute_url', 'docket_absolute_url', 'local_path',
+              'timestamp']
+    sort = 'id asc'
+    group_field = sitemap['group_field']
+    if group_field:
+        # Sorting by the group means each group's items are together, so
+        # only the first of each needs to be kept.
+        fields.append(group_field)
+        sort = '%s asc,%s' % (group_field, sort)
+    params = {
+        'q': '*',
+        'fq': [fq],
+        'fl': ','.join(fields),
+        'sort': sort,
+        'rows': 1000,
+        'caller': 'sitemap_build',
+    }
+
+    cursor = '*'
+    last_group = None
+    while True:
+        params['cursorMark'] = cursor
+        r = conn.query().add_extra(**params).execute()
+        for result in r:
+            if group_field:
+                if result.get(group_field) == last_group:
+                    continue
+                last_group = result.get(group_field)
+            for url in make_sitemap_urls(result, sitemap['changefreq'],
+                                         sitemap['low_priority_pages'],
+                                         sitemap['url_field']):
+                yield url
+        if r.next_cursor_mark in (None, cursor):
+            break
+        cursor = r.next_cursor_mark
+
+
+def write_sitemap_shards(directory, prefix, urls):
+    """Write sitemap entries to gzipped sitemap files.
+
+    Files are written atomically, and files left over from a bigger earlier
+    build of the same shard are removed.
+
+    :param directory: Where to write the files.
+    :param prefix: The start of the file names, like 'sitemap-opinions-1990'.
+    :param urls: An iterable of sitemap entries.
+    :return: The number of files written.
+    """
+    urls = iter(urls)
+    count = 0
+    while True:
+        chunk = list(islice(urls, items_per_sitemap_shard))
+        if not chunk and count > 0:
+            break
+        count += 1
+        path = os.path.join(directory, '%s-%s.xml.gz' % (prefix, count))
+        with gzip.open(path + '.tmp', 'wb') as f:
+            f.write(smart_str(loader.render_to_string('sitemap.xml',
+                                                      {'urlset': chunk})))
+        os.rename(path + '.tmp', path)
+        if not chunk:
+            break
+
+    for path in glob.glob(os.path.join(directory, '%s-*.xml.gz' % prefix)):
+        number = re.search(r'-(\d+)\.xml\.gz$', path)
+        if number and int(number.group(1)) > count:
+            os.remove(path)
+    return count
+
+
+def write_sitemap_index(directory):
+    """Write the sitemap index for the shards in a directory."""
+    cl = 'https://www.courtlistener.com'
+    sites = ['%s%s' % (cl, reverse('sitemap_shard', args=[
+        os.path.basename(path)])) for path in
+        sorted(glob.glob(os.path.join(directory, 'sitemap-*.xml.gz')))]
+
+    # Random additional sitemaps.
+    sites.extend([
+        '%s%s' % (cl, reverse('simple_pages_sitemap')),
+        '%s/sitemap-visualizations.xml' % cl,
+    ])
+
+    path = os.path.join(directory, SITEMAP_INDEX_NAME)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(smart_str(loader.render_to_string('sitemap_index.xml',
+                                                  {'sitemaps': sites})))
+    os.rename(path + '.tmp', path)
+
+
+def build_sitemaps(names=None, full=False, directory=None):
+    """Pre-generate the sitemaps for the Solr cores.
+
+    Unless a full build is requested, only the years with items that were
+    indexed since the last build are regenerated.
+
+    :param names: The sitemaps to build, from SOLR_SITEMAPS. Defaults to all
+    of them.
+    :param full: Whether to rebuild every year, even unchanged ones.
+    :param directory: Where to write the sitemaps. Defaults to
+    settings.SITEMAP_DIR.
+    """
+    directory = directory or settings.SITEMAP_DIR
+    mkdir_p(directory)
+    index_path = os.path.join(directory, SITEMAP_INDEX_NAME)
+    since = None
+    if not full and os.path.isfile(index_path):
+        # Leave plenty of room for items that were committed late.
+        since = datetime.fromtimestamp(os.path.getmtime(index_path),
+                                       tz=utc) - timedelta(hours=1)
+
+    for name in names or SOLR_SITEMAPS.keys():
+        sitemap = SOLR_SITEMAPS[name]
+        conn = ExtraSolrInterface(getattr(settings, sitemap['solr_url']),
+                                  mode='r')
+        years = get_sitemap_years(conn, sitemap['date_field'], since)
+        logger.info("Building %s years of the %s sitemap." %
+                    (len(years), name))
+        for year in years:
+            count = write_sitemap_shards(
+                directory,
+                'sitemap-%s-%s' % (name, year),
+                iter_sitemap_urls(conn, sitemap, year),
+            )
+            logger.info("Wrote %s files for %s in the %s sitemap." %
+                        (count, year, name))
+
+    write_sitemap_index(directory)
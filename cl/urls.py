@@ -1,7 +1,7 @@
 from django.conf.urls import include, url
 from django.contrib import admin
 from django.views.generic import RedirectView
-from cl.sitemap import index_sitemap_maker
+from cl.sitemap import index_sitemap_maker, sitemap_shard
 
 urlpatterns = [
     # Admin docs and site
@@ -22,6 +22,8 @@ urlpatterns = [
 
     # Sitemaps
     url(r'^sitemap\.xml$', index_sitemap_maker),
+    url(r'^sitemaps/(?P<file_name>sitemap-[\w-]+\.xml\.gz)$', sitemap_shard,
+        name='sitemap_shard'),
 
     # Redirects
     url(r'^privacy/$', RedirectView.as_view(